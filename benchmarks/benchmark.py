@@ -0,0 +1,309 @@
+"""
+.. module:: benchmark
+    :platform: any
+    :synopsis: Throughput and memory benchmarks of the file generators
+.. moduleauthor:: AGR consortium
+
+Runs every generator on fixed-size synthetic records, without a database,
+and reports rows/sec, output bytes/sec and peak RSS. Each benchmark runs in
+its own process so that peak RSS is per generator. The records are generated
+as the generator iterates over them, so that they do not count towards peak
+RSS, and the time taken to generate them is left out of the rates. Run it
+from the repository root::
+
+    python3 benchmarks/benchmark.py run --output results.json
+    python3 benchmarks/benchmark.py compare benchmarks/baseline.json results.json
+
+and refresh the baseline with ``run --output benchmarks/baseline.json``.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from common import ContextInfo, SPECIES_QUERY  # noqa: E402
+from json_codec import json_codec  # noqa: E402
+from query_recording import query_recorder, write_recording  # noqa: E402
+from synthetic_data import SyntheticDataSource  # noqa: E402
+from generators import (allele_gff_file_generator,  # noqa: E402
+                        db_summary_file_generator,
+                        disease_file_generator,
+                        expression_file_generator,
+                        gene_cross_reference_file_generator,
+                        human_genes_interacting_with_file_generator,
+                        orthology_file_generator,
+                        uniprot_cross_reference_generator,
+                        vcf_file_generator)
+
+logger = logging.getLogger(name=__name__)
+
+RESULTS_FILE = 'results.json'
+RELEASE_VERSION = 'benchmark'
+
+taxon_id_fms_subtype_map = {"NCBITaxon:10116": "RGD",
+                            "NCBITaxon:9606": "HUMAN",
+                            "NCBITaxon:7227": "FB",
+                            "NCBITaxon:6239": "WB",
+                            "NCBITaxon:7955": "ZFIN",
+                            "NCBITaxon:10090": "MGI",
+                            "NCBITaxon:559292": "SGD"}
+
+
+def _vcf(records, output_dir, config_info):
+    vcf_file_generator.VcfFileGenerator(records, output_dir, config_info).generate_files()
+
+
+def _orthology(records, output_dir, config_info):
+    orthology_file_generator.OrthologyFileGenerator(records, output_dir, config_info).generate_file()
+
+
+def _disease(records, output_dir, config_info):
+    disease_file_generator.DiseaseFileGenerator(records, output_dir, config_info, taxon_id_fms_subtype_map).generate_file()
+
+
+def _expression(records, output_dir, config_info):
+    expression_file_generator.ExpressionFileGenerator(records, output_dir, config_info, taxon_id_fms_subtype_map).generate_file()
+
+
+def _db_summary(records, output_dir, config_info):
+    db_summary_file_generator.DbSummaryFileGenerator(records, output_dir, config_info).generate_file()
+
+
+def _gene_cross_reference(records, output_dir, config_info):
+    gene_cross_reference_file_generator.GeneCrossReferenceFileGenerator(records, output_dir, config_info).generate_file()
+
+
+def _uniprot(records, output_dir, config_info):
+    uniprot_cross_reference_generator.UniProtGenerator(records, config_info, output_dir).generate_file()
+
+
+def _human_genes_interacting_with(records, output_dir, config_info):
+    human_genes_interacting_with_file_generator.HumanGenesInteractingWithFileGenerator(records, config_info, output_dir).generate_file()
+
+
+def _allele_gff(records, output_dir, config_info):
+    allele_gff_file_generator.AlleleGffFileGenerator('GRCz11', records, output_dir, config_info).generate_assembly_file()
+
+
+# name: (generator, synthetic record kind, sizes scaled by --scale, fixed options, requirements)
+# Requirements are executables that have to be on the PATH, or 'network'
+# for generators whose header looks the assembly up online.
+BENCHMARKS = OrderedDict([
+    ('vcf', (_vcf, 'variants', {'variants_per_chromosome': 2000}, {'chromosomes': 25}, ())),
+    ('orthology', (_orthology, 'orthology', {'orthologs': 50000}, {}, ())),
+    ('disease', (_disease, 'disease', {'associations': 20000}, {}, ())),
+    ('expression', (_expression, 'expression', {'expressions': 20000}, {}, ())),
+    ('db-summary', (_db_summary, 'db-summary', {'labels': 1000}, {}, ())),
+    ('gene-cross-reference', (_gene_cross_reference, 'gene-cross-reference', {'cross_references': 100000}, {}, ())),
+    ('uniprot', (_uniprot, 'uniprot', {'cross_references': 100000}, {}, ())),
+    ('human-genes-interacting-with', (_human_genes_interacting_with, 'human-genes-interacting-with', {'genes': 5000}, {}, ())),
+    ('allele-gff', (_allele_gff, 'allele-gff', {'alleles': 10000}, {'assembly': 'GRCz11'}, ('network',))),
+])
+
+# metric: True when higher is better
+METRICS = OrderedDict([('rowsPerSec', True),
+                       ('outputBytesPerSec', True),
+                       ('peakRssMb', False)])
+
+
+def missing_requirements(name, network=False):
+    missing = []
+    for requirement in BENCHMARKS[name][4]:
+        if requirement == 'network':
+            if not network:
+                missing.append(requirement)
+        elif shutil.which(requirement) is None:
+            missing.append(requirement)
+    return missing
+
+
+def _output_bytes(output_dir):
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(output_dir):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+class LazyRecords:
+    """Iterates over a data source as a generator consumes it, counting the
+    records of a pass and the time spent generating them.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.rows = 0
+        self.input_seconds = 0.0
+
+    def __iter__(self):
+        rows = 0
+        records = iter(self.source)
+        while True:
+            started = time.perf_counter()
+            record = next(records, None)
+            self.input_seconds += time.perf_counter() - started
+            if record is None:
+                break
+            rows += 1
+            yield record
+        self.rows = max(self.rows, rows)
+
+
+def _measure(name, scale, replay_dir, queue):
+    (generate, kind, sizes, options, requirements) = BENCHMARKS[name]
+    options = dict(options)
+    for (option, size) in sizes.items():
+        options[option] = max(1, int(size * scale))
+
+    config_info = ContextInfo()
+    config_info.config['RELEASE_VERSION'] = RELEASE_VERSION
+    query_recorder.configure(replay_directory=replay_dir)
+    json_codec.configure(config_info.config['JSON_BACKEND'])
+
+    output_dir = tempfile.mkdtemp(prefix='agr-benchmark-')
+    try:
+        records = LazyRecords(SyntheticDataSource(kind, seed=0, **options))
+        started = time.perf_counter()
+        generate(records, output_dir, config_info)
+        elapsed = time.perf_counter() - started - records.input_seconds
+        output_bytes = _output_bytes(output_dir)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_rss /= 1024
+        queue.put(OrderedDict([('rows', records.rows),
+                               ('seconds', round(elapsed, 3)),
+                               ('rowsPerSec', round(records.rows / elapsed, 1)),
+                               ('outputBytes', output_bytes),
+                               ('outputBytesPerSec', round(output_bytes / elapsed, 1)),
+                               ('peakRssMb', round(peak_rss / 1024, 1))]))
+    except BaseException as e:
+        queue.put({'error': '{}: {}'.format(e.__class__.__name__, e)})
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def run_benchmark(name, scale, replay_dir):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(name, scale, replay_dir, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def write_species_recording(replay_dir):
+    """Records the synthetic species so headers can be built without a database."""
+    path = os.path.join(replay_dir, query_recorder.filename('species', SPECIES_QUERY, {}))
+    for record in write_recording(path, SyntheticDataSource('species')):
+        pass
+
+
+def compare_results(baseline, results, threshold):
+    """Returns (name, metric, baseline value, new value, change) for every regression beyond the threshold."""
+    regressions = []
+    for (name, result) in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None or 'error' in base or 'error' in result:
+            continue
+        for (metric, higher_is_better) in METRICS.items():
+            if not base[metric]:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append((name, metric, base[metric], result[metric], change))
+    return regressions
+
+
+@click.group()
+def cli():
+    logging.basicConfig(level=logging.WARNING)
+
+
+@cli.command()
+@click.option('--output', type=click.Path(dir_okay=False), default=RESULTS_FILE, show_default=True,
+              help='JSON file to write the results to, benchmarks/baseline.json to refresh the baseline')
+@click.option('--scale', type=float, default=1.0, show_default=True, help='Multiplies the number of input records')
+@click.option('--repeat', type=int, default=3, show_default=True, help='Runs per benchmark, the fastest is kept')
+@click.option('--network', is_flag=True, help='Also runs benchmarks that need network access')
+@click.argument('names', nargs=-1, type=click.Choice(list(BENCHMARKS)))
+def run(output, scale, repeat, network, names):
+    """Runs the benchmarks, all of them unless NAMES are given."""
+    results = OrderedDict([('scale', scale),
+                           ('python', sys.version.split()[0]),
+                           ('benchmarks', OrderedDict())])
+    replay_dir = tempfile.mkdtemp(prefix='agr-benchmark-replay-')
+    try:
+        write_species_recording(replay_dir)
+        for name in names or BENCHMARKS:
+            missing = missing_requirements(name, network)
+            if missing:
+                click.echo('{:<30} skipped, requires {}'.format(name, ', '.join(missing)))
+                continue
+            best = None
+            for _ in range(repeat):
+                result = run_benchmark(name, scale, replay_dir)
+                if 'error' in result:
+                    best = result
+                    break
+                if best is None or result['seconds'] < best['seconds']:
+                    best = result
+            results['benchmarks'][name] = best
+            if 'error' in best:
+                click.echo('{:<30} failed: {}'.format(name, best['error']))
+            else:
+                click.echo('{:<30} {:>12,.0f} rows/s {:>14,.0f} bytes/s {:>8.1f} MB peak RSS'.format(
+                    name, best['rowsPerSec'], best['outputBytesPerSec'], best['peakRssMb']))
+    finally:
+        shutil.rmtree(replay_dir, ignore_errors=True)
+
+    with open(output, 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+        outfile.write('\n')
+    click.echo('Results written to ' + output)
+
+
+@cli.command()
+@click.argument('baseline_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('results_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', type=float, default=0.1, show_default=True,
+              help='Relative change counted as a regression')
+def compare(baseline_file, results_file, threshold):
+    """Compares results against a baseline, exiting non-zero on regressions."""
+    with open(baseline_file) as infile:
+        baseline = json.load(infile)
+    with open(results_file) as infile:
+        results = json.load(infile)
+
+    if baseline.get('scale') != results.get('scale'):
+        click.echo('Warning: baseline scale {} differs from results scale {}'.format(baseline.get('scale'), results.get('scale')))
+
+    for (name, result) in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None or 'error' in base or 'error' in result:
+            continue
+        changes = ['{} {:+.1%}'.format(metric, (result[metric] - base[metric]) / base[metric])
+                   for metric in METRICS if base[metric]]
+        click.echo('{:<30} {}'.format(name, '  '.join(changes)))
+
+    regressions = compare_results(baseline, results, threshold)
+    for (name, metric, before, after, change) in regressions:
+        click.echo('REGRESSION {} {}: {} -> {} ({:+.1%})'.format(name, metric, before, after, change))
+    if regressions:
+        exit(1)
+    click.echo('No regressions beyond {:.0%}'.format(threshold))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,220 @@
+"""
+.. module:: vcf_encoding
+    :platform: any
+    :synopsis: Benchmark of VCF line encoding against the implementation it replaced
+.. moduleauthor:: AGR consortium
+
+Times the IUPAC ALT encoding and the formatting of VCF data lines, legacy
+versus current, on synthetic variants and checks that both produce the
+same lines. Run it from the repository root::
+
+    python3 benchmarks/vcf_encoding.py --variants 1000000
+"""
+
+import os
+import sys
+import time
+from collections import OrderedDict
+from itertools import islice
+
+import click
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic_data import SyntheticDataSource  # noqa: E402
+from generators.vcf_file_generator import IUPAC_TO_VCF_ALT, VcfVariant  # noqa: E402
+
+CHUNK_SIZE = 10000
+
+
+def legacy_find_replace(string, iupac_codes={"R", "Y", "S", "W", "K", "M", "B", "D", "H", "V"}):
+    for item in string:
+        if item in iupac_codes:
+            string = string.replace(item, "<" + item + ">")
+    return string
+
+
+def legacy_value_for_file(variant, data_key, transform=None):
+    value = variant.get(data_key)
+    if value is None:
+        return None
+    if transform is None:
+        return value
+    return transform(value)
+
+
+def legacy_format_variant(variant):
+    info_map = OrderedDict()
+    info_map['hgvs_nomenclature'] = legacy_value_for_file(variant, 'hgvsNomenclature')
+
+    variant['geneLevelConsequence'] = []
+    variant['transcriptLevelConsequence'] = []
+    variant['geneImpact'] = []
+    variant['transcriptImpact'] = []
+    variant['geneSymbols'] = []
+    variant['transcriptGFF3IDs'] = []
+    variant['transcriptGFF3Names'] = []
+    variant['geneIDs'] = []
+    variant['transcriptIDs'] = []
+    for geneConsequence in variant['geneConsequences']:
+        if geneConsequence['consequence'] is not None:
+            variant['geneLevelConsequence'].append(geneConsequence['consequence'].replace(",", "|"))
+        else:
+            variant['geneLevelConsequence'].append('')
+        if geneConsequence['impact'] is not None:
+            variant['geneImpact'].append(geneConsequence['impact'])
+        else:
+            variant['geneImpact'].append('')
+        if geneConsequence['gene'] is not None:
+            variant['geneIDs'].append(geneConsequence['gene'])
+            variant['geneSymbols'].append(geneConsequence['geneSymbol'])
+        else:
+            variant['geneSymbols'].append('')
+
+    for transcriptConsequence in variant['transcriptConsequences']:
+        if transcriptConsequence['consequence'] is not None:
+            variant['transcriptLevelConsequence'].append(transcriptConsequence['consequence'].replace(",", "|"))
+        else:
+            variant['transcriptLevelConsequence'].append('')
+        if transcriptConsequence['impact'] is not None:
+            variant['transcriptImpact'].append(transcriptConsequence['impact'])
+        else:
+            variant['transcriptImpact'].append('')
+        if transcriptConsequence['transcript'] is not None:
+            variant['transcriptIDs'].append(transcriptConsequence['transcript'])
+            if transcriptConsequence['transcriptGFF3ID']:
+                variant['transcriptGFF3IDs'].append(transcriptConsequence['transcriptGFF3ID'])
+            else:
+                variant['transcriptGFF3IDs'].append('')
+            if transcriptConsequence['transcriptGFF3Name']:
+                variant['transcriptGFF3Names'].append(transcriptConsequence['transcriptGFF3Name'])
+            else:
+                variant['transcriptGFF3Names'].append('')
+        else:
+            variant['transcriptGFF3IDs'].append('')
+            variant['transcriptGFF3Names'].append('')
+    if legacy_value_for_file(variant, 'geneLevelConsequence') is not None:
+        info_map['geneLevelConsequence'] = ','.join(legacy_value_for_file(variant, 'geneLevelConsequence'))
+    else:
+        info_map['geneLevelConsequence'] = legacy_value_for_file(variant, 'geneLevelConsequence')
+
+    if legacy_value_for_file(variant, 'transcriptLevelConsequence') is not None:
+        info_map['transcriptLevelConsequence'] = ','.join(legacy_value_for_file(variant, 'transcriptLevelConsequence'))
+    else:
+        info_map['transcriptLevelConsequence'] = legacy_value_for_file(variant, 'transcriptLevelConsequence')
+
+    if legacy_value_for_file(variant, 'geneLevelConsequence') is not None:
+        info_map['geneImpact'] = ','.join(legacy_value_for_file(variant, 'geneImpact'))
+    else:
+        info_map['geneImpact'] = legacy_value_for_file(variant, 'geneImpact')
+
+    if legacy_value_for_file(variant, 'geneLevelConsequence') is not None:
+        info_map['transcriptImpact'] = ','.join(legacy_value_for_file(variant, 'transcriptImpact'))
+    else:
+        info_map['transcriptImpact'] = legacy_value_for_file(variant, 'transcriptImpact')
+
+    for allele in variant['alleles']:
+        if 'allele_ids' in variant:
+            variant['allele_ids'].append(allele['id'])
+        else:
+            variant['allele_ids'] = [allele['id']]
+        allele_symbol = allele['symbol']
+        allele_symbol_text = allele['symbolText']
+        if 'alleleSymbols' in variant:
+            variant['alleleSymbols'].append(allele_symbol)
+        else:
+            variant['alleleSymbols'] = [allele_symbol]
+        if 'alleleSymbolText' in variant:
+            variant['alleleSymbolText'].append(allele_symbol_text)
+        else:
+            variant['alleleSymbolText'] = [allele_symbol_text]
+
+    info_map['allele_ids'] = legacy_value_for_file(variant, 'allele_ids', transform=','.join)
+    info_map['allele_symbols'] = legacy_value_for_file(variant, 'alleleSymbols', transform=','.join)
+    info_map['allele_symbols_text'] = legacy_value_for_file(variant, 'alleleSymbolText', transform=','.join)
+    info_map['soTerm'] = legacy_value_for_file(variant, 'soTerm')
+    info_map['globalId'] = variant['globalId']
+
+    if variant['geneIDs']:
+        info_map['allele_of_gene_ids'] = legacy_value_for_file(variant, 'geneIDs', transform=','.join)
+        info_map['allele_of_gene_symbols'] = legacy_value_for_file(variant, 'geneSymbols', transform=','.join)
+
+    if variant['transcriptIDs']:
+        info_map['allele_of_transcript_ids'] = legacy_value_for_file(variant, 'transcriptIDs', transform=','.join)
+        info_map['allele_of_transcript_gff3_ids'] = legacy_value_for_file(variant, 'transcriptGFF3IDs', transform=','.join)
+        info_map['allele_of_transcript_gff3_names'] = legacy_value_for_file(variant, 'transcriptGFF3Names', transform=','.join)
+
+    if any(info_map.values()):
+        info = ';'.join('{}="{}"'.format(k, v)
+                        for (k, v) in info_map.items()
+                        if v)
+    else:
+        info = '.'
+    return '\t'.join([variant['chromosome'],
+                      str(variant['POS']),
+                      info_map['hgvs_nomenclature'],
+                      variant['genomicReferenceSequence'],
+                      variant['genomicVariantSequence'],
+                      '.',
+                      '.',
+                      info]) + '\n'
+
+
+def _chunks(variants):
+    rows = iter(SyntheticDataSource('variants', seed=0, chromosomes=25,
+                                    variants_per_chromosome=max(1, variants // 25)))
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        for row in chunk:
+            row['POS'] = row['start']
+        yield chunk
+
+
+@click.command()
+@click.option('--variants', type=int, default=1000000, show_default=True, help='Number of variants to encode')
+def main(variants):
+    """Compares legacy and current VCF line encoding."""
+    timings = OrderedDict((name, 0.0) for name in ('legacy ALT', 'current ALT', 'legacy line', 'current line'))
+    (count, nested, mismatches) = (0, 0, 0)
+    for chunk in _chunks(variants):
+        alts = [row['genomicVariantSequence'] for row in chunk]
+
+        started = time.perf_counter()
+        legacy_alts = [legacy_find_replace(alt) for alt in alts]
+        timings['legacy ALT'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        current_alts = [alt.translate(IUPAC_TO_VCF_ALT) for alt in alts]
+        timings['current ALT'] += time.perf_counter() - started
+
+        # the legacy encoding wrapped codes occurring more than once repeatedly, e.g. RR -> <<R>><<R>>
+        nested += sum(1 for (legacy_alt, current_alt) in zip(legacy_alts, current_alts) if legacy_alt != current_alt)
+
+        for row in chunk:
+            row['genomicVariantSequence'] = row['genomicVariantSequence'].translate(IUPAC_TO_VCF_ALT)
+
+        started = time.perf_counter()
+        current_lines = [VcfVariant.from_row(row).line() for row in chunk]
+        timings['current line'] += time.perf_counter() - started
+
+        # the legacy formatter adds fields to the rows, so it runs last
+        started = time.perf_counter()
+        legacy_lines = [legacy_format_variant(row) for row in chunk]
+        timings['legacy line'] += time.perf_counter() - started
+
+        mismatches += sum(1 for (legacy_line, current_line) in zip(legacy_lines, current_lines) if legacy_line != current_line)
+        count += len(chunk)
+
+    for (name, seconds) in timings.items():
+        click.echo('{:<14} {:>8.2f}s {:>12,.0f} variants/s'.format(name, seconds, count / seconds))
+    click.echo('ALT encoding speedup:  {:.1f}x'.format(timings['legacy ALT'] / timings['current ALT']))
+    click.echo('Line encoding speedup: {:.1f}x'.format(timings['legacy line'] / timings['current line']))
+    click.echo('{:,} variants, {} differing lines, {} ALTs with repeated codes encoded differently'.format(count, mismatches, nested))
+    if mismatches:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,7 @@ setup(
     include_package_data=True,
     package_dir={'': 'src'},
     packages=find_packages('src'),
-    py_modules=['common', 'data_source'],
+    py_modules=['common', 'data_source', 'query_cache', 'query_profile', 'query_recording', 'synthetic_data', 'scheduler', 'external_sort', 'json_codec'],
     install_requires=[
         'neo4j==1.7.3',
         'neobolt==1.7.13',
@@ -41,5 +41,5 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.7',
 )
@@ -5,7 +5,17 @@ import click
 import coloredlogs
 from common import ContextInfo
 from common import get_neo_uri
+from common import config_flag
 from data_source import DataSource
+from data_source import PagedDataSource
+from data_source import PartitionedDataSource
+from data_source import drivers
+from json_codec import json_codec
+from query_cache import query_cache
+from query_profile import query_profiler
+from query_recording import query_recorder
+from scheduler import Scheduler
+from scheduler import format_timing_table
 from generators import (disease_file_generator,
                         db_summary_file_generator,
                         expression_file_generator,
@@ -65,6 +75,12 @@ taxon_id_fms_subtype_map = {"NCBITaxon:10116": "RGD",
 @click.option('--allele-gff', is_flag=True, help='Generates an Allele based GFF file')
 @click.option('--upload', is_flag=True, help='Submits generated files to File Management System (FMS)')
 @click.option('--validate', is_flag=True, help='Validate generated file. If uploading then validates automatically')
+@click.option('--no-cache', is_flag=True, help='Always query the database, bypassing the query result cache')
+@click.option('--refresh-cache', is_flag=True, help='Query the database and replace any cached query results')
+@click.option('--profile-queries', is_flag=True, help='Writes a report of the result summary of every query run')
+@click.option('--profile-plans', is_flag=True, help='Runs queries with PROFILE and adds their plans and db hits to the report')
+@click.option('--record-queries', type=click.Path(file_okay=False), help='Records every query stream to this directory')
+@click.option('--replay-queries', type=click.Path(exists=True, file_okay=False), help='Serves every query from recordings in this directory')
 def main(vcf,
          orthology,
          disease,
@@ -77,6 +93,12 @@ def main(vcf,
          uniprot,
          human_genes_interacting_with,
          allele_gff,
+         no_cache,
+         refresh_cache,
+         profile_queries,
+         profile_plans,
+         record_queries,
+         replay_queries,
          generated_files_folder=os.path.abspath(os.path.join(os.getcwd(), os.pardir)) + '/output',
          skip_chromosomes={'Unmapped_Scaffold_8_D1580_D1567'}):
 
@@ -89,48 +111,112 @@ def main(vcf,
     if not os.path.exists(generated_files_folder):
         os.makedirs(generated_files_folder, exist_ok=True)
 
+    drivers.configure(max_connection_pool_size=config_info.config['NEO4J_MAX_CONNECTION_POOL_SIZE'])
+    if not no_cache and config_info.config['QUERY_CACHE_DIR']:
+        query_cache.configure(config_info.config['QUERY_CACHE_DIR'],
+                              int(config_info.config['QUERY_CACHE_MAX_MB']) * 1024 * 1024,
+                              config_info.config['RELEASE_VERSION'],
+                              refresh=refresh_cache)
+    query_profiler.configure(profile_queries or profile_plans, plans=profile_plans)
+    query_recorder.configure(record_directory=record_queries, replay_directory=replay_queries)
+    json_codec.configure(config_info.config['JSON_BACKEND'])
+
     click.echo('INFO:\tFiles output: ' + generated_files_folder)
+    scheduler = Scheduler(config_info.config['threads'])
     if vcf is True or all_filetypes is True:
         click.echo('INFO:\tGenerating VCF files, VCF gz files and VCF gz Tabix files')
-        generate_vcf_files(generated_files_folder, skip_chromosomes, config_info, upload, validate)
+        scheduler.add('vcf', generate_vcf_files, generated_files_folder, skip_chromosomes, config_info, upload, validate)
     if orthology is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Orthology file')
-        generate_orthology_file(generated_files_folder, config_info, upload, validate)
+        scheduler.add('orthology', generate_orthology_file, generated_files_folder, config_info, upload, validate)
     if disease is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Disease files')
-        generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
+        scheduler.add('disease', generate_disease_file, generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
     if expression is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Expression files')
-        generate_expression_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
+        scheduler.add('expression', generate_expression_file, generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
     if db_summary is True or all_filetypes is True:
         click.echo('INFO:\tGenerating DB summary file')
-        generate_db_summary_file(generated_files_folder, config_info, upload, validate)
+        scheduler.add('db-summary', generate_db_summary_file, generated_files_folder, config_info, upload, validate)
     if gene_cross_reference is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Gene Cross Reference file')
-        generate_gene_cross_reference_file(generated_files_folder, config_info, upload, validate)
+        scheduler.add('gene-cross-reference', generate_gene_cross_reference_file, generated_files_folder, config_info, upload, validate)
     if uniprot is True or all_filetypes is True:
         click.echo('INFO:\tUniprot Cross Reference file')
-        generate_uniprot_cross_reference(generated_files_folder, config_info, upload, validate)
+        scheduler.add('uniprot', generate_uniprot_cross_reference, generated_files_folder, config_info, upload, validate)
     if human_genes_interacting_with is True or all_filetypes is True:
         click.echo('INFO:\tHuman Genes Interacting With file')
-        generate_human_genes_interacting_with(generated_files_folder, config_info, upload, validate)
+        scheduler.add('human-genes-interacting-with', generate_human_genes_interacting_with, generated_files_folder, config_info, upload, validate)
     if allele_gff is True or all_filetypes is True:
         click.echo('INFO:\tAllele GFF files')
-        generate_allele_gff(generated_files_folder, config_info, upload, validate)
+        scheduler.add('allele-gff', generate_allele_gff, generated_files_folder, config_info, upload, validate)
+
+    try:
+        results = scheduler.run()
+    finally:
+        if query_cache.enabled:
+            logger.info('Query cache: %d hits, %d misses', query_cache.hits, query_cache.misses)
+        if query_profiler.enabled:
+            query_profiler.write_report(os.path.join(generated_files_folder,
+                                                     'query-profile-' + config_info.config['RELEASE_VERSION'] + '.json'))
+        for (uri, stats) in drivers.statistics().items():
+            logger.info('Neo4j driver pool usage for %s: %s', uri, stats)
+        drivers.close_all()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     click.echo('File Generator finished. Elapsed time: %s' % time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
+    click.echo(format_timing_table(results))
+    if any(result['status'] != 'ok' for result in results):
+        exit(-1)
+
+
+def keyset_page_filter(config_info, key):
+    """Returns the filter restricting a paged query to the driving nodes of a page, see PagedDataSource."""
+    if int(config_info.config['QUERY_PAGE_SIZE'] or 0):
+        return 'AND ' + key + ' IN $keys'
+    return ''
+
+
+def create_keyset_data_source(config_info, query, key_query, name):
+    page_size = int(config_info.config['QUERY_PAGE_SIZE'] or 0)
+    if page_size:
+        return PagedDataSource(get_neo_uri(config_info), query, key_query, page_size, name=name,
+                               retries=config_info.config.get('QUERY_PAGE_RETRIES') or 0)
+    return DataSource(get_neo_uri(config_info), query, name=name)
+
+
+def run_per_assembly(name, function, assemblies, config_info, *args):
+    """Runs ``function(assembly, *args)`` for every assembly over a pool of ASSEMBLY_WORKERS processes.
+
+    :param name: prefix of the job names, which tag the log messages of each assembly
+    """
+    scheduler = Scheduler(config_info.config['ASSEMBLY_WORKERS'])
+    for assembly in assemblies:
+        scheduler.add(name + ':' + assembly, function, assembly, *args)
+    failed = [result['name'] for result in scheduler.run() if result['status'] != 'ok']
+    if failed:
+        logger.error('Failed to generate %s', ', '.join(failed))
+        exit(-1)
 
 
 def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config_info, upload_flag, validate_flag):
     logger.info("Querying Assembly: " + assembly)
 
+    partition_workers = int(config_info.config['VCF_PARTITION_WORKERS'] or 0)
+    streaming = config_flag(config_info, 'VCF_STREAMING')
+    if partition_workers:
+        (page_filter, page_order) = ('AND c.primaryKey = $chromosome', '')
+    elif streaming:
+        (page_filter, page_order) = ('', 'ORDER BY chromosome, start')
+    else:
+        (page_filter, page_order) = (keyset_page_filter(config_info, 'v.primaryKey'), '')
     variants_query = '''MATCH (s:Species)-[:FROM_SPECIES]-(a:Allele)-[:VARIATION]-(v:Variant)-[l:LOCATED_ON]->(c:Chromosome),
                               (v:Variant)-[:VARIATION_TYPE]->(st:SOTerm),
                               (v:Variant)-[:ASSOCIATION]->(p:GenomicLocation)-[:ASSOCIATION]->(assembly:Assembly {primaryKey: "''' + assembly + '''"})
-                     WHERE NOT v.genomicReferenceSequence = v.genomicVariantSequence
-                           OR v.genomicVariantSequence = ""
+                     WHERE (NOT v.genomicReferenceSequence = v.genomicVariantSequence
+                            OR v.genomicVariantSequence = "")
+                           ''' + page_filter + '''
                      OPTIONAL MATCH (a:Allele)-[:IS_ALLELE_OF]-(g:Gene)
                      WITH COLLECT(DISTINCT {symbol: a.symbol,
                                             symbolText: a.symbolText,
@@ -139,6 +225,7 @@ def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config
                      OPTIONAL MATCH (v:Variant)-[:ASSOCIATION]-(glc:GeneLevelConsequence)-[:ASSOCIATION]-(g:Gene)
                      OPTIONAL MATCH (v:Variant)-[:ASSOCIATION]-(tlc:TranscriptLevelConsequence)-[:ASSOCIATION]-(t:Transcript)
                      RETURN c.primaryKey AS chromosome,
+                            v.primaryKey AS variantID,
                             v.globalId AS globalId,
                             right(v.paddingLeft,1) AS paddingLeft,
                             v.genomicReferenceSequence AS genomicReferenceSequence,
@@ -160,18 +247,38 @@ def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config
                             p.end AS end,
                             s.name AS species,
                             st.nameKey AS soTerm
-                     '''
+                     ''' + page_order
 
     if config_info.config["DEBUG"]:
         logger.info(variants_query)
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), variants_query)
+    contigs = None
+    if partition_workers or streaming:
+        chromosome_query = '''MATCH (v:Variant)-[:LOCATED_ON]->(c:Chromosome),
+                                    (v:Variant)-[:ASSOCIATION]->(:GenomicLocation)-[:ASSOCIATION]->(:Assembly {primaryKey: $assembly})
+                              RETURN DISTINCT c.primaryKey AS chromosome'''
+        chromosomes = sorted(record['chromosome']
+                             for record in DataSource(get_neo_uri(config_info), chromosome_query, {'assembly': assembly}, 'vcf-chromosomes:' + assembly))
+    if partition_workers:
+        logger.info("Querying %d chromosomes of %s with %d workers", len(chromosomes), assembly, partition_workers)
+        data_source = PartitionedDataSource(get_neo_uri(config_info), variants_query, 'chromosome', chromosomes, partition_workers,
+                                            name='vcf:' + assembly)
+    elif streaming:
+        data_source = DataSource(get_neo_uri(config_info), variants_query, name='vcf:' + assembly)
+        contigs = chromosomes
+    else:
+        variant_key_query = '''MATCH (v:Variant)-[:ASSOCIATION]->(:GenomicLocation)-[:ASSOCIATION]->(:Assembly {primaryKey: "''' + assembly + '''"})
+                               WHERE $last_key IS NULL OR v.primaryKey > $last_key
+                               RETURN DISTINCT v.primaryKey AS key
+                               ORDER BY key
+                               LIMIT $page_size'''
+        data_source = create_keyset_data_source(config_info, variants_query, variant_key_query, 'vcf:' + assembly)
     gvf = vcf_file_generator.VcfFileGenerator(data_source,
                                               generated_files_folder,
                                               config_info)
-    gvf.generate_files(skip_chromosomes=skip_chromosomes, upload_flag=upload_flag, validate_flag=validate_flag)
+    gvf.generate_files(skip_chromosomes=skip_chromosomes, upload_flag=upload_flag, validate_flag=validate_flag, contigs=contigs)
 
     if config_info.config["DEBUG"]:
         end_time = time.time()
@@ -182,15 +289,19 @@ def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config
 def generate_vcf_files(generated_files_folder, skip_chromosomes, config_info, upload_flag, validate_flag):
     assembly_query = """MATCH (a:Assembly)
                         RETURN a.primaryKey as assemblyID"""
-    assembly_data_source = DataSource(get_neo_uri(config_info), assembly_query)
+    assembly_data_source = DataSource(get_neo_uri(config_info), assembly_query, name='assemblies')
 
     if config_info.config["DEBUG"]:
         start_time = time.time()
         logger.info("Start time for generating VCF files: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    for assembly_result in assembly_data_source:
-        assembly = assembly_result["assemblyID"]
-        if assembly not in ignore_assemblies:
+    assemblies = [assembly_result["assemblyID"] for assembly_result in assembly_data_source
+                  if assembly_result["assemblyID"] not in ignore_assemblies]
+    if int(config_info.config['ASSEMBLY_WORKERS'] or 0) > 1:
+        run_per_assembly('vcf', generate_vcf_file, assemblies, config_info,
+                         generated_files_folder, skip_chromosomes, config_info, upload_flag, validate_flag)
+    else:
+        for assembly in assemblies:
             generate_vcf_file(assembly,
                               generated_files_folder,
                               skip_chromosomes,
@@ -231,7 +342,7 @@ def generate_orthology_file(generated_files_folder, config_info, upload_flag, va
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), orthology_query)
+    data_source = DataSource(get_neo_uri(config_info), orthology_query, name='orthology')
     of = orthology_file_generator.OrthologyFileGenerator(data_source,
                                                          generated_files_folder,
                                                          config_info)
@@ -244,16 +355,18 @@ def generate_orthology_file(generated_files_folder, config_info, upload_flag, va
 
 
 def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload_flag, validate_flag):
+    join_types = '''["IS_MARKER_FOR", // need to remove when removed from database
+                     "IS_IMPLICATED_IN", // need to remove when removed from database
+                     "IS_MODEL_OF",
+                     "is_model_of",
+                     "is_implicated_in",
+                     "is_biomarker_for",
+                     "implicated_via_orthology",
+                     "biomarker_via_orthology"]'''
     disease_query = '''MATCH (disease:DOTerm)-[:ASSOCIATION]-(dej:Association:DiseaseEntityJoin)-[:ASSOCIATION]-(object)-[:FROM_SPECIES]-(species:Species)
                    WHERE (object:Gene OR object:Allele OR object:AffectedGenomicModel)
-                         AND dej.joinType IN ["IS_MARKER_FOR", // need to remove when removed from database
-                                              "IS_IMPLICATED_IN", // need to remove when removed from database
-                                              "IS_MODEL_OF",
-                                              "is_model_of",
-                                              "is_implicated_in",
-                                              "is_biomarker_for",
-                                              "implicated_via_orthology",
-                                              "biomarker_via_orthology"]
+                         AND dej.joinType IN ''' + join_types + '''
+                         ''' + keyset_page_filter(config_info, 'dej.primaryKey') + '''
                    MATCH (dej:Association:DiseaseEntityJoin)-[:EVIDENCE]->(pj:PublicationJoin),
                          (p:Publication)-[:ASSOCIATION]->(pj:PublicationJoin)-[:ASSOCIATION]->(ec:Ontology:ECOTerm)
                    OPTIONAL MATCH (object:Gene)-[:ASSOCIATION]->(dej:Association:DiseaseEntityJoin)<-[:ASSOCIATION]-(otherAssociatedEntity)
@@ -283,7 +396,14 @@ def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subt
                                             otherAssociatedEntityID: otherAssociatedEntity.primaryKey}) as evidence,
                           REDUCE(t = "1900-01-01", c IN collect(left(pj.dateAssigned, 10)) | CASE WHEN c > t THEN c ELSE t END) AS dateAssigned,
                           ///takes most recent date
-                          dej.dataProvider AS dataProvider'''
+                          dej.dataProvider AS dataProvider
+                   '''
+    dej_key_query = '''MATCH (dej:Association:DiseaseEntityJoin)
+                       WHERE dej.joinType IN ''' + join_types + '''
+                             AND ($last_key IS NULL OR dej.primaryKey > $last_key)
+                       RETURN dej.primaryKey AS key
+                       ORDER BY key
+                       LIMIT $page_size'''
 
     if config_info.config["DEBUG"]:
         logger.info("Disease Association Query: ")
@@ -291,7 +411,7 @@ def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subt
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), disease_query)
+    data_source = create_keyset_data_source(config_info, disease_query, dej_key_query, 'disease')
     disease = disease_file_generator.DiseaseFileGenerator(data_source,
                                                           generated_files_folder,
                                                           config_info,
@@ -326,7 +446,7 @@ def generate_expression_file(generated_files_folder, config_info, taxon_id_fms_s
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), expression_query)
+    data_source = DataSource(get_neo_uri(config_info), expression_query, name='expression')
     expression = expression_file_generator.ExpressionFileGenerator(data_source,
                                                                    generated_files_folder,
                                                                    config_info,
@@ -351,7 +471,7 @@ def generate_db_summary_file(generated_files_folder, config_info, upload_flag, v
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), db_summary_query)
+    data_source = DataSource(get_neo_uri(config_info), db_summary_query, name='db-summary')
     db_summary = db_summary_file_generator.DbSummaryFileGenerator(data_source,
                                                                   generated_files_folder,
                                                                   config_info)
@@ -377,7 +497,7 @@ def generate_gene_cross_reference_file(generated_files_folder, config_info, uplo
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), gene_cross_reference_query)
+    data_source = DataSource(get_neo_uri(config_info), gene_cross_reference_query, name='gene-cross-reference')
     gene_cross_reference = gene_cross_reference_file_generator.GeneCrossReferenceFileGenerator(data_source,
                                                                                                generated_files_folder,
                                                                                                config_info)
@@ -401,7 +521,7 @@ def generate_uniprot_cross_reference(generated_files_folder, config_info, upload
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), uniprot_cross_reference_query)
+    data_source = DataSource(get_neo_uri(config_info), uniprot_cross_reference_query, name='uniprot')
     ucf = uniprot_cross_reference_generator.UniProtGenerator(data_source, config_info, generated_files_folder)
     ucf.generate_file(upload_flag=upload_flag, validate_flag=validate_flag)
 
@@ -425,7 +545,7 @@ def generate_human_genes_interacting_with(generated_files_folder, config_info, u
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), query)
+    data_source = DataSource(get_neo_uri(config_info), query, name='human-genes-interacting-with')
     hgiw = human_genes_interacting_with_file_generator.HumanGenesInteractingWithFileGenerator(data_source, config_info, generated_files_folder)
     hgiw.generate_file(upload_flag=upload_flag, validate_flag=validate_flag)
 
@@ -468,7 +588,7 @@ ORDER BY chromosome'''
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), query)
+    data_source = DataSource(get_neo_uri(config_info), query, name='allele-gff:' + assembly)
     agff = allele_gff_file_generator.AlleleGffFileGenerator(assembly, data_source, generated_files_folder, config_info)
     agff.generate_assembly_file(upload_flag=upload_flag, validate_flag=validate_flag)
 
@@ -481,15 +601,19 @@ ORDER BY chromosome'''
 def generate_allele_gff(generated_files_folder, config_info, upload_flag, validate_flag):
     assembly_query = """MATCH (a:Assembly)
                         RETURN a.primaryKey AS assemblyID"""
-    assembly_data_source = DataSource(get_neo_uri(config_info), assembly_query)
+    assembly_data_source = DataSource(get_neo_uri(config_info), assembly_query, name='assemblies')
 
     if config_info.config["DEBUG"]:
         start_time = time.time()
         logger.info("Start time for generating Allele GFF files: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    for assembly_result in assembly_data_source:
-        assembly = assembly_result["assemblyID"]
-        if assembly not in ignore_assemblies:
+    assemblies = [assembly_result["assemblyID"] for assembly_result in assembly_data_source
+                  if assembly_result["assemblyID"] not in ignore_assemblies]
+    if int(config_info.config['ASSEMBLY_WORKERS'] or 0) > 1:
+        run_per_assembly('allele-gff', generate_allele_gff_assembly, assemblies, config_info,
+                         generated_files_folder, config_info, upload_flag, validate_flag)
+    else:
+        for assembly in assemblies:
             generate_allele_gff_assembly(assembly,
                                          generated_files_folder,
                                          config_info,
@@ -33,6 +33,14 @@ class ContextInfo(object):
         logger.debug('Initialized with config values: {}'.format(self.config))
 
 
+def config_flag(config_info, key, default=False):
+    """Reads a boolean setting, which is a string when set from the environment."""
+    value = config_info.config.get(key)
+    if value is None:
+        return default
+    return str(value).lower() in ('true', 'yes', '1')
+
+
 def run_command(cmd):
     logger.info('Running ' + cmd)
     process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -53,11 +61,13 @@ def get_neo_uri(config_info):
         exit()
 
 
+SPECIES_QUERY = """MATCH (s:Species)
+                   RETURN s
+                   ORDER BY s.phylogeneticOrder"""
+
+
 def get_ordered_species_dict(config_info, taxon_ids):
-    species_query = """MATCH (s:Species)
-                       RETURN s
-                       ORDER BY s.phylogeneticOrder"""
-    species_data_source = DataSource(get_neo_uri(config_info), species_query)
+    species_data_source = DataSource(get_neo_uri(config_info), SPECIES_QUERY, name='species')
     species = OrderedDict()
     for record in species_data_source:
         if record["s"]["primaryKey"] in taxon_ids:
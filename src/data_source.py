@@ -1,24 +1,253 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, TransientError
+from retry.api import retry_call
+
+from query_cache import query_cache
+from query_profile import query_profiler
+from query_recording import query_recorder
+
+logger = logging.getLogger(__name__)
+
+
+class DriverRegistry:
+    """Process-wide registry of Neo4j drivers, one pooled driver per URI."""
+
+    def __init__(self):
+        self.max_connection_pool_size = None
+        self._drivers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        # drivers inherited from the parent process, see _reset_after_fork
+        self._inherited = []
+
+    def configure(self, max_connection_pool_size=None):
+        if max_connection_pool_size:
+            self.max_connection_pool_size = int(max_connection_pool_size)
+
+    def get(self, uri):
+        with self._lock:
+            driver = self._drivers.get(uri)
+            if driver is None:
+                config = {}
+                if self.max_connection_pool_size:
+                    config['max_connection_pool_size'] = self.max_connection_pool_size
+                logger.debug('Creating driver for %s', uri)
+                driver = self._drivers[uri] = GraphDatabase.driver(uri, **config)
+                self._stats[uri] = {'sessions_opened': 0,
+                                    'sessions_active': 0,
+                                    'sessions_peak': 0}
+            return driver
+
+    def session_opened(self, uri):
+        with self._lock:
+            stats = self._stats[uri]
+            stats['sessions_opened'] += 1
+            stats['sessions_active'] += 1
+            stats['sessions_peak'] = max(stats['sessions_peak'], stats['sessions_active'])
+
+    def session_closed(self, uri):
+        with self._lock:
+            self._stats[uri]['sessions_active'] -= 1
+
+    def statistics(self):
+        statistics = {}
+        with self._lock:
+            for (uri, driver) in self._drivers.items():
+                stats = dict(self._stats[uri])
+                pool = getattr(driver, '_pool', None)
+                connections = getattr(pool, 'connections', {})
+                stats['connections_open'] = sum(len(conns) for conns in connections.values())
+                stats['connections_in_use'] = sum(1 for conns in connections.values()
+                                                  for conn in conns if getattr(conn, 'in_use', False))
+                statistics[uri] = stats
+        return statistics
+
+    def _reset_after_fork(self):
+        # Connections of the parent's drivers must not be used by a child process,
+        # nor closed by it: closing sends GOODBYE on the sockets the parent still
+        # uses. Releasing the drivers would close them from __del__, so they are
+        # marked closed and kept referenced, along with their pools and connections.
+        for driver in self._drivers.values():
+            driver._closed = True
+        self._inherited.extend(self._drivers.values())
+        self._drivers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def close_all(self):
+        with self._lock:
+            for (uri, driver) in self._drivers.items():
+                logger.debug('Closing driver for %s', uri)
+                driver.close()
+            self._drivers.clear()
+
+
+drivers = DriverRegistry()
+os.register_at_fork(after_in_child=drivers._reset_after_fork)
 
 
 class DataSource:
 
-    def __init__(self, uri, query):
+    def __init__(self, uri, query, parameters=None, name=None):
         self.uri = uri
-        self.driver = GraphDatabase.driver(self.uri)
         self.query = query
+        self.parameters = parameters or {}
+        self.name = name or query.split('\n')[0].strip()
 
     def __repr__(self):
         s = '\n'.join(['<' + self.__class__.__qualname__ + '({uri},', '{query})'])
         return s.format(**dict((k, repr(v)) for (k, v) in vars(self).items()))
 
-    def __iter__(self):
-        with self.driver.session() as session:
+    @contextmanager
+    def _session(self):
+        driver = drivers.get(self.uri)
+        drivers.session_opened(self.uri)
+        try:
+            with driver.session() as session:
+                yield session
+        finally:
+            drivers.session_closed(self.uri)
+
+    def _cache_parameters(self):
+        return self.parameters
+
+    def _run(self, tx, parameters):
+        started = time.time()
+        result = tx.run(query_profiler.prepare(self.query), parameters)
+        rows = 0
+        for record in result:
+            rows += 1
+            yield record.data()
+        if query_profiler.enabled:
+            query_profiler.record(self.name, self.query, parameters, rows, time.time() - started, result.summary())
+
+    def _records(self):
+        with self._session() as session:
             with session.begin_transaction() as tx:
-                for record in tx.run(self.query):
-                    yield record.data()
+                for record in self._run(tx, self.parameters):
+                    yield record
+
+    def __iter__(self):
+        parameters = self._cache_parameters()
+        if query_recorder.replaying:
+            return query_recorder.replay(self.name, self.query, parameters)
+        records = query_cache.stream(self.uri, self.query, parameters, self._records)
+        return query_recorder.record(self.name, self.query, parameters, records)
 
     def get_data(self):
-        with self.driver.session() as session:
+        with self._session() as session:
+            with session.begin_transaction() as tx:
+                return list(tx.run(self.query, self.parameters))
+
+
+class PagedDataSource(DataSource):
+    """Streams a query in bounded keyset pages, one transaction per page.
+
+    Each page first runs ``key_query``, which has to return the ``key`` of
+    the next ``$page_size`` driving nodes with a key above ``$last_key``
+    (``null`` for the first page), ordered by key. The query then only
+    expands those nodes, bound to ``$keys``, into any number of rows each,
+    so that a page never splits the rows of a node. ``last_key`` is only
+    advanced once a page has been fully consumed, so a page failing on an
+    unavailable server or a transient error is fetched again from there, up
+    to ``retries`` times, without repeating or losing records.
+    """
+
+    retry_delay = 5
+
+    def __init__(self, uri, query, key_query, page_size, last_key=None, parameters=None, name=None, retries=3):
+        super().__init__(uri, query, parameters, name)
+        self.key_query = key_query
+        self.page_size = int(page_size)
+        self.last_key = last_key
+        self.retries = int(retries)
+
+    def _fetch_page(self):
+        parameters = dict(self.parameters, last_key=self.last_key, page_size=self.page_size)
+        with self._session() as session:
             with session.begin_transaction() as tx:
-                return list(tx.run(self.query))
+                keys = [record['key'] for record in tx.run(self.key_query, parameters)]
+                if not keys:
+                    return (keys, [])
+                return (keys, list(self._run(tx, dict(self.parameters, keys=keys))))
+
+    def _cache_parameters(self):
+        return dict(self.parameters, last_key=self.last_key)
+
+    def _records(self):
+        while True:
+            try:
+                (keys, page) = retry_call(self._fetch_page, exceptions=(ServiceUnavailable, TransientError),
+                                          tries=self.retries + 1, delay=self.retry_delay, backoff=2, logger=logger)
+            except Exception:
+                logger.error('Paged query failed, resume with last_key=%r', self.last_key)
+                raise
+            for record in page:
+                yield record
+            if keys:
+                self.last_key = keys[-1]
+                logger.debug('Committed page of %d keys ending at %r', len(keys), self.last_key)
+            if len(keys) < self.page_size:
+                return
+
+    def get_data(self):
+        return list(self)
+
+
+class PartitionedDataSource:
+    """Runs one parameterised query per partition value over a pool of sessions.
+
+    Each partition is fetched by its own :class:`DataSource` with the value
+    bound to the ``partition_key`` parameter. At most ``workers`` partitions
+    are in flight at once and they are handed back in the order given.
+    """
+
+    def __init__(self, uri, query, partition_key, partitions, workers, parameters=None, name=None):
+        self.uri = uri
+        self.query = query
+        self.partition_key = partition_key
+        self.partitions = list(partitions)
+        self.workers = int(workers)
+        self.parameters = parameters or {}
+        self.name = name or query.split('\n')[0].strip()
+
+    def __repr__(self):
+        return '<{}({!r}, {!r}, {} partitions)>'.format(self.__class__.__qualname__,
+                                                        self.uri,
+                                                        self.partition_key,
+                                                        len(self.partitions))
+
+    def _fetch_partition(self, value):
+        parameters = dict(self.parameters)
+        parameters[self.partition_key] = value
+        name = '{}[{}]'.format(self.name, value)
+        return list(DataSource(self.uri, self.query, parameters, name))
+
+    def iter_partitions(self):
+        pending = deque()
+        values = iter(self.partitions)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for value in values:
+                pending.append((value, executor.submit(self._fetch_partition, value)))
+                if len(pending) >= self.workers:
+                    break
+            while pending:
+                (value, future) = pending.popleft()
+                records = future.result()
+                for next_value in values:
+                    pending.append((next_value, executor.submit(self._fetch_partition, next_value)))
+                    break
+                yield (value, records)
+
+    def __iter__(self):
+        for (value, records) in self.iter_partitions():
+            for record in records:
+                yield record
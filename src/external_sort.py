@@ -0,0 +1,110 @@
+import heapq
+import pickle
+import logging
+import tempfile
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+
+class ExternalSorter:
+    """Sorts ``(key, value)`` pairs of string values within a memory budget.
+
+    Pairs are buffered until their values take up ``buffer_bytes``, then the
+    buffer is sorted and spilled to an anonymous temporary file. Iterating
+    k-way merges the spilled runs, at most ``max_fan_in`` at a time, reading
+    each in chunks of ``buffer_bytes // max_fan_in`` so that merging stays
+    within the budget too. Keys have to be unique for the output order to be
+    deterministic.
+    """
+
+    # rough size of the tuples and key held per buffered pair, on top of the value
+    item_overhead = 150
+    max_fan_in = 16
+
+    def __init__(self, buffer_bytes, directory=None):
+        self.buffer_bytes = int(buffer_bytes)
+        self.directory = directory
+        self.runs = []
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    @property
+    def chunk_bytes(self):
+        return max(self.buffer_bytes // self.max_fan_in, 1)
+
+    def add(self, key, value):
+        self._buffer.append((key, value))
+        self._buffered_bytes += len(value) + self.item_overhead
+        if self._buffered_bytes >= self.buffer_bytes:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort(key=itemgetter(0))
+        self.runs.append(self._write_run(self._buffer))
+        logger.debug('Spilled run %d of %d items', len(self.runs), len(self._buffer))
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def _write_run(self, items):
+        run = tempfile.TemporaryFile(dir=self.directory)
+        chunk = []
+        chunk_bytes = 0
+        for item in items:
+            chunk.append(item)
+            chunk_bytes += len(item[1]) + self.item_overhead
+            if chunk_bytes >= self.chunk_bytes:
+                pickle.dump(chunk, run, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+                chunk_bytes = 0
+        if chunk:
+            pickle.dump(chunk, run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        return run
+
+    @staticmethod
+    def _load_chunk(run):
+        try:
+            return pickle.load(run)
+        except EOFError:
+            return None
+
+    def _read_run(self, run):
+        chunk = self._load_chunk(run)
+        while chunk is not None:
+            for item in chunk:
+                yield item
+            chunk = self._load_chunk(run)
+
+    def _merge(self, runs):
+        return heapq.merge(*[self._read_run(run) for run in runs], key=itemgetter(0))
+
+    def __iter__(self):
+        if not self.runs:
+            self._buffer.sort(key=itemgetter(0))
+            return iter(self._buffer)
+        if self._buffer:
+            self._spill()
+        while len(self.runs) > self.max_fan_in:
+            (merging, self.runs) = (self.runs[:self.max_fan_in], self.runs[self.max_fan_in:])
+            logger.info('Merging %d of %d sorted runs', len(merging), len(merging) + len(self.runs))
+            try:
+                self.runs.append(self._write_run(self._merge(merging)))
+            finally:
+                for run in merging:
+                    run.close()
+        logger.info('Merging %d sorted runs', len(self.runs))
+        return self._merge(self.runs)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
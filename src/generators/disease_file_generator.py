@@ -11,12 +11,12 @@ import os
 import logging
 from datetime import datetime
 from time import gmtime, strftime
-import json
-import csv
 
 import upload
 from headers import create_header
+from scheduler import pool_workers
 from validators import json_validator
+from writers import PartitionedDataWriter
 
 logger = logging.getLogger(name=__name__)
 
@@ -88,144 +88,118 @@ class DiseaseFileGenerator:
                   "Date",
                   "Source"]
 
-        processed_disease_associations = {}
-        processed_disease_associations_tsv = {}
-        species = {}
-        for disease_association in self.disease_associations:
-            for evidence in disease_association["evidence"]:
-                if evidence["otherAssociatedEntityID"]:
-                    continue
-
-                if disease_association["objectType"][0] == "Feature":
-                    db_object_type = "allele"
-                elif disease_association["objectType"][0] == "AffectedGenomicModel":
-                    db_object_type = "affected_genomic_model"
-                else:
-                    db_object_type = disease_association["objectType"][0].lower()
-
-                pub_id = evidence["pubMedID"] if evidence["pubMedID"] else evidence["pubModID"]
-                if pub_id is None:
-                    pub_id = ""
-
-                do_name = disease_association["DOtermName"] if disease_association["DOtermName"] else ""
-                # inferred_gene_association = ""
-                # if db_object_type == "gene":
-                #    inferred_gene_association = disease_association["dbObjectID"]
-                # elif db_object_type == "allele":
-                #    inferred_gene_association = ",".join(disease_association["inferredGeneAssociation"])
-
-                if evidence["evidenceCode"] is not None:
-                    evidence_code = evidence["evidenceCode"]
-                else:
-                    evidence_code = ""
-
-                if evidence["evidenceCodeName"] is not None:
-                    evidence_code_name = evidence['evidenceCodeName']
-                else:
-                    evidence_code_name = ""
-
-                # gene_product_form_id = ""
-                # additional_genetic_component = ""
-                # experimental_conditions = ""
-                # qualifier = ""
-                # modifier_association_type = ""
-                # modifier_qualifier = ""
-                # modifier_genetic = ""
-                # modifier_experimental_conditions = ""
-                # genetic_sex = ""
-
-                if disease_association["associationType"] in ["implicated_via_orthology", "biomarker_via_orthology"] and len(disease_association["withOrthologs"]) == 0:
-                    print(disease_association)
-                    exit()
-                    continue
-
-                if disease_association["dateAssigned"] is None and disease_association["associationType"] in ["implicated_via_orthology",
-                                                                                                              "biomarker_via_orthology"]:
-                    date_str = strftime("%Y-%m-%d", gmtime())
-                else:
-                    date_str = disease_association["dateAssigned"]
-
-                inferred_from_id = ""
-                inferred_from_symbol = ""
-                if evidence["inferredFromEntity"]:
-                    inferred_from_id = evidence["inferredFromEntity"]["primaryKey"]
-                    if "symbol" in evidence["inferredFromEntity"]:
-                        inferred_from_symbol = evidence["inferredFromEntity"]["symbol"]
-                    elif "name" in evidence["inferredFromEntity"]:
-                        inferred_from_symbol = evidence["inferredFromEntity"]["name"]
-                    else:
-                        logger.info("infferred from node not handled" + evidence["inferredFromEntity"]["primaryKey"])
-
-                taxon_id = disease_association["taxonId"]
-                species[taxon_id] = disease_association["speciesName"]
-                processed_association = dict(zip(fields, [taxon_id,
-                                                          disease_association["speciesName"],
-                                                          db_object_type,
-                                                          disease_association["dbObjectID"],
-                                                          disease_association["dbObjectSymbol"] if disease_association["dbObjectSymbol"] else disease_association["dbObjectName"],
-                                                          # inferred_gene_association,
-                                                          # gene_product_form_id,
-                                                          # additional_genetic_component,
-                                                          # experimental_conditions,
-                                                          disease_association["associationType"].lower(),
-                                                          # qualifier,
-                                                          disease_association["DOID"],
-                                                          do_name,
-                                                          disease_association["withOrthologs"],
-                                                          inferred_from_id,
-                                                          inferred_from_symbol,
-                                                          # modifier_association_type,
-                                                          # modifier_qualifier,
-                                                          # modifier_genetic,
-                                                          # modifier_experimental_conditions,
-                                                          evidence_code,
-                                                          evidence_code_name,
-                                                          # genetic_sex,
-                                                          pub_id,
-                                                          datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y%m%d"),
-                                                          disease_association["dataProvider"]]))
-                processed_association_tsv = processed_association.copy()
-                processed_association_tsv["WithOrthologs"] = "|".join(set(disease_association["withOrthologs"])) if len(disease_association["withOrthologs"]) > 0 else ""
-
-                if taxon_id in processed_disease_associations:
-                    processed_disease_associations_tsv[taxon_id].append(processed_association_tsv)
-                    processed_disease_associations[taxon_id].append(processed_association)
-                else:
-                    processed_disease_associations_tsv[taxon_id] = [processed_association_tsv]
-                    processed_disease_associations[taxon_id] = [processed_association]
-
         file_basename = "agr-disease-" + self.config_info.config['RELEASE_VERSION']
         combined_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.combined')
 
-        combined_filepath_tsv = combined_file_basepath + '.tsv'
-        combined_disease_file = open(combined_filepath_tsv, 'w')
-        combined_disease_file.write(self._generate_header(self.config_info, species, 'tsv'))
-        combined_tsv_writer = csv.DictWriter(combined_disease_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        combined_tsv_writer.writeheader()
+        def taxon_file_basepath(taxon_id):
+            return os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
+
+        def header(taxon_ids, data_format):
+            return self._generate_header(self.config_info, taxon_ids, data_format)
+
+        with PartitionedDataWriter(combined_file_basepath, taxon_file_basepath, header, fields,
+                                   workers=pool_workers(self.config_info.config.get('JSON_ENCODING_WORKERS'))) as partitioned_writer:
+            for disease_association in self.disease_associations:
+                for evidence in disease_association["evidence"]:
+                    if evidence["otherAssociatedEntityID"]:
+                        continue
+
+                    if disease_association["objectType"][0] == "Feature":
+                        db_object_type = "allele"
+                    elif disease_association["objectType"][0] == "AffectedGenomicModel":
+                        db_object_type = "affected_genomic_model"
+                    else:
+                        db_object_type = disease_association["objectType"][0].lower()
+
+                    pub_id = evidence["pubMedID"] if evidence["pubMedID"] else evidence["pubModID"]
+                    if pub_id is None:
+                        pub_id = ""
 
+                    do_name = disease_association["DOtermName"] if disease_association["DOtermName"] else ""
+                    # inferred_gene_association = ""
+                    # if db_object_type == "gene":
+                    #    inferred_gene_association = disease_association["dbObjectID"]
+                    # elif db_object_type == "allele":
+                    #    inferred_gene_association = ",".join(disease_association["inferredGeneAssociation"])
+
+                    if evidence["evidenceCode"] is not None:
+                        evidence_code = evidence["evidenceCode"]
+                    else:
+                        evidence_code = ""
+
+                    if evidence["evidenceCodeName"] is not None:
+                        evidence_code_name = evidence['evidenceCodeName']
+                    else:
+                        evidence_code_name = ""
+
+                    # gene_product_form_id = ""
+                    # additional_genetic_component = ""
+                    # experimental_conditions = ""
+                    # qualifier = ""
+                    # modifier_association_type = ""
+                    # modifier_qualifier = ""
+                    # modifier_genetic = ""
+                    # modifier_experimental_conditions = ""
+                    # genetic_sex = ""
+
+                    if disease_association["associationType"] in ["implicated_via_orthology", "biomarker_via_orthology"] \
+                            and len(disease_association["withOrthologs"]) == 0:
+                        print(disease_association)
+                        exit()
+                        continue
+
+                    if disease_association["dateAssigned"] is None and disease_association["associationType"] in ["implicated_via_orthology",
+                                                                                                                  "biomarker_via_orthology"]:
+                        date_str = strftime("%Y-%m-%d", gmtime())
+                    else:
+                        date_str = disease_association["dateAssigned"]
+
+                    inferred_from_id = ""
+                    inferred_from_symbol = ""
+                    if evidence["inferredFromEntity"]:
+                        inferred_from_id = evidence["inferredFromEntity"]["primaryKey"]
+                        if "symbol" in evidence["inferredFromEntity"]:
+                            inferred_from_symbol = evidence["inferredFromEntity"]["symbol"]
+                        elif "name" in evidence["inferredFromEntity"]:
+                            inferred_from_symbol = evidence["inferredFromEntity"]["name"]
+                        else:
+                            logger.info("infferred from node not handled" + evidence["inferredFromEntity"]["primaryKey"])
+
+                    taxon_id = disease_association["taxonId"]
+                    processed_association = dict(zip(fields, [taxon_id,
+                                                              disease_association["speciesName"],
+                                                              db_object_type,
+                                                              disease_association["dbObjectID"],
+                                                              disease_association["dbObjectSymbol"] if disease_association["dbObjectSymbol"]
+                                                              else disease_association["dbObjectName"],
+                                                              # inferred_gene_association,
+                                                              # gene_product_form_id,
+                                                              # additional_genetic_component,
+                                                              # experimental_conditions,
+                                                              disease_association["associationType"].lower(),
+                                                              # qualifier,
+                                                              disease_association["DOID"],
+                                                              do_name,
+                                                              disease_association["withOrthologs"],
+                                                              inferred_from_id,
+                                                              inferred_from_symbol,
+                                                              # modifier_association_type,
+                                                              # modifier_qualifier,
+                                                              # modifier_genetic,
+                                                              # modifier_experimental_conditions,
+                                                              evidence_code,
+                                                              evidence_code_name,
+                                                              # genetic_sex,
+                                                              pub_id,
+                                                              datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y%m%d"),
+                                                              disease_association["dataProvider"]]))
+                    processed_association_tsv = processed_association.copy()
+                    processed_association_tsv["WithOrthologs"] = "|".join(set(disease_association["withOrthologs"])) \
+                        if len(disease_association["withOrthologs"]) > 0 else ""
+                    partitioned_writer.write(taxon_id, processed_association, processed_association_tsv)
+
+        combined_filepath_tsv = combined_file_basepath + '.tsv'
         combined_filepath_json = combined_file_basepath + '.json'
-        with open(combined_filepath_json, 'w') as outfile:
-            content = {'metadata': self._generate_header(self.config_info, species, 'json'),
-                       'data': sum(processed_disease_associations.values(), [])}
-            json.dump(content, outfile)
-
-        for taxon_id in processed_disease_associations:
-            combined_tsv_writer.writerows(processed_disease_associations_tsv[taxon_id])
-            taxon_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
-            taxon_filepath_json = taxon_file_basepath + '.json'
-            with open(taxon_filepath_json, 'w') as f:
-                contents = {'metadata': self._generate_header(self.config_info, [taxon_id], 'json'),
-                            'data': processed_disease_associations[taxon_id]}
-                json.dump(contents, f)
-
-            taxon_filename_tsv = taxon_file_basepath + '.tsv'
-            with open(taxon_filename_tsv, 'w') as f:
-                f.write(self._generate_header(self.config_info, [taxon_id], 'tsv'))
-                tsv_writer = csv.DictWriter(f, delimiter='\t', fieldnames=fields, lineterminator="\n")
-                tsv_writer.writeheader()
-                tsv_writer.writerows(processed_disease_associations_tsv[taxon_id])
-
-        combined_disease_file.close()
 
         if validate_flag:
             json_validator.JsonValidator(combined_filepath_json, 'disease').validateJSON()
@@ -234,7 +208,7 @@ class DiseaseFileGenerator:
                 process_name = "1"
                 upload.upload_process(process_name, combined_filepath_tsv, self.generated_files_folder, 'DISEASE-ALLIANCE', 'COMBINED', self.config_info)
                 upload.upload_process(process_name, combined_filepath_json, self.generated_files_folder, 'DISEASE-ALLIANCE-JSON', 'COMBINED', self.config_info)
-            for taxon_id in processed_disease_associations:
+            for taxon_id in partitioned_writer.partitions:
                 for file_extension in ['json', 'tsv']:
                     filename = file_basename + "." + taxon_id + '.' + file_extension
                     datatype = "DISEASE-ALLIANCE"
@@ -8,11 +8,11 @@
 
 import os
 import logging
-import json
-import csv
 import upload
 from headers import create_header
+from scheduler import pool_workers
 from validators import json_validator
+from writers import PartitionedDataWriter
 
 
 logger = logging.getLogger(name=__name__)
@@ -82,118 +82,88 @@ class ExpressionFileGenerator:
                   'Source',
                   'Reference']
 
-        associations = {}
-        species = {}
-        for expression in self.expressions:
-            association = dict(zip(fields, [None] * len(fields)))
-            association['Species'] = expression['species']['name']
-            association['Source'] = expression['gene']['dataProvider']
-            association['SpeciesID'] = expression['species']['primaryKey']
-            association['SpeciesID'] = association['SpeciesID']
-            association['GeneID'] = expression['gene']['primaryKey']
-            association['GeneSymbol'] = expression['gene']['symbol']
-            association['Location'] = expression['location']
-            for term in expression['terms']:
-                if 'CrossReference' in term.labels:
-                    if association['SourceURL']:
-                        association['SourceURL'].append(term['crossRefCompleteUrl'])  # according to spec should use globalCrossRefId
-                    else:
-                        association['SourceURL'] = [term['crossRefCompleteUrl']]
-                elif 'Publication' in term.labels:
-                    publication = term['pubMedId'] or term['pubModId']
-                    # reference = association['Reference']
-                    if association['Reference']:
-                        association['Reference'].append(publication)
-                    else:
-                        association['Reference'] = [publication]
-                elif 'Stage' in term.labels:
-                    # association['StageID'] = term['primaryKey']
-                    association['StageTerm'] = term['name']
-                elif 'MMOTerm' in term.labels:
-                    association['AssayID'] = term['primaryKey']
-                    association['AssayTermName'] = term['name']
-            for ontology_path in expression['ontologyPaths']:
-                if ontology_path['edge'] == 'ANATOMICAL_STRUCTURE':
-                    association['AnatomyTermID'] = ontology_path['primaryKey']
-                    association['AnatomyTermName'] = ontology_path['name']
-                elif ontology_path['edge'] == 'CELLULAR_COMPONENT':
-                    association['CellularComponentID'] = ontology_path['primaryKey']
-                    association['CellularComponentTerm'] = ontology_path['name']
-                elif ontology_path['edge'] == 'ANATOMICAL_SUB_SUBSTRUCTURE':
-                    association['SubStructureID'] = ontology_path['primaryKey']
-                    association['SubStructureName'] = ontology_path['name']
-                elif ontology_path['edge'] == 'CELLULAR_COMPONENT_QUALIFIER':
-                    if association['CellularComponentQualifierIDs']:
-                        association['CellularComponentQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['CellularComponentQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['CellularComponentQualifierTermNames']:
-                        association['CellularComponentQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['CellularComponentQualifierTermNames'] = [ontology_path['name']]
-                elif ontology_path['edge'] == 'ANATOMICAL_SUB_STRUCTURE_QUALIFIER':
-                    if association['SubStructureQualifierIDs']:
-                        association['SubStructureQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['SubStructureQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['SubStructureQualifierTermNames']:
-                        association['SubStructureQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['SubStructureQualifierTermNames'] = [ontology_path['name']]
-                elif ontology_path['edge'] == 'ANATOMICAL_STRUCTURE_QUALIFIER':
-                    if association['AnatomyTermQualifierIDs']:
-                        association['AnatomyTermQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['AnatomyTermQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['AnatomyTermQualifierTermNames']:
-                        association['AnatomyTermQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['AnatomyTermQualifierTermNames'] = [ontology_path['name']]
-            taxon_id = association['SpeciesID']
-            species[taxon_id] = association['Species']
-            if taxon_id in associations:
-                associations[taxon_id].append(association)
-            else:
-                associations[taxon_id] = [association]
-
         file_basename = "agr-expression-" + self.config_info.config['RELEASE_VERSION']
         combined_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.combined')
 
-        combined_filepath_tsv = combined_file_basepath + '.tsv'
-        combined_expression_file = open(combined_filepath_tsv, 'w')
-        combined_expression_file.write(self._generate_header(self.config_info, species.keys(), 'tsv'))
-        combined_tsv_writer = csv.DictWriter(combined_expression_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        combined_tsv_writer.writeheader()
+        def taxon_file_basepath(taxon_id):
+            return os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
+
+        def header(taxon_ids, data_format):
+            return self._generate_header(self.config_info, taxon_ids, data_format)
+
+        with PartitionedDataWriter(combined_file_basepath, taxon_file_basepath, header, fields,
+                                   workers=pool_workers(self.config_info.config.get('JSON_ENCODING_WORKERS'))) as partitioned_writer:
+            for expression in self.expressions:
+                association = dict(zip(fields, [None] * len(fields)))
+                association['Species'] = expression['species']['name']
+                association['Source'] = expression['gene']['dataProvider']
+                association['SpeciesID'] = expression['species']['primaryKey']
+                association['SpeciesID'] = association['SpeciesID']
+                association['GeneID'] = expression['gene']['primaryKey']
+                association['GeneSymbol'] = expression['gene']['symbol']
+                association['Location'] = expression['location']
+                for term in expression['terms']:
+                    if 'CrossReference' in term.labels:
+                        if association['SourceURL']:
+                            association['SourceURL'].append(term['crossRefCompleteUrl'])  # according to spec should use globalCrossRefId
+                        else:
+                            association['SourceURL'] = [term['crossRefCompleteUrl']]
+                    elif 'Publication' in term.labels:
+                        publication = term['pubMedId'] or term['pubModId']
+                        # reference = association['Reference']
+                        if association['Reference']:
+                            association['Reference'].append(publication)
+                        else:
+                            association['Reference'] = [publication]
+                    elif 'Stage' in term.labels:
+                        # association['StageID'] = term['primaryKey']
+                        association['StageTerm'] = term['name']
+                    elif 'MMOTerm' in term.labels:
+                        association['AssayID'] = term['primaryKey']
+                        association['AssayTermName'] = term['name']
+                for ontology_path in expression['ontologyPaths']:
+                    if ontology_path['edge'] == 'ANATOMICAL_STRUCTURE':
+                        association['AnatomyTermID'] = ontology_path['primaryKey']
+                        association['AnatomyTermName'] = ontology_path['name']
+                    elif ontology_path['edge'] == 'CELLULAR_COMPONENT':
+                        association['CellularComponentID'] = ontology_path['primaryKey']
+                        association['CellularComponentTerm'] = ontology_path['name']
+                    elif ontology_path['edge'] == 'ANATOMICAL_SUB_SUBSTRUCTURE':
+                        association['SubStructureID'] = ontology_path['primaryKey']
+                        association['SubStructureName'] = ontology_path['name']
+                    elif ontology_path['edge'] == 'CELLULAR_COMPONENT_QUALIFIER':
+                        if association['CellularComponentQualifierIDs']:
+                            association['CellularComponentQualifierIDs'].append(ontology_path['primaryKey'])
+                        else:
+                            association['CellularComponentQualifierIDs'] = [ontology_path['primaryKey']]
+                        if association['CellularComponentQualifierTermNames']:
+                            association['CellularComponentQualifierTermNames'].append(ontology_path['name'])
+                        else:
+                            association['CellularComponentQualifierTermNames'] = [ontology_path['name']]
+                    elif ontology_path['edge'] == 'ANATOMICAL_SUB_STRUCTURE_QUALIFIER':
+                        if association['SubStructureQualifierIDs']:
+                            association['SubStructureQualifierIDs'].append(ontology_path['primaryKey'])
+                        else:
+                            association['SubStructureQualifierIDs'] = [ontology_path['primaryKey']]
+                        if association['SubStructureQualifierTermNames']:
+                            association['SubStructureQualifierTermNames'].append(ontology_path['name'])
+                        else:
+                            association['SubStructureQualifierTermNames'] = [ontology_path['name']]
+                    elif ontology_path['edge'] == 'ANATOMICAL_STRUCTURE_QUALIFIER':
+                        if association['AnatomyTermQualifierIDs']:
+                            association['AnatomyTermQualifierIDs'].append(ontology_path['primaryKey'])
+                        else:
+                            association['AnatomyTermQualifierIDs'] = [ontology_path['primaryKey']]
+                        if association['AnatomyTermQualifierTermNames']:
+                            association['AnatomyTermQualifierTermNames'].append(ontology_path['name'])
+                        else:
+                            association['AnatomyTermQualifierTermNames'] = [ontology_path['name']]
+                association_tsv = dict((key, ','.join(value) if isinstance(value, list) else value)
+                                       for (key, value) in association.items())
+                partitioned_writer.write(association['SpeciesID'], association, association_tsv)
 
+        combined_filepath_tsv = combined_file_basepath + '.tsv'
         combined_filepath_json = combined_file_basepath + '.json'
-        with open(combined_filepath_json, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, species.keys(), 'json'),
-                        'data': sum(associations.values(), [])}
-            json.dump(contents, outfile)
-
-        for taxon_id in associations:
-            taxon_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
-            taxon_filepath_json = taxon_file_basepath + '.json'
-            with open(taxon_filepath_json, 'w') as f:
-                contents = {'metadata': self._generate_header(self.config_info, [taxon_id], 'json'),
-                            'data': associations[taxon_id]}
-                json.dump(contents, f)
-
-            logger.info(taxon_id)
-            for association in associations[taxon_id]:
-                for key in association:
-                    if isinstance(association[key], list):
-                        association[key] = ','.join(association[key])
-
-            combined_tsv_writer.writerows(associations[taxon_id])
-            taxon_filename_tsv = taxon_file_basepath + '.tsv'
-            with open(taxon_filename_tsv, 'w') as f:
-                f.write(self._generate_header(self.config_info, [taxon_id], 'tsv'))
-                tsv_writer = csv.DictWriter(f, delimiter='\t', fieldnames=fields, lineterminator="\n")
-                tsv_writer.writeheader()
-                tsv_writer.writerows(associations[taxon_id])
-
-        combined_expression_file.close()
 
         if validate_flag:
             json_validator.JsonValidator(combined_filepath_json, 'expression').validateJSON()
@@ -203,7 +173,7 @@ class ExpressionFileGenerator:
 
                 upload.upload_process(process_name, combined_filepath_tsv, self.generated_files_folder, 'EXPRESSION-ALLIANCE', 'COMBINED', self.config_info)
                 upload.upload_process(process_name, combined_filepath_json, self.generated_files_folder, 'EXPRESSION-ALLIANCE-JSON', 'COMBINED', self.config_info)
-            for taxon_id in associations:
+            for taxon_id in partitioned_writer.partitions:
                 for file_extension in ['json', 'tsv']:
                     filename = file_basename + "." + taxon_id + '.' + file_extension
                     datatype = "EXPRESSION-ALLIANCE"
@@ -8,12 +8,11 @@
 
 import os
 import logging
-import csv
-import json
 
 from upload import upload
 from headers import create_header
 from validators import json_validator
+from writers import JsonDataWriter, TsvDataWriter
 
 logger = logging.getLogger(name=__name__)
 
@@ -58,7 +57,6 @@ class GeneCrossReferenceFileGenerator:
         JSONfilename = 'agr-gene-cross-references-json-' + self.config_info.config['RELEASE_VERSION'] + '.json'
         output_filepath = os.path.join(self.generated_files_folder, TSVfilename)
         output_filepath_json = os.path.join(self.generated_files_folder, JSONfilename)
-        gene_cross_reference_file = open(output_filepath, 'w')
 
         columns = ['GeneID',
                    'GlobalCrossReferenceID',
@@ -66,30 +64,20 @@ class GeneCrossReferenceFileGenerator:
                    'ResourceDescriptorPage',
                    'TaxonID']
 
-        listofxrefs = []
         taxon_ids = set()
-        rows = []
-        for data in self.gene_cross_references:
-            listofxrefs.append(data)
-            row = dict(zip(columns, [None] * len(columns)))
-            row['GeneID'] = data['GeneID']
-            row['GlobalCrossReferenceID'] = data['GlobalCrossReferenceID']
-            row['CrossReferenceCompleteURL'] = data['CrossReferenceCompleteURL']
-            row['ResourceDescriptorPage'] = data['ResourceDescriptorPage']
-            row['TaxonID'] = data['TaxonID']
-            taxon_ids.add(data['TaxonID'])
-            rows.append(row)
-
-        gene_cross_reference_file.write(self._generate_header(self.config_info, taxon_ids, 'tsv'))
-        tsv_writer = csv.DictWriter(gene_cross_reference_file, delimiter='\t', fieldnames=columns, lineterminator="\n")
-        tsv_writer.writeheader()
-        tsv_writer.writerows(rows)
-        gene_cross_reference_file.close()
-
-        with open(output_filepath_json, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, taxon_ids, 'json'),
-                        'data': listofxrefs}
-            json.dump(contents, outfile)
+        with JsonDataWriter(output_filepath_json) as json_writer, TsvDataWriter(output_filepath, columns) as tsv_writer:
+            for data in self.gene_cross_references:
+                json_writer.write(data)
+                row = dict(zip(columns, [None] * len(columns)))
+                row['GeneID'] = data['GeneID']
+                row['GlobalCrossReferenceID'] = data['GlobalCrossReferenceID']
+                row['CrossReferenceCompleteURL'] = data['CrossReferenceCompleteURL']
+                row['ResourceDescriptorPage'] = data['ResourceDescriptorPage']
+                row['TaxonID'] = data['TaxonID']
+                taxon_ids.add(data['TaxonID'])
+                tsv_writer.write(row)
+            json_writer.close(self._generate_header(self.config_info, taxon_ids, 'json'))
+            tsv_writer.close(self._generate_header(self.config_info, taxon_ids, 'tsv'))
 
         if validate_flag:
             json_validator.JsonValidator(output_filepath_json, 'gene-cross-references').validateJSON()
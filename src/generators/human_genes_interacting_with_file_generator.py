@@ -1,11 +1,11 @@
 import os
 import logging
-import json
 import csv
 
 import upload
 from headers import create_header
 from validators import json_validator
+from writers import JsonDataWriter
 
 logger = logging.getLogger(name=__name__)
 
@@ -32,28 +32,21 @@ class HumanGenesInteractingWithFileGenerator:
                   "Symbol",
                   "Name"]
 
-        processed_interactions = []
-        for interaction in self.interactions:
-            processed_interactions.append(dict(zip(fields, [interaction["GeneID"],
-                                                            interaction["Symbol"],
-                                                            interaction["Name"]])))
-
         json_filename = file_basename + ".json"
         json_filepath = os.path.join(self.generated_files_folder, json_filename)
-        with open(json_filepath, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, 'json'),
-                        'data': processed_interactions}
-            json.dump(contents, outfile)
-
         tsv_filename = file_basename + ".tsv"
         tsv_filepath = os.path.join(self.generated_files_folder, tsv_filename)
-        tsv_file = open(tsv_filepath, 'w')
-        tsv_file.write(self._generate_header(self.config_info, 'tsv'))
-
-        tsv_writer = csv.DictWriter(tsv_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        tsv_writer.writeheader()
-        tsv_writer.writerows(processed_interactions)
-        tsv_file.close()
+        with JsonDataWriter(json_filepath, self._generate_header(self.config_info, 'json')) as json_writer, \
+                open(tsv_filepath, 'w') as tsv_file:
+            tsv_file.write(self._generate_header(self.config_info, 'tsv'))
+            tsv_writer = csv.DictWriter(tsv_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
+            tsv_writer.writeheader()
+            for interaction in self.interactions:
+                processed_interaction = dict(zip(fields, [interaction["GeneID"],
+                                                          interaction["Symbol"],
+                                                          interaction["Name"]]))
+                json_writer.write(processed_interaction)
+                tsv_writer.writerow(processed_interaction)
 
         if validate_flag:
             json_validator.JsonValidator(json_filepath, 'human-genes-interacting-with').validateJSON()
@@ -1,11 +1,10 @@
 import os
 import logging
-import json
-import csv
 
 import upload
 from headers import create_header
 from validators import json_validator
+from writers import JsonDataWriter, TsvDataWriter
 
 logger = logging.getLogger(name=__name__)
 
@@ -43,45 +42,34 @@ class OrthologyFileGenerator:
                   "IsBestScore",
                   "IsBestRevScore"]
 
-        processed_orthologs = []
-        taxon_ids = set()
-        for ortholog in self.orthologs:
-            num_algorithms = ortholog["numAlgorithmMatch"] + ortholog["numAlgorithmNotMatched"]
-            taxon_ids.add(ortholog["species1TaxonID"])
-            taxon_ids.add(ortholog["species2TaxonID"])
-            processed_orthologs.append(dict(zip(fields, [ortholog["gene1ID"],
-                                                         ortholog["gene1Symbol"],
-                                                         ortholog["species1TaxonID"],
-                                                         ortholog["species1Name"],
-                                                         ortholog["gene2ID"],
-                                                         ortholog["gene2Symbol"],
-                                                         ortholog["species2TaxonID"],
-                                                         ortholog["species2Name"],
-                                                         ortholog["Algorithms"],
-                                                         str(ortholog["numAlgorithmMatch"]),
-                                                         num_algorithms,
-                                                         ortholog["best"],
-                                                         ortholog["bestRev"]])))
-
         json_filename = file_basename + ".json"
         json_filepath = os.path.join(self.generated_files_folder, json_filename)
-        with open(json_filepath, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, taxon_ids, 'json'),
-                        'data': processed_orthologs}
-            json.dump(contents, outfile)
-
-        for processed_ortholog in processed_orthologs:
-            processed_ortholog['Algorithms'] = "|".join(set(processed_ortholog['Algorithms']))
-
         tsv_filename = file_basename + ".tsv"
         tsv_filepath = os.path.join(self.generated_files_folder, tsv_filename)
-        tsv_file = open(tsv_filepath, 'w')
-        tsv_file.write(self._generate_header(self.config_info, taxon_ids, 'tsv'))
-
-        tsv_writer = csv.DictWriter(tsv_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        tsv_writer.writeheader()
-        tsv_writer.writerows(processed_orthologs)
-        tsv_file.close()
+        taxon_ids = set()
+        with JsonDataWriter(json_filepath) as json_writer, TsvDataWriter(tsv_filepath, fields) as tsv_writer:
+            for ortholog in self.orthologs:
+                num_algorithms = ortholog["numAlgorithmMatch"] + ortholog["numAlgorithmNotMatched"]
+                taxon_ids.add(ortholog["species1TaxonID"])
+                taxon_ids.add(ortholog["species2TaxonID"])
+                processed_ortholog = dict(zip(fields, [ortholog["gene1ID"],
+                                                       ortholog["gene1Symbol"],
+                                                       ortholog["species1TaxonID"],
+                                                       ortholog["species1Name"],
+                                                       ortholog["gene2ID"],
+                                                       ortholog["gene2Symbol"],
+                                                       ortholog["species2TaxonID"],
+                                                       ortholog["species2Name"],
+                                                       ortholog["Algorithms"],
+                                                       str(ortholog["numAlgorithmMatch"]),
+                                                       num_algorithms,
+                                                       ortholog["best"],
+                                                       ortholog["bestRev"]]))
+                json_writer.write(processed_ortholog)
+                processed_ortholog['Algorithms'] = "|".join(set(processed_ortholog['Algorithms']))
+                tsv_writer.write(processed_ortholog)
+            json_writer.close(self._generate_header(self.config_info, taxon_ids, 'json'))
+            tsv_writer.close(self._generate_header(self.config_info, taxon_ids, 'tsv'))
 
         if validate_flag:
             json_validator.JsonValidator(json_filepath, 'orthology').validateJSON()
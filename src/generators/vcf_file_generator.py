@@ -1,10 +1,21 @@
 import os
 import time
 import sys
+import heapq
+import shutil
+import marshal
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote
 from collections import defaultdict, OrderedDict
-from functools import partial
-from operator import itemgetter
-from common import run_command
+from itertools import chain, groupby
+from operator import attrgetter, itemgetter
+from common import run_command, config_flag
+from external_sort import ExternalSorter
+from scheduler import pool_workers
+from writers import IndexedVcfWriter, PlainVcfWriter, TabixIndex
 from validators import vcf_validator
 import logging
 import upload
@@ -13,6 +24,159 @@ sys.path.append('../')
 
 logger = logging.getLogger(name=__name__)
 
+# ambiguity codes from https://www.bioinformatics.org/sms/iupac.html, written as symbolic ALT alleles
+IUPAC_TO_VCF_ALT = str.maketrans(dict((code, '<' + code + '>') for code in 'RYSWKMBDHV'))
+
+# settings choosing how the VCF files are generated, in the order they take precedence; the settings after the
+# one in use are ignored, except VCF_SHARD_CACHE and VCF_FORMAT_WORKERS which combine
+VCF_MODE_SETTINGS = ('VCF_PARTITION_WORKERS', 'VCF_STREAMING', 'VCF_SORT_BUFFER_MB', 'VCF_SHARD_CACHE', 'VCF_FORMAT_WORKERS')
+
+# (INFO key, VcfVariant slot) in the order the fields are written
+INFO_FIELDS = (('hgvs_nomenclature', 'hgvs_nomenclature'),
+               ('geneLevelConsequence', 'gene_consequences'),
+               ('transcriptLevelConsequence', 'transcript_consequences'),
+               ('geneImpact', 'gene_impacts'),
+               ('transcriptImpact', 'transcript_impacts'),
+               ('allele_ids', 'allele_ids'),
+               ('allele_symbols', 'allele_symbols'),
+               ('allele_symbols_text', 'allele_symbols_text'),
+               ('soTerm', 'so_term'),
+               ('globalId', 'global_id'),
+               ('allele_of_gene_ids', 'gene_ids'),
+               ('allele_of_gene_symbols', 'gene_symbols'),
+               ('allele_of_transcript_ids', 'transcript_ids'),
+               ('allele_of_transcript_gff3_ids', 'transcript_gff3_ids'),
+               ('allele_of_transcript_gff3_names', 'transcript_gff3_names'))
+
+
+# changing the lines written for the same variant rows has to change this,
+# so that shards cached by an earlier version are not reused
+SHARD_FORMAT_VERSION = '1'
+
+# (generator, variant rows by chromosome) of the file being written from shards,
+# inherited by the forked shard workers instead of being pickled to them
+_shard_source = None
+
+
+def _optional_str(value):
+    return None if value is None else str(value)
+
+
+def _write_shard(chromosome, shard_path):
+    (generator, chromo_variants) = _shard_source
+    with generator._open_vcf_file(shard_path, shard=True) as shard:
+        for record in generator._sorted_variants(chromosome, chromo_variants[chromosome]):
+            generator._add_variant_to_vcf_file(shard, record)
+    return getattr(shard, 'index', None)
+
+
+class VcfVariant:
+    """The fields of one VCF data line, built once from a variant query row.
+
+    List valued fields are joined when the record is built, so a record holds
+    a handful of strings instead of the nested row it came from.
+    """
+
+    __slots__ = ('chromosome', 'pos', 'hgvs_nomenclature', 'ref', 'alt',
+                 'gene_consequences', 'transcript_consequences', 'gene_impacts', 'transcript_impacts',
+                 'allele_ids', 'allele_symbols', 'allele_symbols_text', 'so_term', 'global_id',
+                 'gene_ids', 'gene_symbols', 'transcript_ids', 'transcript_gff3_ids', 'transcript_gff3_names')
+
+    empty_value_marker = '.'
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds the record of an adjusted row, see :meth:`VcfFileGenerator._adjust_variant`."""
+        record = cls()
+        record.chromosome = row['chromosome']
+        record.pos = row['POS']
+        record.hgvs_nomenclature = _optional_str(row.get('hgvsNomenclature'))
+        record.ref = row['genomicReferenceSequence']
+        record.alt = row['genomicVariantSequence']
+        record.so_term = _optional_str(row.get('soTerm'))
+        record.global_id = _optional_str(row['globalId'])
+
+        gene_consequences = []
+        gene_impacts = []
+        gene_ids = []
+        gene_symbols = []
+        for gene_consequence in row['geneConsequences']:
+            consequence = gene_consequence['consequence']
+            gene_consequences.append(consequence.replace(",", "|") if consequence is not None else '')
+            impact = gene_consequence['impact']
+            gene_impacts.append(impact if impact is not None else '')
+            if gene_consequence['gene'] is not None:
+                gene_ids.append(gene_consequence['gene'])
+                gene_symbols.append(gene_consequence['geneSymbol'])
+            else:
+                gene_symbols.append('')
+        record.gene_consequences = ','.join(gene_consequences)
+        record.gene_impacts = ','.join(gene_impacts)
+        if gene_ids:
+            record.gene_ids = ','.join(gene_ids)
+            record.gene_symbols = ','.join(gene_symbols)
+        else:
+            record.gene_ids = record.gene_symbols = None
+
+        transcript_consequences = []
+        transcript_impacts = []
+        transcript_ids = []
+        transcript_gff3_ids = []
+        transcript_gff3_names = []
+        for transcript_consequence in row['transcriptConsequences']:
+            consequence = transcript_consequence['consequence']
+            transcript_consequences.append(consequence.replace(",", "|") if consequence is not None else '')
+            impact = transcript_consequence['impact']
+            transcript_impacts.append(impact if impact is not None else '')
+            if transcript_consequence['transcript'] is not None:
+                transcript_ids.append(transcript_consequence['transcript'])
+                transcript_gff3_ids.append(transcript_consequence['transcriptGFF3ID'] or '')
+                transcript_gff3_names.append(transcript_consequence['transcriptGFF3Name'] or '')
+            else:
+                transcript_gff3_ids.append('')
+                transcript_gff3_names.append('')
+        record.transcript_consequences = ','.join(transcript_consequences)
+        record.transcript_impacts = ','.join(transcript_impacts)
+        if transcript_ids:
+            record.transcript_ids = ','.join(transcript_ids)
+            record.transcript_gff3_ids = ','.join(transcript_gff3_ids)
+            record.transcript_gff3_names = ','.join(transcript_gff3_names)
+        else:
+            record.transcript_ids = record.transcript_gff3_ids = record.transcript_gff3_names = None
+
+        alleles = row['alleles']
+        if alleles:
+            record.allele_ids = ','.join(allele['id'] for allele in alleles)
+            record.allele_symbols = ','.join(allele['symbol'] for allele in alleles)
+            record.allele_symbols_text = ','.join(allele['symbolText'] for allele in alleles)
+        else:
+            record.allele_ids = record.allele_symbols = record.allele_symbols_text = None
+        return record
+
+    _info_prefixes = tuple(key + '="' for (key, slot) in INFO_FIELDS)
+    _info_values = attrgetter(*(slot for (key, slot) in INFO_FIELDS))
+
+    def info(self):
+        """Formats the INFO column, leaving out empty fields.
+
+        The gene and transcript fields are None when a variant has no gene or
+        transcript ids, which leaves them out as well.
+        """
+        fields = [prefix + value for (prefix, value) in zip(self._info_prefixes, self._info_values(self)) if value]
+        if not fields:
+            return self.empty_value_marker
+        return '";'.join(fields) + '"'
+
+    def line(self):
+        return '\t'.join([self.chromosome,
+                          str(self.pos),
+                          self.hgvs_nomenclature,
+                          self.ref,
+                          self.alt,
+                          '.',
+                          '.',
+                          self.info()]) + '\n'
+
 
 class VcfFileGenerator:
 
@@ -46,163 +210,34 @@ class VcfFileGenerator:
         vcf_file.write('#' + '\t'.join(cls.col_headers))
         vcf_file.write('\n')
 
-    @classmethod
-    def _variant_value_for_file(cls, variant, data_key, transform=None):
-        value = variant.get(data_key)
-        if value is None:
-            return None
-        if transform is None:
-            return value
-        return transform(value)
-
     @classmethod
     def _add_variant_to_vcf_file(cls, vcf_file, variant):
-        info_map = OrderedDict()
-        info_map['hgvs_nomenclature'] = cls._variant_value_for_file(variant, 'hgvsNomenclature')
-
-        variant['geneLevelConsequence'] = []
-        variant['transcriptLevelConsequence'] = []
-        variant['geneImpact'] = []
-        variant['transcriptImpact'] = []
-        variant['geneSymbols'] = []
-        variant['transcriptGFF3IDs'] = []
-        variant['transcriptGFF3Names'] = []
-        variant['geneIDs'] = []
-        variant['transcriptIDs'] = []
-        for geneConsequence in variant['geneConsequences']:
-            if geneConsequence['consequence'] is not None:
-                variant['geneLevelConsequence'].append(geneConsequence['consequence'].replace(",", "|"))
-            else:
-                variant['geneLevelConsequence'].append('')
-            if geneConsequence['impact'] is not None:
-                variant['geneImpact'].append(geneConsequence['impact'])
-            else:
-                variant['geneImpact'].append('')
-            if geneConsequence['gene'] is not None:
-                variant['geneIDs'].append(geneConsequence['gene'])
-                variant['geneSymbols'].append(geneConsequence['geneSymbol'])
-            else:
-                variant['geneSymbols'].append('')
+        vcf_file.write_record(variant.line())
 
-        for transcriptConsequence in variant['transcriptConsequences']:
-            if transcriptConsequence['consequence'] is not None:
-                variant['transcriptLevelConsequence'].append(transcriptConsequence['consequence'].replace(",", "|"))
-            else:
-                variant['transcriptLevelConsequence'].append('')
-            if transcriptConsequence['impact'] is not None:
-                variant['transcriptImpact'].append(transcriptConsequence['impact'])
-            else:
-                variant['transcriptImpact'].append('')
-            if transcriptConsequence['transcript'] is not None:
-                variant['transcriptIDs'].append(transcriptConsequence['transcript'])
-                if transcriptConsequence['transcriptGFF3ID']:
-                    variant['transcriptGFF3IDs'].append(transcriptConsequence['transcriptGFF3ID'])
-                else:
-                    variant['transcriptGFF3IDs'].append('')
-                if transcriptConsequence['transcriptGFF3Name']:
-                    variant['transcriptGFF3Names'].append(transcriptConsequence['transcriptGFF3Name'])
-                else:
-                    variant['transcriptGFF3Names'].append('')
-            else:
-                variant['transcriptGFF3IDs'].append('')
-                variant['transcriptGFF3Names'].append('')
-        if cls._variant_value_for_file(variant, 'geneLevelConsequence') is not None:
-            info_map['geneLevelConsequence'] = ','.join(cls._variant_value_for_file(variant, 'geneLevelConsequence'))
-        else:
-            info_map['geneLevelConsequence'] = cls._variant_value_for_file(variant, 'geneLevelConsequence')
-
-        if cls._variant_value_for_file(variant, 'transcriptLevelConsequence') is not None:
-            info_map['transcriptLevelConsequence'] = ','.join(cls._variant_value_for_file(variant, 'transcriptLevelConsequence'))
-        else:
-            info_map['transcriptLevelConsequence'] = cls._variant_value_for_file(variant, 'transcriptLevelConsequence')
+    def _consume_data_source(self, skip_chromosomes=(), build_records=True):
+        """
 
-        if cls._variant_value_for_file(variant, 'geneLevelConsequence') is not None:
-            info_map['geneImpact'] = ','.join(cls._variant_value_for_file(variant, 'geneImpact'))
-        else:
-            info_map['geneImpact'] = cls._variant_value_for_file(variant, 'geneImpact')
-
-        if cls._variant_value_for_file(variant, 'geneLevelConsequence') is not None:
-            info_map['transcriptImpact'] = ','.join(cls._variant_value_for_file(variant, 'transcriptImpact'))
-        else:
-            info_map['transcriptImpact'] = cls._variant_value_for_file(variant, 'transcriptImpact')
-
-        for allele in variant['alleles']:
-            if 'allele_ids' in variant:
-                variant['allele_ids'].append(allele['id'])
-            else:
-                variant['allele_ids'] = [allele['id']]
-            allele_symbol = allele['symbol']
-            allele_symbol_text = allele['symbolText']
-            if 'alleleSymbols' in variant:
-                variant['alleleSymbols'].append(allele_symbol)
-            else:
-                variant['alleleSymbols'] = [allele_symbol]
-            if 'alleleSymbolText' in variant:
-                variant['alleleSymbolText'].append(allele_symbol_text)
-            else:
-                variant['alleleSymbolText'] = [allele_symbol_text]
-
-        info_map['allele_ids'] = cls._variant_value_for_file(variant, 'allele_ids', transform=','.join)
-        info_map['allele_symbols'] = cls._variant_value_for_file(variant, 'alleleSymbols', transform=','.join)
-        info_map['allele_symbols_text'] = cls._variant_value_for_file(variant, 'alleleSymbolText', transform=','.join)
-        info_map['soTerm'] = cls._variant_value_for_file(variant, 'soTerm')
-        info_map['globalId'] = variant['globalId']
-
-        if variant['geneIDs']:
-            info_map['allele_of_gene_ids'] = cls._variant_value_for_file(variant, 'geneIDs', transform=','.join)
-            info_map['allele_of_gene_symbols'] = cls._variant_value_for_file(variant, 'geneSymbols', transform=','.join)
-
-        if variant['transcriptIDs']:
-            info_map['allele_of_transcript_ids'] = cls._variant_value_for_file(variant, 'transcriptIDs', transform=','.join)
-            info_map['allele_of_transcript_gff3_ids'] = cls._variant_value_for_file(variant, 'transcriptGFF3IDs', transform=','.join)
-            info_map['allele_of_transcript_gff3_names'] = cls._variant_value_for_file(variant, 'transcriptGFF3Names', transform=','.join)
-
-        if any(info_map.values()):
-            info = ';'.join('{}="{}"'.format(k, v)
-                            for (k, v) in info_map.items()
-                            if v)
-        else:
-            info = cls.empty_value_marker
-        vcf_file.write('\t'.join([variant['chromosome'],
-                                  str(variant['POS']),
-                                  info_map['hgvs_nomenclature'],
-                                  variant['genomicReferenceSequence'],
-                                  variant['genomicVariantSequence'],
-                                  '.',
-                                  '.',
-                                  info]))
-        vcf_file.write('\n')
-
-    def _consume_data_source(self):
+        :param build_records: adjust the variants and keep their records, or keep the variant rows as they are
+        """
         assembly_chr_variants = defaultdict(lambda: defaultdict(list))
         assembly_species = {}
         for variant in self.variants:
             assembly = variant['assembly'].replace('.', '').replace('_', '')
             chromosome = variant['chromosome']
-            assembly_chr_variants[assembly][chromosome].append(variant)
+            records = assembly_chr_variants[assembly][chromosome]
             assembly_species[assembly] = variant['species']
+            if chromosome not in skip_chromosomes:
+                record = self._variant_record(variant) if build_records else variant
+                if record is not None:
+                    records.append(record)
         return (assembly_chr_variants, assembly_species)
 
-    def _find_replace(self, string, iupac_codes):
-        # is the item in the dict?
-        for item in string:
-            # iterate by keys
-            if item in iupac_codes:
-                # look up and replace
-                string = string.replace(item, "<" + item + ">")
-                # return updated string
-        return string
-
     def _adjust_variant(self, variant):
         so_term = variant['soTerm']
         if variant['start'] is None:
             return None
 
-        # from https://www.bioinformatics.org/sms/iupac.html
-        iupac_to_vcf_ref_codes = {"R", "Y", "S", "W", "K", "M", "B", "D", "H", "V"}
-
-        variant['genomicVariantSequence'] = self._find_replace(variant['genomicVariantSequence'],
-                                                               iupac_to_vcf_ref_codes)
+        variant['genomicVariantSequence'] = variant['genomicVariantSequence'].translate(IUPAC_TO_VCF_ALT)
 
         if so_term == 'deletion':
             variant['POS'] = variant['start'] - 1
@@ -239,50 +274,363 @@ class VcfFileGenerator:
             return None
         return variant
 
-    def generate_files(self, skip_chromosomes=(), upload_flag=False, validate_flag=False):
-        (assembly_chr_variants, assembly_species) = self._consume_data_source()
-        for (assembly, chromo_variants) in assembly_chr_variants.items():
-            filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
-            filepath = os.path.join(self.generated_files_folder, filename)
-            logger.info('Generating VCF File for assembly %r', assembly)
-            with open(filepath, 'w') as vcf_file:
-                contigs = set()
-                for (chromosome, variants) in sorted(chromo_variants.items(), key=itemgetter(0)):
-                    if chromosome not in skip_chromosomes:
-                        contigs.add(chromosome)
-                self._write_vcf_header(vcf_file, assembly, contigs,
-                                       assembly_species[assembly],
-                                       self.config_info)
-                for (chromosome, variants) in sorted(chromo_variants.items(), key=itemgetter(0)):
-                    if chromosome in skip_chromosomes:
-                        logger.info('Skipping VCF file generation for chromosome %r', chromosome)
-                        continue
-                    adjust_varient = partial(self._adjust_variant)
-                    adjusted_variants = filter(None, map(adjust_varient, variants))
-                    for variant in sorted(adjusted_variants, key=itemgetter('POS')):
-                        self._add_variant_to_vcf_file(vcf_file, variant)
-            stdout, stderr, return_code = run_command('bgzip -c ' + filepath + ' > ' + filepath + '.gz')
-            if return_code == 0:
-                logger.info(filepath + ' compressed successfully')
-            else:
-                logger.error(filepath + ' could not be compressed')
+    def _variant_record(self, variant):
+        if self._adjust_variant(variant) is None:
+            return None
+        return VcfVariant.from_row(variant)
+
+    @classmethod
+    def _sorted_records(cls, chromosome, records):
+        return sorted(records, key=attrgetter('pos'))
+
+    def _sorted_variants(self, chromosome, variants):
+        return self._sorted_records(chromosome, filter(None, map(self._variant_record, variants)))
+
+    def _ordered_variants(self, chromosome, variants):
+        """Adjusts variants arriving in start order and yields them in POS order.
+
+        POS is either start or start - 1, so once a variant starting at
+        ``start`` has arrived no later variant can have a POS below
+        ``start - 1``. Only the variants above that line are held back.
+        """
+        window = []
+        last_start = None
+        for (seq, variant) in enumerate(variants):
+            start = variant['start']
+            record = self._variant_record(variant)
+            if record is None:
+                continue
+            if last_start is not None and start < last_start:
+                logger.error('Variants of chromosome %r are not ordered by start: %r after %r', chromosome, start, last_start)
                 exit(-1)
+            last_start = start
+            heapq.heappush(window, (record.pos, seq, record))
+            while window and window[0][0] <= start - 1:
+                yield heapq.heappop(window)[2]
+        while window:
+            yield heapq.heappop(window)[2]
 
-            command = 'tabix -p vcf ' + filepath + '.gz'
-            stdout, stderr, return_code = run_command(command)
-            if return_code == 0:
-                logger.info('Index file created: ' + filepath + '.gz.tbi')
-            else:
-                logger.error('Could not create index file: ' + command)
+    @classmethod
+    def _chromosome_groups(cls, variants):
+        seen = set()
+        for (chromosome, group) in groupby(variants, key=itemgetter('chromosome')):
+            if chromosome in seen:
+                logger.error('Variants are not ordered by chromosome, %r seen twice', chromosome)
                 exit(-1)
+            seen.add(chromosome)
+            yield (chromosome, group)
 
-            if validate_flag:
-                process_name = "1"
-                filepath = os.path.join(self.generated_files_folder, filename)
-                validator = vcf_validator.VcfValidator(filepath)
-                validator.validate_vcf()
-                if upload_flag:
-                    logger.info("Submitting to FMS")
+    def _native_compression(self):
+        return (self.config_info.config.get('VCF_COMPRESSION') or 'native') == 'native'
+
+    def _writes_plain(self):
+        return not self._native_compression() or config_flag(self.config_info, 'VCF_WRITE_PLAIN', default=True)
+
+    def _open_vcf_file(self, filepath, shard=False):
+        """Opens the plain VCF file, or with native compression the .vcf.gz and its index.
+
+        :param shard: open a file to be appended to another one, compressed on one thread and
+                      keeping its index in memory
+        """
+        if self._native_compression():
+            threads = 1 if shard else int(self.config_info.config.get('VCF_COMPRESSION_THREADS') or 1)
+            return IndexedVcfWriter(filepath, write_plain=self._writes_plain(), threads=threads, write_index=not shard)
+        return PlainVcfWriter(filepath)
+
+    def _write_vcf_file(self, filepath, assembly, species, contigs, chromosome_variants, skip_chromosomes,
+                        prepare=None):
+        """
+
+        :param chromosome_variants: (chromosome, variants) pairs in chromosome order
+        :param prepare: turns the variants of a chromosome into records in POS order,
+                        defaults to adjusting and sorting variant rows
+        """
+        prepare = prepare or self._sorted_variants
+        with self._open_vcf_file(filepath) as vcf_file:
+            self._write_vcf_header(vcf_file, assembly, contigs, species, self.config_info)
+            for (chromosome, variants) in chromosome_variants:
+                if chromosome in skip_chromosomes:
+                    logger.info('Skipping VCF file generation for chromosome %r', chromosome)
+                    continue
+                for variant in prepare(chromosome, variants):
+                    self._add_variant_to_vcf_file(vcf_file, variant)
+
+    @classmethod
+    def _fingerprint(cls, variants):
+        """Returns a digest of variant rows that does not depend on their order.
+
+        It is the sum of the digests of the rows, seeded with the shard format
+        version. Rows are serialized with marshal version 2, which has no
+        references between objects, so equal rows always give equal bytes
+        within a Python version.
+        """
+        total = int.from_bytes(hashlib.blake2b(SHARD_FORMAT_VERSION.encode('utf-8'), digest_size=16).digest(), 'little')
+        for variant in variants:
+            total += int.from_bytes(hashlib.blake2b(marshal.dumps(variant, 2), digest_size=16).digest(), 'little')
+        return '{:032x}'.format(total % (1 << 128))
+
+    def _cached_shard_exists(self, shard_path):
+        return ((not self._native_compression() or
+                 (os.path.exists(shard_path + '.gz') and os.path.exists(shard_path + '.gz.idx')))
+                and (not self._writes_plain() or os.path.exists(shard_path)))
+
+    def _write_vcf_file_from_shards(self, filepath, assembly, species, contigs, chromo_variants, skip_chromosomes,
+                                    workers, cache_folder=None):
+        """Adjusts, sorts, formats and compresses every chromosome to a shard, in worker processes
+        when ``workers`` is above 1.
+
+        The shards are appended to the VCF file in chromosome order as they
+        come in; BGZF blocks are copied without being recompressed and the
+        index of each shard is moved to where its blocks end up.
+
+        :param chromo_variants: variant rows by chromosome
+        :param cache_folder: keeps the shards and their indexes for the next run, named after the
+                             fingerprint of the rows of their chromosome; a chromosome with the same
+                             fingerprint is copied from its shard. Other files in the folder are removed.
+        """
+        global _shard_source
+        chromosomes = []
+        for chromosome in sorted(chromo_variants):
+            if chromosome in skip_chromosomes:
+                logger.info('Skipping VCF file generation for chromosome %r', chromosome)
+            else:
+                chromosomes.append(chromosome)
+        if cache_folder is None:
+            shard_folder = tempfile.mkdtemp(prefix=os.path.basename(filepath) + '.', dir=self.generated_files_folder)
+        else:
+            shard_folder = cache_folder
+            os.makedirs(shard_folder, exist_ok=True)
+        shard_files = set()
+        _shard_source = (self, chromo_variants)
+        try:
+            with self._open_vcf_file(filepath) as vcf_file:
+                self._write_vcf_header(vcf_file, assembly, contigs, species, self.config_info)
+                if workers > 1:
+                    executor = ProcessPoolExecutor(max_workers=min(workers, len(chromosomes)) or 1,
+                                                   mp_context=multiprocessing.get_context('fork'))
+                else:
+                    executor = ThreadPoolExecutor(max_workers=1)
+                with executor:
+                    shards = []
+                    for (number, chromosome) in enumerate(chromosomes):
+                        if cache_folder is None:
+                            shard_name = str(number)
+                        else:
+                            shard_name = quote(chromosome, safe='') + '.' + self._fingerprint(chromo_variants[chromosome])
+                        shard_path = os.path.join(shard_folder, shard_name + '.vcf')
+                        shard_files.update([shard_path, shard_path + '.gz', shard_path + '.gz.idx'])
+                        if cache_folder is not None and self._cached_shard_exists(shard_path):
+                            logger.info('Reusing the shard of unchanged chromosome %r', chromosome)
+                            shards.append((shard_path, None, None))
+                            continue
+                        part_path = os.path.join(shard_folder, shard_name + '.part.vcf')
+                        shards.append((shard_path, part_path, executor.submit(_write_shard, chromosome, part_path)))
+                    for (shard_path, part_path, future) in shards:
+                        if future is None:
+                            index = TabixIndex.read(shard_path + '.gz.idx') if self._native_compression() else None
+                        else:
+                            index = future.result()
+                            if index is not None:
+                                # holds tell_block positions of the shard rather than virtual offsets
+                                index.write(part_path + '.gz.idx')
+                            for suffix in ('', '.gz', '.gz.idx'):
+                                if os.path.exists(part_path + suffix):
+                                    os.replace(part_path + suffix, shard_path + suffix)
+                        vcf_file.append(shard_path, index)
+        finally:
+            _shard_source = None
+            if cache_folder is None:
+                shutil.rmtree(shard_folder, ignore_errors=True)
+        if cache_folder is not None:
+            for name in os.listdir(shard_folder):
+                if os.path.join(shard_folder, name) not in shard_files:
+                    os.remove(os.path.join(shard_folder, name))
+
+    def _compress_vcf_file(self, filepath):
+        stdout, stderr, return_code = run_command('bgzip -c ' + filepath + ' > ' + filepath + '.gz')
+        if return_code == 0:
+            logger.info(filepath + ' compressed successfully')
+        else:
+            logger.error(filepath + ' could not be compressed')
+            exit(-1)
+
+        command = 'tabix -p vcf ' + filepath + '.gz'
+        stdout, stderr, return_code = run_command(command)
+        if return_code == 0:
+            logger.info('Index file created: ' + filepath + '.gz.tbi')
+        else:
+            logger.error('Could not create index file: ' + command)
+            exit(-1)
+
+    def _finish_vcf_file(self, filename, assembly, upload_flag, validate_flag):
+        filepath = os.path.join(self.generated_files_folder, filename)
+        if self._native_compression():
+            logger.info('Compressed and indexed ' + filepath + '.gz while writing')
+        else:
+            self._compress_vcf_file(filepath)
+
+        if validate_flag:
+            process_name = "1"
+            full_scan = (self.config_info.config.get('VCF_VALIDATION') or 'full') == 'full'
+            validator = vcf_validator.VcfValidator(filepath + '.gz', full_scan=full_scan)
+            validator.validate_vcf()
+            if upload_flag:
+                logger.info("Submitting to FMS")
+                if self._writes_plain():
                     upload.upload_process(process_name, filename, self.generated_files_folder, 'VCF', assembly, self.config_info)
-                    upload.upload_process(process_name, filename + ".gz", self.generated_files_folder, 'VCF-GZ', assembly, self.config_info)
-                    upload.upload_process(process_name, filename + ".gz.tbi", self.generated_files_folder, 'VCF-GZ-TBI', assembly, self.config_info)
+                upload.upload_process(process_name, filename + ".gz", self.generated_files_folder, 'VCF-GZ', assembly, self.config_info)
+                upload.upload_process(process_name, filename + ".gz.tbi", self.generated_files_folder, 'VCF-GZ-TBI', assembly, self.config_info)
+
+    def _generate_partitioned_files(self, skip_chromosomes, upload_flag, validate_flag):
+        """Writes each chromosome section as soon as its partition has been fetched.
+
+        The contigs are known up front from the partition values, so nothing
+        but the partitions still in flight is held in memory.
+        """
+        partitions = self.variants.iter_partitions()
+        fetched = []
+        for (chromosome, variants) in partitions:
+            fetched.append((chromosome, variants))
+            if variants:
+                break
+        if not fetched or not fetched[-1][1]:
+            logger.info('No variants found in any partition, no VCF file written')
+            return
+
+        first_variant = fetched[-1][1][0]
+        assembly = first_variant['assembly'].replace('.', '').replace('_', '')
+        contigs = set(chromosome for chromosome in self.variants.partitions
+                      if chromosome not in skip_chromosomes)
+        filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
+        filepath = os.path.join(self.generated_files_folder, filename)
+        logger.info('Generating VCF File for assembly %r from %d partitions', assembly, len(self.variants.partitions))
+        self._write_vcf_file(filepath, assembly, first_variant['species'], contigs,
+                             chain(fetched, partitions), skip_chromosomes)
+        self._finish_vcf_file(filename, assembly, upload_flag, validate_flag)
+
+    def _generate_ordered_file(self, contigs, skip_chromosomes, upload_flag, validate_flag):
+        """Writes variants as they arrive, ordered by chromosome and start.
+
+        The header is written once the first variant is known, so only the
+        variants in the reorder window of the current chromosome are held in
+        memory.
+        """
+        variants = iter(self.variants)
+        first_variant = next(variants, None)
+        if first_variant is None:
+            logger.info('No variants found, no VCF file written')
+            return
+
+        assembly = first_variant['assembly'].replace('.', '').replace('_', '')
+        contigs = set(chromosome for chromosome in contigs if chromosome not in skip_chromosomes)
+        filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
+        filepath = os.path.join(self.generated_files_folder, filename)
+        logger.info('Streaming VCF File for assembly %r', assembly)
+        self._write_vcf_file(filepath, assembly, first_variant['species'], contigs,
+                             self._chromosome_groups(chain([first_variant], variants)),
+                             skip_chromosomes, prepare=self._ordered_variants)
+        self._finish_vcf_file(filename, assembly, upload_flag, validate_flag)
+
+    def _generate_externally_sorted_files(self, buffer_bytes, skip_chromosomes, upload_flag, validate_flag):
+        """Formats variants as they arrive and sorts the lines within ``buffer_bytes``.
+
+        Lines are keyed by chromosome, POS and arrival order, so the output is
+        the same as sorting every chromosome in memory. Sorted runs beyond the
+        budget are spilled to temporary files and merged into the VCF file.
+        """
+        sorters = OrderedDict()
+        assembly_contigs = defaultdict(set)
+        assembly_species = {}
+        skipped = set()
+        try:
+            for (seq, variant) in enumerate(self.variants):
+                chromosome = variant['chromosome']
+                if chromosome in skip_chromosomes:
+                    if chromosome not in skipped:
+                        logger.info('Skipping VCF file generation for chromosome %r', chromosome)
+                        skipped.add(chromosome)
+                    continue
+                assembly = variant['assembly'].replace('.', '').replace('_', '')
+                if assembly not in sorters:
+                    sorters[assembly] = ExternalSorter(buffer_bytes)
+                assembly_contigs[assembly].add(chromosome)
+                assembly_species[assembly] = variant['species']
+                record = self._variant_record(variant)
+                if record is None:
+                    continue
+                sorters[assembly].add((chromosome, record.pos, seq), record.line())
+
+            for (assembly, sorter) in sorters.items():
+                filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
+                filepath = os.path.join(self.generated_files_folder, filename)
+                logger.info('Generating VCF File for assembly %r from %d spilled runs', assembly, len(sorter.runs))
+                with self._open_vcf_file(filepath) as vcf_file:
+                    self._write_vcf_header(vcf_file, assembly, assembly_contigs[assembly], assembly_species[assembly], self.config_info)
+                    for (key, line) in sorter:
+                        vcf_file.write_record(line)
+                sorter.close()
+                self._finish_vcf_file(filename, assembly, upload_flag, validate_flag)
+        finally:
+            for sorter in sorters.values():
+                sorter.close()
+
+    def _mode_setting_is_set(self, key):
+        if key == 'VCF_STREAMING':
+            return config_flag(self.config_info, key)
+        if key == 'VCF_SHARD_CACHE':
+            return bool(self.config_info.config.get(key))
+        if key == 'VCF_FORMAT_WORKERS':
+            return int(self.config_info.config.get(key) or 0) > 1
+        return int(self.config_info.config.get(key) or 0) > 0
+
+    def _warn_ignored_settings(self, mode):
+        ignored = [key for key in VCF_MODE_SETTINGS[VCF_MODE_SETTINGS.index(mode) + 1:] if self._mode_setting_is_set(key)]
+        if ignored:
+            logger.warning('%s is set, ignoring %s', mode, ', '.join(ignored))
+
+    def generate_files(self, skip_chromosomes=(), upload_flag=False, validate_flag=False, contigs=None):
+        """
+
+        :param skip_chromosomes:
+        :param upload_flag:
+        :param validate_flag:
+        :param contigs: chromosomes of the assembly; when given the variants are expected to be
+                        ordered by chromosome and start and are written as they arrive
+        :return:
+        """
+        if hasattr(self.variants, 'iter_partitions'):
+            self._warn_ignored_settings('VCF_PARTITION_WORKERS')
+            self._generate_partitioned_files(skip_chromosomes, upload_flag, validate_flag)
+            return
+        if contigs is not None:
+            self._warn_ignored_settings('VCF_STREAMING')
+            self._generate_ordered_file(contigs, skip_chromosomes, upload_flag, validate_flag)
+            return
+        sort_buffer_mb = int(self.config_info.config.get('VCF_SORT_BUFFER_MB') or 0)
+        if sort_buffer_mb:
+            self._warn_ignored_settings('VCF_SORT_BUFFER_MB')
+            self._generate_externally_sorted_files(sort_buffer_mb * 1024 * 1024, skip_chromosomes, upload_flag, validate_flag)
+            return
+
+        format_workers = pool_workers(self.config_info.config.get('VCF_FORMAT_WORKERS'))
+        shard_cache = self.config_info.config.get('VCF_SHARD_CACHE')
+        sharded = format_workers > 1 or bool(shard_cache)
+        (assembly_chr_variants, assembly_species) = self._consume_data_source(skip_chromosomes,
+                                                                              build_records=not sharded)
+        for (assembly, chromo_variants) in assembly_chr_variants.items():
+            filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
+            filepath = os.path.join(self.generated_files_folder, filename)
+            logger.info('Generating VCF File for assembly %r', assembly)
+            contigs = set()
+            for chromosome in chromo_variants:
+                if chromosome not in skip_chromosomes:
+                    contigs.add(chromosome)
+            if sharded:
+                cache_folder = os.path.join(shard_cache, assembly) if shard_cache else None
+                self._write_vcf_file_from_shards(filepath, assembly, assembly_species[assembly], contigs, chromo_variants,
+                                                 skip_chromosomes, format_workers, cache_folder)
+            else:
+                self._write_vcf_file(filepath, assembly, assembly_species[assembly], contigs,
+                                     sorted(chromo_variants.items(), key=itemgetter(0)), skip_chromosomes,
+                                     prepare=self._sorted_records)
+            self._finish_vcf_file(filename, assembly, upload_flag, validate_flag)
@@ -0,0 +1,63 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    """Encodes and decodes the JSON files with the configured backend.
+
+    ``stdlib`` is the json module and writes exactly what ``json.dumps``
+    does. ``orjson`` is several times faster but writes compact JSON with
+    non-ASCII characters as UTF-8, which is the same data for any JSON
+    reader. ``auto`` uses orjson when it is installed and falls back to
+    stdlib otherwise. Values orjson cannot encode, such as integers beyond
+    64 bits, are encoded with stdlib.
+    """
+
+    backends = ('auto', 'orjson', 'stdlib')
+
+    def __init__(self):
+        self.backend = 'stdlib'
+
+    def configure(self, backend='auto'):
+        backend = (backend or 'auto').lower()
+        if backend not in self.backends:
+            logger.error('Unknown JSON_BACKEND {!r}, expected one of {}'.format(backend, ', '.join(self.backends)))
+            exit(-1)
+        if backend != 'stdlib' and orjson is None:
+            if backend == 'orjson':
+                logger.warning('orjson is not installed, encoding JSON with the json module')
+            backend = 'stdlib'
+        elif backend == 'auto':
+            backend = 'orjson'
+        self.backend = backend
+        logger.info('Encoding JSON with ' + backend)
+
+    def dumps(self, obj):
+        if self.backend == 'orjson':
+            try:
+                return orjson.dumps(obj).decode('utf-8')
+            except TypeError:
+                pass
+        return json.dumps(obj)
+
+    def loads(self, data):
+        """
+
+        :param data: str or UTF-8 bytes
+        """
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def load(self, file):
+        return self.loads(file.read())
+
+
+json_codec = JsonCodec()
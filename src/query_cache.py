@@ -0,0 +1,177 @@
+import os
+import json
+import glob
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+
+from neo4j.types.graph import Node
+
+logger = logging.getLogger(__name__)
+
+
+class DetachedNode(dict):
+    """The properties and labels of a Node, usable without a driver session."""
+
+    __slots__ = ('labels', 'id')
+
+    def __init__(self, labels, properties, id=None):
+        super().__init__(properties)
+        self.labels = frozenset(labels)
+        self.id = id
+
+    def __reduce__(self):
+        return (DetachedNode, (self.labels, dict(self), self.id))
+
+    def __repr__(self):
+        return '<DetachedNode id={!r} labels={!r} properties={!r}>'.format(self.id, set(self.labels), dict(self))
+
+
+def detach(value):
+    if isinstance(value, Node):
+        return DetachedNode(value.labels, dict(value), value.id)
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, detach(item)) for (key, item) in value.items())
+    return value
+
+
+class QueryCache:
+    """On-disk cache of query result streams.
+
+    Entries are keyed by a hash of the database URI, the query text, its
+    parameters and the release version. Each entry stores the column names once followed by one
+    pickled tuple per row. Entries are only published once a stream has been
+    fully consumed and the least recently used ones are evicted when the
+    cache grows beyond ``max_bytes``.
+    """
+
+    suffix = '.rows'
+
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.release = None
+        self.refresh = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory, max_bytes, release, refresh=False):
+        """
+
+        :param directory: only readable by the current user, as entries are unpickled
+        """
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.release = release
+        self.refresh = refresh
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            if os.stat(directory).st_uid != os.getuid():
+                logger.warning('Query cache disabled, %s belongs to another user', directory)
+                self.directory = None
+            else:
+                os.chmod(directory, 0o700)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def key(self, uri, query, parameters):
+        content = json.dumps({'uri': uri,
+                              'query': query,
+                              'parameters': parameters,
+                              'release': self.release},
+                             sort_keys=True,
+                             default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _read(self, fp):
+        with fp:
+            columns = pickle.load(fp)
+            while True:
+                try:
+                    values = pickle.load(fp)
+                except EOFError:
+                    return
+                yield dict(zip(columns, values))
+
+    def _write(self, path, records):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        completed = False
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                columns = None
+                for record in records:
+                    if columns is None:
+                        columns = tuple(record.keys())
+                        pickle.dump(columns, fp, pickle.HIGHEST_PROTOCOL)
+                    pickle.dump(tuple(detach(record[column]) for column in columns), fp, pickle.HIGHEST_PROTOCOL)
+                    yield record
+                if columns is None:
+                    pickle.dump((), fp, pickle.HIGHEST_PROTOCOL)
+            completed = True
+        finally:
+            if completed:
+                os.replace(tmp_path, path)
+                self.evict()
+            else:
+                os.remove(tmp_path)
+
+    def stream(self, uri, query, parameters, fetch):
+        """Returns the cached records for the query run on ``uri``, or tees ``fetch()`` into the cache."""
+        if not self.enabled:
+            return fetch()
+
+        key = self.key(uri, query, parameters)
+        path = self._path(key)
+        if not self.refresh:
+            # the entry is opened here, as another thread or process may evict it before the records are read
+            fp = None
+            try:
+                fp = open(path, 'rb')
+                os.utime(path)
+            except FileNotFoundError:
+                if fp is not None:
+                    fp.close()
+                fp = None
+            if fp is not None:
+                with self._lock:
+                    self.hits += 1
+                logger.info('Query cache hit: %s', key)
+                return self._read(fp)
+
+        with self._lock:
+            self.misses += 1
+        logger.info('Query cache miss: %s', key)
+        return self._write(path, fetch())
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.directory, '*' + self.suffix)):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for (mtime, size, path) in entries)
+            for (mtime, size, path) in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                logger.info('Evicting query cache entry %s', os.path.basename(path))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+query_cache = QueryCache()
@@ -0,0 +1,96 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _plan_to_dict(plan):
+    node = OrderedDict([('operatorType', plan.operator_type),
+                        ('identifiers', list(plan.identifiers)),
+                        ('arguments', dict(plan.arguments))])
+    if hasattr(plan, 'db_hits'):
+        node['dbHits'] = plan.db_hits
+        node['rows'] = plan.rows
+    node['children'] = [_plan_to_dict(child) for child in plan.children]
+    return node
+
+
+def _total_db_hits(plan):
+    return plan.db_hits + sum(_total_db_hits(child) for child in plan.children)
+
+
+class QueryProfiler:
+    """Collects the result summary of every query run while profiling is on.
+
+    With ``plans`` enabled queries are prefixed with ``PROFILE`` so the
+    summary also carries the executed plan and its db hits, at the cost of
+    slower queries.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.plans = False
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def configure(self, enabled, plans=False):
+        self.enabled = enabled
+        self.plans = enabled and plans
+
+    def prepare(self, query):
+        if self.plans:
+            return 'PROFILE ' + query
+        return query
+
+    def record(self, name, query, parameters, rows, elapsed, summary):
+        entry = OrderedDict([('name', name),
+                             ('parameters', parameters),
+                             ('rows', rows),
+                             ('resultAvailableAfterMs', summary.result_available_after),
+                             ('resultConsumedAfterMs', summary.result_consumed_after),
+                             ('clientElapsedMs', int(elapsed * 1000)),
+                             ('dbHits', None),
+                             ('query', query)])
+        if summary.profile is not None:
+            entry['dbHits'] = _total_db_hits(summary.profile)
+            entry['plan'] = _plan_to_dict(summary.profile)
+        logger.info('Query %s: %d rows, available after %sms, consumed after %sms, %s db hits',
+                    name, rows, entry['resultAvailableAfterMs'], entry['resultConsumedAfterMs'], entry['dbHits'])
+        with self._lock:
+            self.entries.append(entry)
+
+    def drain(self):
+        """Returns the collected entries and forgets them."""
+        with self._lock:
+            (entries, self.entries) = (self.entries, [])
+        return entries
+
+    def extend(self, entries):
+        with self._lock:
+            self.entries.extend(entries)
+
+    def totals(self):
+        totals = OrderedDict()
+        for entry in self.entries:
+            total = totals.setdefault(entry['name'], OrderedDict([('executions', 0),
+                                                                  ('rows', 0),
+                                                                  ('resultAvailableAfterMs', 0),
+                                                                  ('resultConsumedAfterMs', 0),
+                                                                  ('clientElapsedMs', 0),
+                                                                  ('dbHits', None)]))
+            total['executions'] += 1
+            for key in ('rows', 'resultAvailableAfterMs', 'resultConsumedAfterMs', 'clientElapsedMs'):
+                total[key] += entry[key] or 0
+            if entry['dbHits'] is not None:
+                total['dbHits'] = (total['dbHits'] or 0) + entry['dbHits']
+        return totals
+
+    def write_report(self, filepath):
+        with open(filepath, 'w') as report_file:
+            json.dump({'totals': self.totals(), 'queries': self.entries}, report_file, indent=4, default=str)
+        logger.info('Query profile written to %s', filepath)
+
+
+query_profiler = QueryProfiler()
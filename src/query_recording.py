@@ -0,0 +1,118 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+
+from neo4j.types.graph import Node
+
+from query_cache import DetachedNode
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    if isinstance(value, (Node, DetachedNode)):
+        return {'$node': {'id': value.id,
+                          'labels': sorted(value.labels),
+                          'properties': _encode(dict(value))}}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _encode(item)) for (key, item) in value.items())
+    return value
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$node' in obj:
+        node = obj['$node']
+        return DetachedNode(node['labels'], node['properties'], node['id'])
+    return obj
+
+
+def write_recording(path, records):
+    """Writes records to a gzipped JSON lines recording, yielding them as they are written."""
+    directory = os.path.dirname(path) or '.'
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    completed = False
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', compresslevel=6) as fp:
+            for record in records:
+                fp.write(json.dumps(_encode(record), default=str))
+                fp.write('\n')
+                yield record
+        completed = True
+    finally:
+        if completed:
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+
+
+def read_recording(path):
+    with gzip.open(path, 'rt') as fp:
+        for line in fp:
+            yield json.loads(line, object_hook=_decode_object)
+
+
+class ReplayDataSource:
+    """Serves the records of a recorded query stream from disk."""
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    def __repr__(self):
+        return '<{}({!r})>'.format(self.__class__.__qualname__, self.path)
+
+    def __iter__(self):
+        return read_recording(self.path)
+
+
+class QueryRecorder:
+    """Records every query stream to, or replays it from, a directory.
+
+    Each stream is stored as ``<name>-<hash>.jsonl.gz`` where the hash
+    covers the query text and parameters, so a recording made by one run
+    can be replayed by another without a database.
+    """
+
+    suffix = '.jsonl.gz'
+
+    def __init__(self):
+        self.record_directory = None
+        self.replay_directory = None
+
+    def configure(self, record_directory=None, replay_directory=None):
+        self.record_directory = record_directory
+        self.replay_directory = replay_directory
+        if record_directory:
+            os.makedirs(record_directory, exist_ok=True)
+
+    @property
+    def replaying(self):
+        return bool(self.replay_directory)
+
+    def filename(self, name, query, parameters):
+        content = json.dumps({'query': query, 'parameters': parameters}, sort_keys=True, default=str)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+        return re.sub(r'[^\w.-]+', '_', name) + '-' + digest + self.suffix
+
+    def record(self, name, query, parameters, records):
+        if not self.record_directory:
+            return records
+        path = os.path.join(self.record_directory, self.filename(name, query, parameters))
+        logger.info('Recording query %s to %s', name, path)
+        return write_recording(path, records)
+
+    def replay(self, name, query, parameters):
+        path = os.path.join(self.replay_directory, self.filename(name, query, parameters))
+        if not os.path.exists(path):
+            raise FileNotFoundError('No recording of query {} at {}'.format(name, path))
+        logger.info('Replaying query %s from %s', name, path)
+        return iter(ReplayDataSource(path, name))
+
+
+query_recorder = QueryRecorder()
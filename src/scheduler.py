@@ -0,0 +1,163 @@
+import time
+import logging
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from data_source import drivers
+from query_cache import query_cache
+from query_profile import query_profiler
+
+logger = logging.getLogger(__name__)
+
+# set in the worker processes of a Scheduler, see in_worker_process
+_in_worker_process = False
+
+
+def _mark_worker_process():
+    global _in_worker_process
+    _in_worker_process = True
+
+
+def in_worker_process():
+    """Returns whether this process is a worker of a :class:`Scheduler`.
+
+    Pools started by a job would multiply the processes of every level, so
+    jobs run them in-process instead.
+    """
+    return _in_worker_process
+
+
+def pool_workers(workers):
+    """Returns the number of processes a pool of ``workers`` is given, 0 in a Scheduler worker."""
+    return 0 if _in_worker_process else int(workers or 0)
+
+
+def run_job(name, function, args):
+    """Runs one generator, turning any failure (including ``exit(-1)``) into a result.
+
+    The query profile entries and cache counters collected by the job are
+    handed back with the result so the parent process can report on them.
+    """
+    result = OrderedDict([('name', name),
+                          ('status', 'ok'),
+                          ('started', time.time()),
+                          ('elapsed', None),
+                          ('error', None)])
+    (hits, misses) = (query_cache.hits, query_cache.misses)
+    try:
+        function(*args)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result['status'] = 'failed'
+            result['error'] = 'exit({})'.format(e.code)
+    except Exception as e:
+        logger.error('Generating %s failed:\n%s', name, traceback.format_exc())
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(e.__class__.__name__, e)
+    result['elapsed'] = time.time() - result['started']
+    result['profile'] = query_profiler.drain()
+    result['cache_hits'] = query_cache.hits - hits
+    result['cache_misses'] = query_cache.misses - misses
+    return result
+
+
+class JobLogFilter(logging.Filter):
+    """Prefixes every log message with the name of the job being run."""
+
+    def __init__(self, name):
+        super().__init__()
+        self.job = name
+
+    def filter(self, record):
+        if getattr(record, 'job', None) != self.job:
+            record.job = self.job
+            record.msg = '[{}] {}'.format(self.job, record.msg)
+        return True
+
+
+def _tag_logs(name):
+    for handler in logging.getLogger().handlers:
+        for log_filter in [f for f in handler.filters if isinstance(f, JobLogFilter)]:
+            handler.removeFilter(log_filter)
+        if name is not None:
+            handler.addFilter(JobLogFilter(name))
+
+
+def _run_job_in_worker(name, function, args):
+    _tag_logs(name)
+    try:
+        return run_job(name, function, args)
+    finally:
+        for (uri, stats) in drivers.statistics().items():
+            logger.info('Neo4j driver pool usage for %s: %s', uri, stats)
+        drivers.close_all()
+        _tag_logs(None)
+
+
+class Scheduler:
+    """Runs independent generators concurrently, each in a worker process.
+
+    With ``workers`` set to 1 the jobs run one after another in the calling
+    process, as they do when called from a job of another Scheduler running
+    in a worker process. Either way a failing job does not stop the others; the outcome
+    of every job is returned by :meth:`run`. Log messages of jobs run in
+    worker processes are prefixed with the job name.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(1, int(workers))
+        self.jobs = []
+
+    def add(self, name, function, *args):
+        self.jobs.append((name, function, args))
+
+    def _collect(self, result, from_worker=False):
+        """
+
+        :param from_worker: whether the job ran in a worker process, whose cache counters
+                            are added to the ones of this process
+        """
+        query_profiler.extend(result.pop('profile'))
+        (hits, misses) = (result.pop('cache_hits'), result.pop('cache_misses'))
+        if from_worker:
+            query_cache.hits += hits
+            query_cache.misses += misses
+        if result['status'] == 'ok':
+            logger.info('Generated %s in %.1fs', result['name'], result['elapsed'])
+        else:
+            logger.error('Generating %s failed after %.1fs: %s', result['name'], result['elapsed'], result['error'])
+        return result
+
+    def run(self):
+        if self.workers == 1 or len(self.jobs) <= 1 or in_worker_process():
+            return [self._collect(run_job(name, function, args)) for (name, function, args) in self.jobs]
+
+        logger.info('Running %d jobs with %d workers', len(self.jobs), self.workers)
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(self.jobs)), mp_context=context,
+                                 initializer=_mark_worker_process) as executor:
+            futures = [(name, executor.submit(_run_job_in_worker, name, function, args))
+                       for (name, function, args) in self.jobs]
+            results = []
+            for (name, future) in futures:
+                try:
+                    results.append(self._collect(future.result(), from_worker=True))
+                except Exception as e:
+                    # the job could not be sent to a worker or the worker process died
+                    logger.error('Could not run %s: %s', name, e)
+                    results.append(OrderedDict([('name', name),
+                                                ('status', 'failed'),
+                                                ('started', None),
+                                                ('elapsed', None),
+                                                ('error', '{}: {}'.format(e.__class__.__name__, e))]))
+        return results
+
+
+def format_timing_table(results):
+    lines = ['{:<30} {:<8} {:>10}  {}'.format('Generator', 'Status', 'Elapsed', 'Error')]
+    for result in results:
+        elapsed = '-' if result['elapsed'] is None else time.strftime('%H:%M:%S', time.gmtime(result['elapsed']))
+        lines.append('{:<30} {:<8} {:>10}  {}'.format(result['name'], result['status'], elapsed, result['error'] or ''))
+    return '\n'.join(line.rstrip() for line in lines)
@@ -0,0 +1,321 @@
+"""
+.. module:: synthetic_data
+    :platform: any
+    :synopsis: Synthetic query records for load testing the file generators
+.. moduleauthor:: AGR consortium
+
+Every factory yields records shaped like the rows of the matching query in
+``app.py``. Sizes are configurable and the output is deterministic for a
+given seed, so a :class:`SyntheticDataSource` can stand in for a
+``DataSource`` at any scale.
+"""
+
+import random
+import string
+
+from query_cache import DetachedNode
+
+
+# taxon ID, species name, data provider, assembly, relative share of records
+SPECIES = [('NCBITaxon:10090', 'Mus musculus', 'MGI', 'GRCm39', 25),
+           ('NCBITaxon:10116', 'Rattus norvegicus', 'RGD', 'mRatBN7.2', 15),
+           ('NCBITaxon:7955', 'Danio rerio', 'ZFIN', 'GRCz11', 20),
+           ('NCBITaxon:7227', 'Drosophila melanogaster', 'FB', 'R6', 20),
+           ('NCBITaxon:6239', 'Caenorhabditis elegans', 'WB', 'WBcel235', 10),
+           ('NCBITaxon:559292', 'Saccharomyces cerevisiae', 'SGD', 'R64-2-1', 5),
+           ('NCBITaxon:9606', 'Homo sapiens', 'HUMAN', 'GRCh38', 5)]
+
+SO_TERMS = ['point_mutation', 'point_mutation', 'point_mutation', 'deletion', 'insertion', 'delins', 'MNV']
+
+IMPACTS = ['HIGH', 'MODERATE', 'LOW', 'MODIFIER']
+
+CONSEQUENCES = ['missense_variant', 'stop_gained', 'frameshift_variant',
+                'intron_variant', 'synonymous_variant', 'splice_region_variant,intron_variant']
+
+ASSOCIATION_TYPES = ['IS_IMPLICATED_IN', 'is_model_of', 'is_implicated_in', 'is_biomarker_for',
+                     'implicated_via_orthology', 'biomarker_via_orthology']
+
+EVIDENCE_CODES = [('ECO:0000033', 'author statement supported by traceable reference'),
+                  ('ECO:0000250', 'sequence similarity evidence used in manual assertion'),
+                  ('ECO:0000266', 'sequence orthology evidence used in manual assertion'),
+                  ('ECO:0000501', 'evidence used in automatic assertion')]
+
+EXPRESSION_EDGES = ['ANATOMICAL_STRUCTURE', 'CELLULAR_COMPONENT', 'ANATOMICAL_SUB_SUBSTRUCTURE',
+                    'CELLULAR_COMPONENT_QUALIFIER', 'ANATOMICAL_SUB_STRUCTURE_QUALIFIER', 'ANATOMICAL_STRUCTURE_QUALIFIER']
+
+
+def _species_picker(rng, species_weights):
+    weights = species_weights or dict((taxon_id, share) for (taxon_id, _, _, _, share) in SPECIES)
+    species = [record for record in SPECIES if record[0] in weights]
+    cumulative = []
+    total = 0
+    for record in species:
+        total += weights[record[0]]
+        cumulative.append(total)
+    return lambda: rng.choices(species, cum_weights=cumulative)[0]
+
+
+def _sequence(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def _symbol(rng, prefix=''):
+    return prefix + ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 6))) + str(rng.randint(1, 99))
+
+
+def _date(rng):
+    return '20{:02d}-{:02d}-{:02d}'.format(rng.randint(5, 21), rng.randint(1, 12), rng.randint(1, 28))
+
+
+def species(rng):
+    for (order, (taxon_id, name, _, _, _)) in enumerate(SPECIES):
+        yield {'s': DetachedNode(['Species'], {'primaryKey': taxon_id,
+                                               'name': name,
+                                               'phylogeneticOrder': order})}
+
+
+def assemblies(rng):
+    for (_, _, _, assembly, _) in SPECIES:
+        yield {'assemblyID': assembly}
+
+
+def variants(rng, assembly='GRCz11', chromosomes=25, variants_per_chromosome=1000,
+             consequences_per_variant=2, chromosome=None):
+    """Rows of the VCF variant query, unordered across chromosomes like the real query."""
+    (taxon_id, species_name, provider, _, _) = next((record for record in SPECIES if record[3] == assembly), SPECIES[0])
+    chromosome_names = [str(number) for number in range(1, chromosomes + 1)]
+    if chromosome is not None:
+        chromosome_names = [chromosome]
+    rows = [(name, index) for name in chromosome_names for index in range(variants_per_chromosome)]
+    rng.shuffle(rows)
+    for (serial, (chromosome_name, index)) in enumerate(rows):
+        so_term = rng.choice(SO_TERMS)
+        start = rng.randint(2, 50000000)
+        if so_term == 'deletion':
+            reference = _sequence(rng, rng.randint(1, 12))
+            variant = ''
+        elif so_term == 'insertion':
+            reference = ''
+            variant = _sequence(rng, rng.randint(1, 12))
+        elif so_term == 'delins':
+            reference = _sequence(rng, rng.randint(1, 8))
+            variant = _sequence(rng, rng.randint(0, 8))
+        elif so_term == 'MNV':
+            reference = _sequence(rng, 3)
+            variant = _sequence(rng, 2) + rng.choice('RYSWKMBDHV')
+        else:
+            reference = rng.choice('ACGT')
+            variant = rng.choice('ACGT')
+        variant_id = '{}:{}:{}:{}'.format(provider, chromosome_name, start, serial)
+        allele_id = '{}:ALLELE-{}-{}'.format(provider, chromosome_name, index)
+        gene_consequences = []
+        transcript_consequences = []
+        for consequence in range(consequences_per_variant):
+            gene_id = '{}:GENE-{}'.format(provider, rng.randint(1, 20000))
+            gene_consequences.append({'gene': gene_id,
+                                      'geneSymbol': _symbol(rng),
+                                      'consequence': rng.choice(CONSEQUENCES),
+                                      'impact': rng.choice(IMPACTS)})
+            transcript_consequences.append({'transcript': gene_id + '-T' + str(consequence),
+                                            'transcriptGFF3ID': 'transcript:' + gene_id,
+                                            'transcriptGFF3Name': _symbol(rng) + '-201',
+                                            'consequence': rng.choice(CONSEQUENCES),
+                                            'impact': rng.choice(IMPACTS)})
+        yield {'chromosome': chromosome_name,
+               'variantID': variant_id,
+               'globalId': variant_id,
+               'paddingLeft': rng.choice('ACGT'),
+               'genomicReferenceSequence': reference,
+               'genomicVariantSequence': variant,
+               'hgvsNomenclature': 'NC_{}.1:g.{}{}>{}'.format(chromosome_name, start, reference, variant),
+               'dataProvider': provider,
+               'assembly': assembly,
+               'alleles': [{'symbol': _symbol(rng, 'a<sup>') + '</sup>',
+                            'symbolText': _symbol(rng, 'a'),
+                            'id': allele_id}],
+               'geneConsequences': gene_consequences,
+               'transcriptConsequences': transcript_consequences,
+               'start': start,
+               'end': start + max(len(reference), 1) - 1,
+               'species': species_name,
+               'soTerm': so_term}
+
+
+def orthology(rng, orthologs=10000, species_weights=None):
+    pick = _species_picker(rng, species_weights)
+    algorithms = ['Ensembl Compara', 'HGNC', 'Hieranoid', 'InParanoid', 'OMA', 'OrthoFinder',
+                  'OrthoInspector', 'PANTHER', 'PhylomeDB', 'TreeFam', 'ZFIN']
+    for index in range(orthologs):
+        species1 = pick()
+        species2 = pick()
+        matched = rng.sample(algorithms, rng.randint(1, len(algorithms)))
+        yield {'gene1ID': '{}:{}'.format(species1[2], index),
+               'gene1Symbol': _symbol(rng),
+               'gene2ID': '{}:{}'.format(species2[2], rng.randint(1, 30000)),
+               'gene2Symbol': _symbol(rng),
+               'Algorithms': matched,
+               'numAlgorithmMatch': len(matched),
+               'numAlgorithmNotMatched': rng.randint(0, len(algorithms) - len(matched)),
+               'best': rng.choice(['Yes', 'No']),
+               'bestRev': rng.choice(['Yes', 'No']),
+               'species1TaxonID': species1[0],
+               'species1Name': species1[1],
+               'species2TaxonID': species2[0],
+               'species2Name': species2[1]}
+
+
+def disease(rng, associations=10000, evidence_per_association=3, species_weights=None):
+    pick = _species_picker(rng, species_weights)
+    object_types = [['Gene'], ['Feature'], ['AffectedGenomicModel']]
+    for index in range(associations):
+        (taxon_id, species_name, provider, _, _) = pick()
+        association_type = rng.choice(ASSOCIATION_TYPES)
+        with_orthologs = []
+        if association_type.endswith('via_orthology'):
+            with_orthologs = ['HGNC:{}'.format(rng.randint(1, 50000)) for _ in range(rng.randint(1, 3))]
+        evidence = []
+        for _ in range(evidence_per_association):
+            (code, code_name) = rng.choice(EVIDENCE_CODES)
+            inferred_from = None
+            if rng.random() < 0.3:
+                inferred_from = DetachedNode(['Allele'], {'primaryKey': '{}:ALLELE-{}'.format(provider, rng.randint(1, 90000)),
+                                                          'symbol': _symbol(rng)})
+            evidence.append({'pubModID': '{}:REF-{}'.format(provider, rng.randint(1, 90000)),
+                             'pubMedID': 'PMID:{}'.format(rng.randint(1, 3000000)) if rng.random() < 0.8 else None,
+                             'evidenceCode': code,
+                             'evidenceCodeName': code_name,
+                             'inferredFromEntity': inferred_from,
+                             'otherAssociatedEntityID': 'MGI:{}'.format(index) if rng.random() < 0.05 else None})
+        yield {'dejID': '{}:DEJ-{:08d}'.format(provider, index),
+               'taxonId': taxon_id,
+               'speciesName': species_name,
+               'withOrthologs': with_orthologs,
+               'objectType': rng.choice(object_types),
+               'dbObjectID': '{}:{}'.format(provider, rng.randint(1, 90000)),
+               'dbObjectSymbol': _symbol(rng),
+               'dbObjectName': _symbol(rng),
+               'associationType': association_type.lower(),
+               'DOID': 'DOID:{}'.format(rng.randint(1, 100000)),
+               'DOtermName': _symbol(rng) + ' disease',
+               'evidence': evidence,
+               'dateAssigned': _date(rng),
+               'dataProvider': provider}
+
+
+def expression(rng, expressions=10000, species_weights=None):
+    pick = _species_picker(rng, species_weights)
+    for index in range(expressions):
+        (taxon_id, species_name, provider, _, _) = pick()
+        terms = [DetachedNode(['Publication'], {'pubMedId': 'PMID:{}'.format(rng.randint(1, 3000000)),
+                                                'pubModId': '{}:REF-{}'.format(provider, rng.randint(1, 90000))}),
+                 DetachedNode(['Stage', 'Ontology'], {'primaryKey': 'UBERON:{}'.format(rng.randint(1, 9999)),
+                                                      'name': _symbol(rng) + ' stage'}),
+                 DetachedNode(['MMOTerm', 'Ontology'], {'primaryKey': 'MMO:{:07d}'.format(rng.randint(1, 700)),
+                                                        'name': rng.choice(['RNA in situ', 'immunohistochemistry', 'RT-PCR'])})]
+        if rng.random() < 0.5:
+            terms.append(DetachedNode(['CrossReference'], {'crossRefCompleteUrl': 'https://example.org/{}'.format(index)}))
+        ontology_paths = []
+        for edge in rng.sample(EXPRESSION_EDGES, rng.randint(1, 3)):
+            ontology_paths.append({'edge': edge,
+                                   'primaryKey': 'UBERON:{}'.format(rng.randint(1, 99999)),
+                                   'name': _symbol(rng)})
+        yield {'species': {'primaryKey': taxon_id, 'name': species_name},
+               'gene': {'primaryKey': '{}:{}'.format(provider, rng.randint(1, 30000)),
+                        'symbol': _symbol(rng),
+                        'dataProvider': provider},
+               'terms': terms,
+               'begejId': 'BEGEJ:{}'.format(index),
+               'location': _symbol(rng) + ' ' + _symbol(rng),
+               'ontologyPaths': ontology_paths}
+
+
+def db_summary(rng, labels=200):
+    for index in range(labels):
+        entity_types = ['Label{}'.format(index)]
+        if rng.random() < 0.3:
+            entity_types.append('Parent{}'.format(index % 10))
+        yield {'frequency': rng.randint(1, 10000000), 'entityTypes': entity_types}
+
+
+def gene_cross_references(rng, cross_references=10000, species_weights=None):
+    pick = _species_picker(rng, species_weights)
+    for index in range(cross_references):
+        (taxon_id, _, provider, _, _) = pick()
+        yield {'GeneID': '{}:{}'.format(provider, rng.randint(1, 30000)),
+               'GlobalCrossReferenceID': 'NCBI_Gene:{}'.format(index),
+               'CrossReferenceCompleteURL': 'https://www.ncbi.nlm.nih.gov/gene/{}'.format(index),
+               'ResourceDescriptorPage': 'default',
+               'TaxonID': taxon_id}
+
+
+def uniprot_cross_references(rng, cross_references=10000, species_weights=None):
+    pick = _species_picker(rng, species_weights)
+    for index in range(cross_references):
+        provider = pick()[2]
+        yield {'GeneID': '{}:{}'.format(provider, rng.randint(1, 30000)),
+               'GlobalCrossReferenceID': 'UniProtKB:P{:05d}'.format(index)}
+
+
+def human_genes_interacting_with(rng, genes=500):
+    for index in range(genes):
+        yield {'GeneID': 'HGNC:{}'.format(index), 'Symbol': _symbol(rng).upper(), 'Name': _symbol(rng) + ' protein'}
+
+
+def allele_gff(rng, assembly='GRCz11', alleles=5000, variants_per_allele=3, chromosomes=25):
+    for row in sorted(({'chromosome': str(rng.randint(1, chromosomes)), 'index': index} for index in range(alleles)),
+                      key=lambda row: row['chromosome']):
+        allele_variants = []
+        for variant_index in range(variants_per_allele):
+            start = rng.randint(2, 50000000)
+            so_term = rng.choice(SO_TERMS)
+            reference = _sequence(rng, rng.randint(1, 6))
+            allele_variants.append({'ID': 'VARIANT-{}-{}'.format(row['index'], variant_index),
+                                    'genomicVariantSequence': _sequence(rng, rng.randint(0, 6)),
+                                    'genomicReferenceSequence': reference,
+                                    'soTerm': so_term,
+                                    'start': start,
+                                    'end': start + len(reference) - 1,
+                                    'chromosome': row['chromosome'],
+                                    'geneLevelConsequences': [{'geneID': 'GENE-{}'.format(rng.randint(1, 30000)),
+                                                               'geneSymbol': _symbol(rng),
+                                                               'geneLevelConsequence': rng.choice(CONSEQUENCES),
+                                                               'impact': rng.choice(IMPACTS)}]})
+        yield {'chromosome': row['chromosome'],
+               'ID': 'ALLELE-{}'.format(row['index']),
+               'symbol': _symbol(rng, 'a'),
+               'symbol_text': _symbol(rng, 'a'),
+               'variants': allele_variants}
+
+
+FACTORIES = {'species': species,
+             'assemblies': assemblies,
+             'variants': variants,
+             'orthology': orthology,
+             'disease': disease,
+             'expression': expression,
+             'db-summary': db_summary,
+             'gene-cross-reference': gene_cross_references,
+             'uniprot': uniprot_cross_references,
+             'human-genes-interacting-with': human_genes_interacting_with,
+             'allele-gff': allele_gff}
+
+
+class SyntheticDataSource:
+    """Drop-in replacement for a DataSource that yields synthetic records.
+
+    Iterating twice yields the same records again, as re-running a query
+    would.
+    """
+
+    def __init__(self, kind, seed=0, **options):
+        self.kind = kind
+        self.name = kind
+        self.seed = seed
+        self.options = options
+        self.factory = FACTORIES[kind]
+
+    def __repr__(self):
+        return '<{}({!r}, seed={!r}, {!r})>'.format(self.__class__.__qualname__, self.kind, self.seed, self.options)
+
+    def __iter__(self):
+        return self.factory(random.Random(self.seed), **self.options)
@@ -1,7 +1,7 @@
 import os
 import logging
-import json
 
+from json_codec import json_codec
 from jsonschema import validate
 from jsonschema import ValidationError
 from jsonschema import SchemaError
@@ -16,11 +16,11 @@ class JsonValidator:
 
     def validateJSON(self):
         logger.info("validating " + self.filepath)
-        with open(self.filepath, "r") as jsonFile:
+        with open(self.filepath, "rb") as jsonFile:
             schema_filepath = os.path.join("./schemas/", self.schema) + '.schema'
-            with open(schema_filepath, "r") as schemaFile:
+            with open(schema_filepath, "rb") as schemaFile:
                 try:
-                    validate(json.load(jsonFile), json.load(schemaFile))
+                    validate(json_codec.load(jsonFile), json_codec.load(schemaFile))
                     logger.info("successfully validated against '%s'" % schema_filepath)
                 except SchemaError as e:
                     logger.error(e)
@@ -1,10 +1,10 @@
+import os
+import gzip
 import ntpath
 import logging
-import collections
-from operator import itemgetter
 from collections import OrderedDict
-from itertools import groupby
 from common import run_command
+from writers import IndexedVcfReader
 
 logger = logging.getLogger(name=__name__)
 
@@ -35,79 +35,106 @@ EXAMPLE_CASES = {
 
 
 class VcfValidator:
+    """Checks a generated VCF file in a single pass over its data lines.
 
-    def __init__(self, filepath):
+    Records are checked one at a time as they are read, so only the IDs seen
+    so far and the examples not found yet are kept in memory. A .vcf.gz file
+    is decompressed as it is read; when it has a tabix index the examples are
+    looked up by region first, which checks the index as well.
+    """
+
+    col_headers = ('CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO')
+
+    def __init__(self, filepath, full_scan=True):
+        """
+
+        :param filepath: .vcf or .vcf.gz file
+        :param full_scan: also read every record to check their order and IDs, otherwise
+                          only the examples are looked up through the tabix index
+        """
         self.filepath = filepath
         self.filename = ntpath.basename(filepath)
         self.assembly = self.filename.split('-')[0]
+        self.full_scan = full_scan
+        self.start_validation()
+
+    def start_validation(self):
+        # examples not found yet, by ID
+        self.examples = OrderedDict((example['ID'], example) for example in EXAMPLE_CASES.get(self.assembly, ()))
+        self.previous_record = None
+        self.seen_ids = set()
+        self.duplicate_ids = set()
 
     def parse_vcf_file(self, path):
-        """
+        """Yields the data lines of the file one by one, as dicts of column name to value.
 
         :param path:
         :return:
         """
 
-        data = []
         headers = []
-        with open(path, 'rt') as fp:
+        with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'rt')) as fp:
             for line in fp:
                 if line.startswith('##'):
                     continue
                 if line.startswith('#'):
-                    cols = line[1:].split('\t')
-                    headers.extend(cols)
+                    headers = line[1:].rstrip('\n').split('\t')
                     continue
-                else:
-                    cols = line.split('\t')
-                data.append(OrderedDict(zip(headers, cols)))
-        return data
-
-    def check_examples(self, parsed_vcf):
-        examples = EXAMPLE_CASES.get(self.assembly)
-        if not examples:
-            logger.info('No examples for ' + self.filename + ', skipping ...')
-        else:
-            logger.info('Checking against examples')
-            found = False
-            for example in examples:
-                for vcf_record in parsed_vcf:
-                    if vcf_record['ID'] == example['ID']:
-                        found = True
-                        for key in example.keys():
-                            if example[key] != vcf_record[key]:
-                                logger.error('Mismatch between example and parsed VCF record')
-                                logger.error("key mismatch: " + key)
-                                logger.error("example value: " + example[key])
-                                logger.error("VCF record value: " + vcf_record[key])
-                                exit(-1)
-                if not found:
-                    logger.error('No matching VCF data found for example with id: ' + example['ID'])
-                    exit(-1)
-
-    def check_sorted_by_chromosome_and_position(self, parsed_vcf):
-        select_chromosome = itemgetter('CHROM')
-        chromosomes = list(map(select_chromosome, parsed_vcf))
-        assert chromosomes == sorted(chromosomes), 'Chromosomes not alphabetically sorted'
-        for (chromo, recs) in groupby(parsed_vcf, select_chromosome):
-            row = list(recs)
-            positions = list(int(col['POS']) for col in row)
-            if positions != sorted(positions):
-                logger.error('Positions are not sorted in correct order')
+                yield dict(zip(headers, line.rstrip('\n').split('\t')))
+
+    def check_example(self, vcf_record):
+        example = self.examples.pop(vcf_record['ID'], None)
+        if example is None:
+            return
+        for key in example.keys():
+            if example[key] != vcf_record[key]:
+                logger.error('Mismatch between example and parsed VCF record')
+                logger.error("key mismatch: " + key)
+                logger.error("example value: " + example[key])
+                logger.error("VCF record value: " + vcf_record[key])
                 exit(-1)
 
-        logger.info('Sorted by chromosome and position')
+    def check_examples_by_region(self, reader):
+        for example in list(self.examples.values()):
+            position = int(example['POS'])
+            for line in reader.fetch(example['CHROM'], position - 1, position):
+                vcf_record = dict(zip(self.col_headers, line.rstrip('\n').split('\t')))
+                if vcf_record['ID'] == example['ID']:
+                    self.check_example(vcf_record)
+
+    def check_examples_found(self):
+        for example_id in self.examples:
+            logger.error('No matching VCF data found for example with id: ' + example_id)
+            exit(-1)
+
+    def check_sorted_by_chromosome_and_position(self, vcf_record):
+        """Compares the record with the one before it."""
+        record = (vcf_record['CHROM'], int(vcf_record['POS']))
+        previous_record = self.previous_record
+        self.previous_record = record
+        if previous_record is None:
+            return
+        if record[0] < previous_record[0]:
+            logger.error('Chromosomes not alphabetically sorted: %r after %r', record[0], previous_record[0])
+            exit(-1)
+        if record[0] == previous_record[0] and record[1] < previous_record[1]:
+            logger.error('Positions are not sorted in correct order: %r after %r on chromosome %r',
+                         record[1], previous_record[1], record[0])
+            exit(-1)
 
-    def check_duplicate_entries(self, parsed_vcf):
-        all_entries = []
-        for variant in parsed_vcf:
-            all_entries.append(variant['ID'])
+    def check_duplicate_entries(self, vcf_record):
+        variant_id = vcf_record['ID']
+        if variant_id in self.seen_ids:
+            self.duplicate_ids.add(variant_id)
+        else:
+            self.seen_ids.add(variant_id)
 
-        if len(all_entries) == len(set(all_entries)):
+    def report_duplicate_entries(self):
+        if not self.duplicate_ids:
             logger.info("No duplicate enteries")
         else:
             logger.error("At least one Duplicate entery")
-            logger.error([item for item, count in collections.Counter(all_entries).items() if count > 1])
+            logger.error(sorted(self.duplicate_ids))
             exit(-1)
 
     def run_vcf_validator_cmd(filepath):
@@ -122,8 +149,28 @@ class VcfValidator:
     def validate_vcf(self):
         logger.info("Validating VCF: %s" % self.filename)
 
-        parsed_vcf = self.parse_vcf_file(self.filepath)
-
-        self.check_examples(parsed_vcf)
-        self.check_sorted_by_chromosome_and_position(parsed_vcf)
-        self.check_duplicate_entries(parsed_vcf)
+        self.start_validation()
+        if not self.examples:
+            logger.info('No examples for ' + self.filename + ', skipping ...')
+        else:
+            logger.info('Checking against examples')
+        index_path = self.filepath + '.tbi'
+        if self.examples and self.filepath.endswith('.gz') and os.path.exists(index_path):
+            logger.info('Looking up examples through ' + ntpath.basename(index_path))
+            with IndexedVcfReader(self.filepath, index_path) as reader:
+                self.check_examples_by_region(reader)
+            self.check_examples_found()
+        elif self.examples and not self.full_scan:
+            logger.error('No tabix index for ' + self.filename + ' to look up the examples in')
+            exit(-1)
+        if not self.full_scan:
+            logger.info('Skipping the order and duplicate checks of ' + self.filename)
+            return
+
+        for vcf_record in self.parse_vcf_file(self.filepath):
+            self.check_example(vcf_record)
+            self.check_sorted_by_chromosome_and_position(vcf_record)
+            self.check_duplicate_entries(vcf_record)
+        self.check_examples_found()
+        logger.info('Sorted by chromosome and position')
+        self.report_duplicate_entries()
@@ -0,0 +1,5 @@
+from .bgzf import BgzfReader, BgzfWriter
+from .json_data import JsonDataWriter
+from .partitioned import PartitionedDataWriter, TsvDataWriter
+from .tabix import TabixIndex
+from .vcf import IndexedVcfReader, IndexedVcfWriter, PlainVcfWriter
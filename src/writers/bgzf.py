@@ -0,0 +1,226 @@
+"""
+.. module:: bgzf
+    :platform: any
+    :synopsis: Writer and reader of BGZF (blocked gzip) files as produced by bgzip
+.. moduleauthor:: AGR consortium
+
+A BGZF file is a series of gzip members of at most 64kb each, carrying their
+compressed size in a ``BC`` extra field, followed by an empty EOF block. A
+position in the file is addressed by a virtual offset: the file offset of a
+block shifted left by 16 bits, or'ed with the offset within its uncompressed
+data.
+"""
+
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# uncompressed bytes per block, the same as htslib so that incompressible
+# data still fits in a 64kb block
+BLOCK_SIZE = 0xff00
+
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN, SI1, SI2, SLEN, BSIZE
+_HEADER = struct.Struct('<BBBBIBBHBBHH')
+_TRAILER = struct.Struct('<II')
+
+
+def compress_block(data, compresslevel=6):
+    """Returns ``data`` (at most BLOCK_SIZE bytes) as one BGZF block."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = _HEADER.size + len(compressed) + _TRAILER.size
+    return b''.join([_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1),
+                     compressed,
+                     _TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data))])
+
+
+class BgzfWriter:
+    """Compresses written bytes into BGZF blocks as each block fills up.
+
+    With ``threads`` above 1 full blocks are compressed on a thread pool
+    (zlib releases the GIL) and written in order, with at most two blocks
+    per thread in flight. The file offset of a block is then only known
+    once it has been written, so positions are taken with :meth:`tell_block`,
+    which numbers blocks instead, and turned into virtual offsets with
+    :meth:`resolve` once those blocks are out.
+    """
+
+    def __init__(self, file, compresslevel=6, threads=1):
+        if isinstance(file, str):
+            self.fileobj = open(file, 'wb')
+            self._owns_file = True
+        else:
+            self.fileobj = file
+            self._owns_file = False
+        self.compresslevel = compresslevel
+        self.threads = max(1, int(threads))
+        self._executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._block_number = 0
+        self._address = 0
+        # file offset of every block written, by block number
+        self.block_addresses = []
+
+    def tell_block(self):
+        """Returns the position of the next byte as ``block number << 16 | offset in block``."""
+        return (self._block_number << 16) | len(self._buffer)
+
+    def resolve(self, block_offset):
+        """Turns a :meth:`tell_block` position into a virtual offset, once its block has been written."""
+        block_number = block_offset >> 16
+        if block_number < len(self.block_addresses):
+            address = self.block_addresses[block_number]
+        elif block_number == len(self.block_addresses) and not self._pending:
+            address = self._address
+        else:
+            raise ValueError('Block {} has not been written yet'.format(block_number))
+        return (address << 16) | (block_offset & 0xffff)
+
+    def tell(self):
+        """Returns the virtual offset of the next byte, waiting for blocks still being compressed."""
+        self._write_pending()
+        return self.resolve(self.tell_block())
+
+    def _write_compressed(self, block):
+        self.block_addresses.append(self._address)
+        self.fileobj.write(block)
+        self._address += len(block)
+
+    def _write_pending(self, keep=0):
+        while len(self._pending) > keep:
+            self._write_compressed(self._pending.popleft().result())
+
+    def _write_block(self, data):
+        self._block_number += 1
+        if self._executor is None:
+            self._write_compressed(compress_block(data, self.compresslevel))
+            return
+        self._pending.append(self._executor.submit(compress_block, data, self.compresslevel))
+        self._write_pending(keep=2 * self.threads)
+
+    def append_blocks(self, file):
+        """Copies the blocks of another BGZF file as they are, leaving out its EOF block.
+
+        The current block is ended first. Returns the number of the first
+        block copied: a :meth:`tell_block` position taken while writing the
+        copied file moves by that number shifted left by 16 bits.
+        """
+        self.flush()
+        first_block = self._block_number
+        while True:
+            header = file.read(_HEADER.size)
+            if not header:
+                break
+            fields = _HEADER.unpack(header) if len(header) == _HEADER.size else ()
+            if fields[:2] != (31, 139) or fields[8:10] != (66, 67):
+                raise ValueError('Not a BGZF block at offset {} of {!r}'.format(file.tell() - len(header), file))
+            block = header + file.read(fields[-1] + 1 - _HEADER.size)
+            if block == EOF_BLOCK:
+                continue
+            self._block_number += 1
+            self._write_compressed(block)
+        return first_block
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+
+    def flush(self):
+        """Ends the current block early, so the next write starts a new one."""
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._write_pending()
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        try:
+            self.flush()
+            self.fileobj.write(EOF_BLOCK)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            if self._owns_file:
+                self.fileobj.close()
+            self.fileobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BgzfReader:
+    """Reads lines of a BGZF file starting at virtual offsets."""
+
+    def __init__(self, file):
+        if isinstance(file, str):
+            self.fileobj = open(file, 'rb')
+            self._owns_file = True
+        else:
+            self.fileobj = file
+            self._owns_file = False
+        self._address = 0
+        self._block_size = 0
+        self._data = b''
+        self._offset = 0
+
+    def _load_block(self, address):
+        self.fileobj.seek(address)
+        header = self.fileobj.read(_HEADER.size)
+        self._address = address
+        self._offset = 0
+        if not header:
+            (self._block_size, self._data) = (0, b'')
+            return False
+        fields = _HEADER.unpack(header) if len(header) == _HEADER.size else ()
+        if fields[:2] != (31, 139) or fields[8:10] != (66, 67):
+            raise ValueError('Not a BGZF block at offset {} of {!r}'.format(address, self.fileobj))
+        self._block_size = fields[-1] + 1
+        compressed = self.fileobj.read(self._block_size - _HEADER.size - _TRAILER.size)
+        self._data = zlib.decompress(compressed, -15)
+        self.fileobj.read(_TRAILER.size)
+        return True
+
+    def seek(self, virtual_offset):
+        self._load_block(virtual_offset >> 16)
+        self._offset = virtual_offset & 0xffff
+
+    def tell(self):
+        """Returns the virtual offset of the next byte."""
+        if self._offset == len(self._data) and self._block_size:
+            return (self._address + self._block_size) << 16
+        return (self._address << 16) | self._offset
+
+    def readline(self):
+        """Returns the next line including its newline, or ``b''`` at the end of the file."""
+        parts = []
+        while True:
+            end = self._data.find(b'\n', self._offset)
+            if end != -1:
+                parts.append(self._data[self._offset:end + 1])
+                self._offset = end + 1
+                return b''.join(parts)
+            parts.append(self._data[self._offset:])
+            self._offset = len(self._data)
+            if not self._load_block(self._address + self._block_size):
+                return b''.join(parts)
+
+    def close(self):
+        if self._owns_file and self.fileobj is not None:
+            self.fileobj.close()
+        self.fileobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,106 @@
+"""
+.. module:: json_data
+    :platform: any
+    :synopsis: Writer of the metadata and data JSON files of the generators
+.. moduleauthor:: AGR consortium
+
+The JSON files hold a single ``{"metadata": {...}, "data": [...]}`` object.
+:class:`JsonDataWriter` writes it one data element at a time, so the
+elements never have to be held in one list.
+"""
+
+import os
+import shutil
+import tempfile
+
+from json_codec import json_codec
+
+
+def write_json_start(file, metadata):
+    """Writes the start of a metadata and data JSON file, up to the first data element."""
+    file.write('{"metadata": ')
+    file.write(json_codec.dumps(metadata))
+    file.write(', "data": [')
+
+
+class JsonDataWriter:
+    """Writes a metadata and data JSON file one data element at a time.
+
+    With the stdlib backend of :class:`json_codec.JsonCodec` the file is
+    byte for byte what ``json.dump({'metadata': metadata, 'data': elements}, f)``
+    writes. When the metadata is only known once all elements have been
+    seen, such as the taxa they cover, leave it out here and pass it to
+    :meth:`close` instead: the elements are then spooled to a temporary
+    file next to ``filepath`` and copied after the metadata.
+    """
+
+    def __init__(self, filepath, metadata=None):
+        self.filepath = filepath
+        self.count = 0
+        # byte offsets of the data elements, once a file opened with its metadata is closed
+        self.data_start = self.data_end = None
+        if metadata is None:
+            (handle, self._spool_path) = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.',
+                                                          dir=os.path.dirname(filepath) or None)
+            self._file = os.fdopen(handle, 'w', encoding='utf-8')
+        else:
+            self._spool_path = None
+            self._file = open(filepath, 'w', encoding='utf-8')
+            write_json_start(self._file, metadata)
+            self.data_start = self._file.tell()
+
+    def write(self, element):
+        if self.count:
+            self._file.write(', ')
+        self._file.write(json_codec.dumps(element))
+        self.count += 1
+
+    def write_all(self, elements):
+        for element in elements:
+            self.write(element)
+
+    def write_encoded(self, encoded_elements):
+        """Writes data elements already encoded to JSON text."""
+        if not encoded_elements:
+            return
+        if self.count:
+            self._file.write(', ')
+        self._file.write(', '.join(encoded_elements))
+        self.count += len(encoded_elements)
+
+    def close(self, metadata=None):
+        """
+
+        :param metadata: required when it was not given when opening the file
+        """
+        if self._file is None:
+            return
+        if self._spool_path is None:
+            self.data_end = self._file.tell()
+            self._file.write(']}')
+            self._file.close()
+            self._file = None
+            return
+        self._file.close()
+        self._file = None
+        try:
+            if metadata is None:
+                raise ValueError('No metadata for ' + self.filepath)
+            with open(self.filepath, 'w', encoding='utf-8') as json_file, open(self._spool_path, encoding='utf-8') as spool:
+                write_json_start(json_file, metadata)
+                shutil.copyfileobj(spool, json_file)
+                json_file.write(']}')
+        finally:
+            os.remove(self._spool_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+            if self._spool_path is not None:
+                os.remove(self._spool_path)
@@ -0,0 +1,243 @@
+"""
+.. module:: partitioned
+    :platform: any
+    :synopsis: Writer of the per-partition and combined JSON and TSV files of a generator
+.. moduleauthor:: AGR consortium
+
+Generators such as disease write one JSON and one TSV file per taxon plus
+combined files of every taxon. :class:`PartitionedDataWriter` writes each
+element to the files of its partition as it is produced and puts the
+combined files together from those at the end, so no elements are held
+in memory.
+"""
+
+import io
+import os
+import csv
+import shutil
+import tempfile
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from json_codec import json_codec
+from .json_data import JsonDataWriter, write_json_start
+
+_COPY_SIZE = 1024 * 1024
+
+
+def _copy_range(filepath, start, end, file):
+    with open(filepath, 'rb') as source:
+        source.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = source.read(min(remaining, _COPY_SIZE))
+            if not data:
+                raise IOError('{} ended before offset {}'.format(filepath, end))
+            file.write(data)
+            remaining -= len(data)
+
+
+def _encode_chunk(chunk, fields):
+    """Returns the JSON elements and the TSV text of the rows of a chunk of
+    ``(partition, json_element, tsv_row)``, by partition in the order first seen.
+    """
+    encoded = OrderedDict()
+    for (partition, json_element, tsv_row) in chunk:
+        partition_encoded = encoded.get(partition)
+        if partition_encoded is None:
+            partition_encoded = encoded[partition] = ([], [])
+        partition_encoded[0].append(json_codec.dumps(json_element))
+        partition_encoded[1].append(tsv_row)
+    for (partition, (json_elements, tsv_rows)) in encoded.items():
+        tsv_text = io.StringIO()
+        csv.DictWriter(tsv_text, delimiter='\t', fieldnames=fields, lineterminator="\n").writerows(tsv_rows)
+        encoded[partition] = (json_elements, tsv_text.getvalue())
+    return encoded
+
+
+class TsvDataWriter:
+    """Writes a TSV file of a header followed by a row per element.
+
+    When the header is only known once all rows have been seen, leave it out
+    here and pass it to :meth:`close` instead: the rows are then spooled to
+    a temporary file next to ``filepath``, as :class:`JsonDataWriter` does.
+    """
+
+    def __init__(self, filepath, fields, header=None):
+        self.filepath = filepath
+        self.fields = fields
+        # byte offsets of the rows in a file opened with its header, once closed
+        self.data_start = self.data_end = None
+        if header is None:
+            (handle, self._spool_path) = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.',
+                                                          dir=os.path.dirname(filepath) or None)
+            self._file = os.fdopen(handle, 'w')
+        else:
+            self._spool_path = None
+            self._file = open(filepath, 'w')
+            self._write_start(self._file, header)
+            self.data_start = self._file.tell()
+        self._writer = csv.DictWriter(self._file, delimiter='\t', fieldnames=fields, lineterminator="\n")
+
+    def _write_start(self, file, header):
+        file.write(header)
+        csv.DictWriter(file, delimiter='\t', fieldnames=self.fields, lineterminator="\n").writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def write_encoded(self, text):
+        """Writes rows already encoded to TSV text."""
+        self._file.write(text)
+
+    def close(self, header=None):
+        """
+
+        :param header: required when it was not given when opening the file
+        """
+        if self._file is None:
+            return
+        if self._spool_path is None:
+            self.data_end = self._file.tell()
+            self._file.close()
+            self._file = None
+            return
+        self._file.close()
+        self._file = None
+        try:
+            if header is None:
+                raise ValueError('No header for ' + self.filepath)
+            with open(self.filepath, 'w') as tsv_file, open(self._spool_path) as spool:
+                self._write_start(tsv_file, header)
+                shutil.copyfileobj(spool, tsv_file)
+        finally:
+            os.remove(self._spool_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+            if self._spool_path is not None:
+                os.remove(self._spool_path)
+
+
+class PartitionedDataWriter:
+    """Writes the JSON and TSV files of every partition, and combined files of all partitions, in one pass.
+
+    The header of the combined files depends on the partitions seen, so
+    those files are only put together by :meth:`close`, from the data of
+    the partition files copied in the order the partitions were first
+    seen. They come out the same as writing all elements grouped by
+    partition.
+
+    With ``workers`` above 1 elements are encoded in that many forked
+    processes, :attr:`chunk_size` elements at a time, and the encoded
+    chunks are written in the order they were submitted, with at most two
+    chunks per worker in flight. The files are the same either way.
+    """
+
+    chunk_size = 2000
+
+    def __init__(self, combined_basepath, partition_basepath, header, fields, workers=0):
+        """
+
+        :param combined_basepath: path of the combined files, without the extension
+        :param partition_basepath: returns that path for the files of a partition
+        :param header: ``header(partitions, data_format)`` returns the JSON metadata or TSV header
+                       of a file holding the given partitions
+        :param fields: TSV columns
+        :param workers: processes encoding the elements
+        """
+        self.combined_basepath = combined_basepath
+        self.partition_basepath = partition_basepath
+        self.header = header
+        self.fields = fields
+        # (JSON writer, TSV writer) by partition, in the order they were first seen
+        self.partitions = OrderedDict()
+        self.workers = int(workers or 0)
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        else:
+            self._executor = None
+        self._chunk = []
+        self._pending = deque()
+
+    def _writers(self, partition):
+        writers = self.partitions.get(partition)
+        if writers is None:
+            basepath = self.partition_basepath(partition)
+            writers = self.partitions[partition] = (
+                JsonDataWriter(basepath + '.json', self.header([partition], 'json')),
+                TsvDataWriter(basepath + '.tsv', self.fields, self.header([partition], 'tsv')))
+        return writers
+
+    def write(self, partition, json_element, tsv_row):
+        """Writes an element to the files of ``partition``, as a JSON element and a TSV row."""
+        writers = self._writers(partition)
+        if self._executor is None:
+            writers[0].write(json_element)
+            writers[1].write(tsv_row)
+            return
+        self._chunk.append((partition, json_element, tsv_row))
+        if len(self._chunk) >= self.chunk_size:
+            self._submit_chunk()
+            self._write_pending(keep=2 * self.workers)
+
+    def _submit_chunk(self):
+        if self._chunk:
+            self._pending.append(self._executor.submit(_encode_chunk, self._chunk, self.fields))
+            self._chunk = []
+
+    def _write_pending(self, keep=0):
+        while len(self._pending) > keep:
+            for (partition, (json_elements, tsv_text)) in self._pending.popleft().result().items():
+                (json_writer, tsv_writer) = self.partitions[partition]
+                json_writer.write_encoded(json_elements)
+                tsv_writer.write_encoded(tsv_text)
+
+    def _write_combined(self):
+        partitions = list(self.partitions)
+        with open(self.combined_basepath + '.json', 'w', encoding='utf-8') as json_file:
+            write_json_start(json_file, self.header(partitions, 'json'))
+            for (number, (json_writer, tsv_writer)) in enumerate(self.partitions.values()):
+                if number:
+                    json_file.write(', ')
+                json_file.flush()
+                _copy_range(json_writer.filepath, json_writer.data_start, json_writer.data_end, json_file.buffer)
+            json_file.write(']}')
+
+        with open(self.combined_basepath + '.tsv', 'w') as tsv_file:
+            tsv_file.write(self.header(partitions, 'tsv'))
+            csv.DictWriter(tsv_file, delimiter='\t', fieldnames=self.fields, lineterminator="\n").writeheader()
+            tsv_file.flush()
+            for (json_writer, tsv_writer) in self.partitions.values():
+                _copy_range(tsv_writer.filepath, tsv_writer.data_start, tsv_writer.data_end, tsv_file.buffer)
+
+    def close(self, write_combined=True):
+        if self._executor is not None:
+            try:
+                if write_combined:
+                    self._submit_chunk()
+                    self._write_pending()
+            finally:
+                self._executor.shutdown()
+                self._executor = None
+                self._chunk = []
+                self._pending.clear()
+        for (json_writer, tsv_writer) in self.partitions.values():
+            json_writer.close()
+            tsv_writer.close()
+        if write_combined:
+            self._write_combined()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(write_combined=exc_type is None)
@@ -0,0 +1,226 @@
+"""
+.. module:: tabix
+    :platform: any
+    :synopsis: Tabix (.tbi) index built while a sorted BGZF file is written
+.. moduleauthor:: AGR consortium
+
+Follows the tabix format of htslib: records are binned with the UCSC binning
+scheme (16kb smallest bins, 5 levels) and a linear index keeps the lowest
+virtual offset of any record overlapping each 16kb window.
+"""
+
+import gzip
+import struct
+from collections import OrderedDict
+
+from .bgzf import BgzfWriter
+
+MIN_SHIFT = 14
+DEPTH = 5
+# holds the virtual offset range and record counts of a reference
+PSEUDO_BIN = 37450
+
+FORMAT_GENERIC = 0
+FORMAT_SAM = 1
+FORMAT_VCF = 2
+
+
+def reg2bin(beg, end):
+    """Returns the smallest bin holding the 0-based, half-open interval [beg, end)."""
+    end -= 1
+    shift = MIN_SHIFT
+    level_start = ((1 << (3 * DEPTH)) - 1) // 7
+    for level in range(DEPTH, 0, -1):
+        if beg >> shift == end >> shift:
+            return level_start + (beg >> shift)
+        shift += 3
+        level_start = ((1 << (3 * (level - 1))) - 1) // 7
+    return 0
+
+
+def reg2bins(beg, end):
+    """Returns every bin that can hold records overlapping the 0-based, half-open interval [beg, end)."""
+    end -= 1
+    bins = [0]
+    for level in range(1, DEPTH + 1):
+        shift = MIN_SHIFT + 3 * (DEPTH - level)
+        level_start = ((1 << (3 * level)) - 1) // 7
+        bins.extend(range(level_start + (beg >> shift), level_start + (end >> shift) + 1))
+    return bins
+
+
+class _Reference:
+
+    __slots__ = ('bins', 'linear', 'first_offset', 'last_offset', 'records', 'last_beg')
+
+    def __init__(self):
+        self.bins = {}
+        self.linear = []
+        self.first_offset = None
+        self.last_offset = None
+        self.records = 0
+        self.last_beg = -1
+
+    def shifted(self, shift):
+        reference = _Reference()
+        reference.bins = dict((bin_number, [[start + shift, stop + shift] for (start, stop) in chunks])
+                              for (bin_number, chunks) in self.bins.items())
+        reference.linear = [None if offset is None else offset + shift for offset in self.linear]
+        reference.first_offset = self.first_offset + shift
+        reference.last_offset = self.last_offset + shift
+        reference.records = self.records
+        reference.last_beg = self.last_beg
+        return reference
+
+
+class TabixIndex:
+    """Collects the index entries of records added in file order.
+
+    Defaults describe a VCF file: sequence name in column 1, position in
+    column 2 and '#' starting header lines.
+    """
+
+    def __init__(self, file_format=FORMAT_VCF, col_seq=1, col_beg=2, col_end=0, meta='#', skip=0):
+        self.file_format = file_format
+        self.col_seq = col_seq
+        self.col_beg = col_beg
+        self.col_end = col_end
+        self.meta = meta
+        self.skip = skip
+        self.references = OrderedDict()
+        self._current = None
+
+    def add(self, name, beg, end, start, stop):
+        """Indexes a record of sequence ``name`` covering the 0-based interval [beg, end).
+
+        :param start: virtual offset of the start of the record
+        :param stop: virtual offset just past the end of the record
+        """
+        reference = self.references.get(name)
+        if reference is None:
+            reference = self.references[name] = _Reference()
+            reference.first_offset = start
+        elif reference is not self._current:
+            raise ValueError('Records of {!r} are not contiguous'.format(name))
+        if beg < reference.last_beg:
+            raise ValueError('Records of {!r} are not sorted: {} after {}'.format(name, beg, reference.last_beg))
+        self._current = reference
+        reference.last_beg = beg
+        reference.last_offset = stop
+        reference.records += 1
+
+        chunks = reference.bins.setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] >> 16 == start >> 16:
+            # records ending in the block this one starts in are read anyway
+            chunks[-1][1] = stop
+        else:
+            chunks.append([start, stop])
+
+        linear = reference.linear
+        last_window = (end - 1) >> MIN_SHIFT
+        if last_window >= len(linear):
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> MIN_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start
+
+    @classmethod
+    def read(cls, path):
+        """Loads a .tbi file."""
+        with gzip.open(path) as index_file:
+            data = index_file.read()
+        if data[:4] != b'TBI\1':
+            raise ValueError('{} is not a tabix index'.format(path))
+        (n_ref, file_format, col_seq, col_beg, col_end, meta, skip, l_nm) = struct.unpack_from('<8i', data, 4)
+        index = cls(file_format, col_seq, col_beg, col_end, chr(meta), skip)
+        names = data[36:36 + l_nm].split(b'\0')[:n_ref]
+        offset = 36 + l_nm
+        for name in names:
+            reference = index.references[name.decode('utf-8')] = _Reference()
+            (n_bin,) = struct.unpack_from('<i', data, offset)
+            offset += 4
+            for _ in range(n_bin):
+                (bin_number, n_chunk) = struct.unpack_from('<Ii', data, offset)
+                offset += 8
+                chunks = [list(struct.unpack_from('<QQ', data, offset + 16 * number)) for number in range(n_chunk)]
+                offset += 16 * n_chunk
+                if bin_number == PSEUDO_BIN:
+                    ((reference.first_offset, reference.last_offset), (reference.records, _)) = chunks
+                else:
+                    reference.bins[bin_number] = chunks
+            (n_intv,) = struct.unpack_from('<i', data, offset)
+            reference.linear = list(struct.unpack_from('<{}Q'.format(n_intv), data, offset + 4))
+            offset += 4 + 8 * n_intv
+        return index
+
+    def region_chunks(self, name, beg, end):
+        """Returns the sorted, merged (start, stop) offset ranges holding the records of ``name``
+        that overlap the 0-based interval [beg, end).
+        """
+        reference = self.references.get(name)
+        if reference is None:
+            return []
+        linear = self._filled_linear_index(reference.linear)
+        min_offset = linear[min(beg >> MIN_SHIFT, len(linear) - 1)] if linear else 0
+        chunks = sorted((start, stop) for bin_number in reg2bins(beg, end)
+                        for (start, stop) in reference.bins.get(bin_number, ()) if stop > min_offset)
+        merged = []
+        for (start, stop) in chunks:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([max(start, min_offset), stop])
+        return merged
+
+    def merge(self, other, shift=0):
+        """Adds the references of ``other``, the index of a file appended to this one.
+
+        :param shift: added to every offset of ``other``, see :meth:`BgzfWriter.append_blocks`
+        """
+        for (name, reference) in other.references.items():
+            if name in self.references:
+                raise ValueError('Records of {!r} are not contiguous'.format(name))
+            self._current = self.references[name] = reference.shifted(shift)
+
+    @staticmethod
+    def _filled_linear_index(linear):
+        filled = []
+        previous = next((offset for offset in linear if offset is not None), 0)
+        for offset in linear:
+            if offset is None:
+                offset = previous
+            filled.append(offset)
+            previous = offset
+        return filled
+
+    def to_bytes(self, resolve=None):
+        """
+
+        :param resolve: maps the offsets given to :meth:`add` to virtual offsets, when they
+                        were taken with :meth:`BgzfWriter.tell_block`
+        """
+        if resolve is None:
+            def resolve(offset):
+                return offset
+        names = b''.join(name.encode('utf-8') + b'\0' for name in self.references)
+        parts = [b'TBI\1',
+                 struct.pack('<iiiiiiii', len(self.references), self.file_format, self.col_seq, self.col_beg,
+                             self.col_end, ord(self.meta), self.skip, len(names)),
+                 names]
+        for reference in self.references.values():
+            parts.append(struct.pack('<i', len(reference.bins) + 1))
+            for (bin_number, chunks) in sorted(reference.bins.items()):
+                parts.append(struct.pack('<Ii', bin_number, len(chunks)))
+                parts.extend(struct.pack('<QQ', resolve(start), resolve(stop)) for (start, stop) in chunks)
+            parts.append(struct.pack('<IiQQQQ', PSEUDO_BIN, 2,
+                                     resolve(reference.first_offset), resolve(reference.last_offset), reference.records, 0))
+            linear = [resolve(offset) for offset in self._filled_linear_index(reference.linear)]
+            parts.append(struct.pack('<i', len(linear)))
+            parts.append(struct.pack('<{}Q'.format(len(linear)), *linear))
+        # records without coordinates
+        parts.append(struct.pack('<Q', 0))
+        return b''.join(parts)
+
+    def write(self, path, resolve=None):
+        with BgzfWriter(path) as index_file:
+            index_file.write(self.to_bytes(resolve))
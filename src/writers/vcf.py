@@ -0,0 +1,126 @@
+"""
+.. module:: vcf
+    :platform: any
+    :synopsis: Outputs the VCF generator writes to, and a reader of the indexed output
+.. moduleauthor:: AGR consortium
+
+Both writers take header text through :meth:`write` and one complete data
+line at a time through :meth:`write_record`. Data lines written separately
+to a shard, a file of the same writer class, can be added with :meth:`append`.
+"""
+
+import shutil
+
+from .bgzf import BgzfReader, BgzfWriter
+from .tabix import TabixIndex
+
+
+class PlainVcfWriter:
+    """Writes the plain text VCF file only."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'w')
+
+    def write(self, text):
+        self._file.write(text)
+
+    write_record = write
+
+    def append(self, filepath, index=None):
+        with open(filepath) as shard:
+            shutil.copyfileobj(shard, self._file)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class IndexedVcfWriter:
+    """Writes ``<filepath>.gz`` and its tabix index in one pass, plus the plain file if asked for.
+
+    The index is only written once the file has been closed without error,
+    and not at all with ``write_index`` off, which leaves it in :attr:`index`
+    for a shard. Data lines have to be sorted by position within each
+    chromosome, with the lines of a chromosome kept together.
+    """
+
+    def __init__(self, filepath, write_plain=True, compresslevel=6, threads=1, write_index=True):
+        self.filepath = filepath
+        self.write_index = write_index
+        self._plain = open(filepath, 'w') if write_plain else None
+        self._bgzf = BgzfWriter(filepath + '.gz', compresslevel, threads)
+        self.index = TabixIndex()
+
+    def write(self, text):
+        if self._plain is not None:
+            self._plain.write(text)
+        self._bgzf.write(text.encode('utf-8'))
+
+    def write_record(self, line):
+        (chromosome, pos, _, ref, _) = line.split('\t', 4)
+        beg = int(pos) - 1
+        start = self._bgzf.tell_block()
+        self.write(line)
+        self.index.add(chromosome, beg, beg + max(len(ref), 1), start, self._bgzf.tell_block())
+
+    def append(self, filepath, index):
+        """Appends a shard written with ``write_index`` off, without recompressing it.
+
+        :param index: :attr:`index` of the shard
+        """
+        if self._plain is not None:
+            with open(filepath) as shard:
+                shutil.copyfileobj(shard, self._plain)
+        with open(filepath + '.gz', 'rb') as shard:
+            first_block = self._bgzf.append_blocks(shard)
+        self.index.merge(index, first_block << 16)
+
+    def close(self, write_index=True):
+        if self._plain is not None:
+            self._plain.close()
+        self._bgzf.close()
+        if write_index and self.write_index:
+            self.index.write(self.filepath + '.gz.tbi', self._bgzf.resolve)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(write_index=exc_type is None)
+
+
+class IndexedVcfReader:
+    """Looks up the data lines of a region of a .vcf.gz file through its tabix index."""
+
+    def __init__(self, filepath, index_path=None):
+        self.filepath = filepath
+        self.index = TabixIndex.read(index_path or filepath + '.tbi')
+        self._bgzf = BgzfReader(filepath)
+
+    def fetch(self, chromosome, beg, end):
+        """Yields the data lines of ``chromosome`` overlapping the 0-based interval [beg, end)."""
+        for (start, stop) in self.index.region_chunks(chromosome, beg, end):
+            self._bgzf.seek(start)
+            while self._bgzf.tell() < stop:
+                line = self._bgzf.readline().decode('utf-8')
+                (line_chromosome, pos, _, ref, _) = line.split('\t', 4)
+                line_beg = int(pos) - 1
+                if line_chromosome != chromosome or line_beg >= end:
+                    return
+                if line_beg + max(len(ref), 1) > beg:
+                    yield line
+
+    def close(self):
+        self._bgzf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,157 @@
+import gzip
+import io
+import os
+import struct
+import sys
+import tempfile
+
+sys.path.append('../src')
+from writers import BgzfWriter, IndexedVcfReader, IndexedVcfWriter  # noqa: E402
+from writers.bgzf import BLOCK_SIZE, EOF_BLOCK  # noqa: E402
+from writers.tabix import TabixIndex, reg2bin  # noqa: E402
+
+
+def read_blocks(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        (block_size,) = struct.unpack_from('<H', data, offset + 16)
+        blocks.append(data[offset:offset + block_size + 1])
+        offset += block_size + 1
+    return blocks
+
+
+def test_bgzf_round_trip():
+    data = os.urandom(BLOCK_SIZE) + b'ACGT' * 100000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.gz')
+        with BgzfWriter(path) as writer:
+            writer.write(data)
+
+        with gzip.open(path) as f:
+            assert f.read() == data
+        blocks = read_blocks(path)
+        assert blocks[-1] == EOF_BLOCK
+        assert all(len(block) <= 65536 for block in blocks)
+
+
+def test_bgzf_virtual_offsets():
+    output = io.BytesIO()
+    writer = BgzfWriter(output)
+    assert writer.tell() == 0
+    writer.write(b'x' * (BLOCK_SIZE + 10))
+    assert writer.tell() == (len(output.getvalue()) << 16) | 10
+    writer.close()
+    assert output.getvalue().endswith(EOF_BLOCK)
+
+
+def test_reg2bin():
+    assert reg2bin(0, 1) == 4681
+    assert reg2bin(0, 1 << 14) == 4681
+    assert reg2bin(1 << 14, (1 << 14) + 1) == 4682
+    assert reg2bin(0, (1 << 14) + 1) == 585
+    assert reg2bin(0, 1 << 26) == 1
+    assert reg2bin(0, (1 << 26) + 1) == 0
+
+
+def test_indexed_vcf_writer():
+    lines = ['1\t{}\t.\tAC\tA\t.\t.\t.\n'.format(position) for position in range(100, 200000, 7)]
+    lines += ['2\t{}\t.\tA\tG\t.\t.\t.\n'.format(position) for position in range(5, 50000, 3)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.vcf')
+        with IndexedVcfWriter(path, write_plain=True) as writer:
+            writer.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for line in lines:
+                writer.write_record(line)
+
+        with open(path, 'rb') as f:
+            plain = f.read()
+        with gzip.open(path + '.gz') as f:
+            assert f.read() == plain
+        with gzip.open(path + '.gz.tbi') as f:
+            index = f.read()
+        assert index[:4] == b'TBI\1'
+        (n_ref, file_format, col_seq, col_beg, col_end, meta, skip, l_nm) = struct.unpack_from('<8i', index, 4)
+        assert (n_ref, file_format, col_seq, col_beg, col_end, chr(meta), skip) == (2, 2, 1, 2, 0, '#', 0)
+        assert index[36:36 + l_nm] == b'1\x002\x00'
+
+
+def test_threaded_bgzf_matches_single_threaded():
+    data = b''.join(b'%d\tACGT\n' % number for number in range(300000))
+    outputs = []
+    for threads in (1, 4):
+        output = io.BytesIO()
+        with BgzfWriter(output, threads=threads) as writer:
+            positions = []
+            for start in range(0, len(data), 1000):
+                positions.append(writer.tell_block())
+                writer.write(data[start:start + 1000])
+        virtual_offsets = [writer.resolve(position) for position in positions]
+        outputs.append((output.getvalue(), virtual_offsets))
+    assert outputs[0] == outputs[1]
+
+
+def test_indexed_vcf_writer_appends_shards():
+    header = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    chromosome_lines = [['{}\t{}\t.\tA\tG\t.\t.\t.\n'.format(chromosome, position) for position in range(1, 300000, 11)]
+                        for chromosome in ('1', '2')]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.vcf')
+        with IndexedVcfWriter(path) as writer:
+            writer.write(header)
+            for (number, lines) in enumerate(chromosome_lines):
+                shard_path = os.path.join(directory, 'shard{}.vcf'.format(number))
+                with IndexedVcfWriter(shard_path, write_index=False) as shard:
+                    for line in lines:
+                        shard.write_record(line)
+                assert not os.path.exists(shard_path + '.gz.tbi')
+                writer.append(shard_path, shard.index)
+
+        with gzip.open(path + '.gz') as f:
+            data = f.read()
+        assert data == (header + ''.join(sum(chromosome_lines, []))).encode('utf-8')
+
+        # maps the virtual offset of every block to the offset of its data in the file
+        blocks = read_blocks(path + '.gz')
+        block_data_offsets = {}
+        (address, data_offset) = (0, 0)
+        for block in blocks:
+            block_data_offsets[address] = data_offset
+            data_offset += struct.unpack('<I', block[-4:])[0]
+            address += len(block)
+        for (name, reference) in writer.index.references.items():
+            first_offset = writer._bgzf.resolve(reference.first_offset)
+            start = block_data_offsets[first_offset >> 16] + (first_offset & 0xffff)
+            assert data[start:].startswith('{}\t1\t'.format(name).encode('utf-8'))
+
+
+def test_indexed_vcf_reader_fetches_regions():
+    lines = ['1\t{}\t.\tACGT\tA\t.\t.\t.\n'.format(position) for position in range(100, 400000, 13)]
+    lines += ['2\t{}\t.\tA\tG\t.\t.\t.\n'.format(position) for position in range(5, 90000, 3)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.vcf')
+        with IndexedVcfWriter(path, write_plain=False) as writer:
+            writer.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for line in lines:
+                writer.write_record(line)
+
+        with IndexedVcfReader(path + '.gz') as reader:
+            for (chromosome, beg, end) in (('1', 0, 1), ('1', 16380, 16390), ('1', 65000, 300000), ('2', 89990, 100000),
+                                           ('3', 0, 1000)):
+                expected = [line for line in lines if line.split('\t')[0] == chromosome and
+                            int(line.split('\t')[1]) - 1 < end and
+                            int(line.split('\t')[1]) - 1 + len(line.split('\t')[3]) > beg]
+                assert list(reader.fetch(chromosome, beg, end)) == expected
+
+
+def test_tabix_index_round_trip():
+    index = TabixIndex()
+    for position in range(0, 200000, 50):
+        index.add('1', position, position + 3, position << 4, (position + 50) << 4)
+    index.add('X', 10, 11, 5 << 30, 6 << 30)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.tbi')
+        index.write(path)
+        assert TabixIndex.read(path).to_bytes() == index.to_bytes()
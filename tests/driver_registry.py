@@ -0,0 +1,46 @@
+import gc
+import os
+import sys
+
+sys.path.append('../src')
+from data_source import drivers  # noqa: E402
+
+
+class StandInDriver:
+    """Closes like a neo4j 1.7 Driver, including from __del__, and reports it on a pipe."""
+
+    def __init__(self, report_fd):
+        self.report_fd = report_fd
+        self._closed = False
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            os.write(self.report_fd, str(os.getpid()).encode('ascii') + b'\n')
+
+
+def test_forked_child_never_closes_the_parent_drivers():
+    (read_fd, write_fd) = os.pipe()
+    # the registry holds the only reference, as for a driver created by DriverRegistry.get
+    drivers._drivers['bolt://stand-in:7687'] = StandInDriver(write_fd)
+    drivers._stats['bolt://stand-in:7687'] = {}
+    try:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                assert drivers._drivers == {}
+                drivers.close_all()
+                gc.collect()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        drivers.close_all()
+        os.close(write_fd)
+        with os.fdopen(read_fd) as report:
+            assert report.read().split() == [str(os.getpid())]
+    finally:
+        drivers._drivers.pop('bolt://stand-in:7687', None)
+        drivers._stats.pop('bolt://stand-in:7687', None)
@@ -0,0 +1,83 @@
+import random
+import sys
+
+sys.path.append('../src')
+from external_sort import ExternalSorter  # noqa: E402
+
+
+def variant_items(count):
+    """Returns (key, line) pairs keyed like the VCF generator: (chromosome, POS, arrival index),
+    with many POS ties on each chromosome."""
+    generator = random.Random(0)
+    items = []
+    for seq in range(count):
+        chromosome = generator.choice(['1', '10', '2', 'X'])
+        pos = generator.randint(1, 20)
+        items.append(((chromosome, pos, seq), '{}\t{}\tvariant{}\n'.format(chromosome, pos, seq)))
+    return items
+
+
+def test_spilled_runs_merge_in_key_order_with_ties_in_arrival_order():
+    items = variant_items(500)
+    sorter = ExternalSorter(buffer_bytes=3000)
+    sorter.max_fan_in = 4
+    for (key, line) in items:
+        sorter.add(key, line)
+    assert len(sorter.runs) > 5
+    assert sorter._buffer
+    merged = list(sorter)
+    sorter.close()
+    assert sorter.runs == []
+
+    assert merged == sorted(items)
+    # lines of the same chromosome and POS come out in the order they were added
+    for (previous, current) in zip(merged, merged[1:]):
+        if previous[0][:2] == current[0][:2]:
+            assert previous[0][2] < current[0][2]
+
+
+class CountingSorter(ExternalSorter):
+    """Counts the items read from the runs that the merge has not taken yet."""
+
+    held = 0
+    peak = 0
+
+    def _load_chunk(self, run):
+        chunk = super()._load_chunk(run)
+        if chunk is not None:
+            self.held += len(chunk)
+            self.peak = max(self.peak, self.held)
+        return chunk
+
+    def _read_run(self, run):
+        for item in super()._read_run(run):
+            self.held -= 1
+            yield item
+
+
+def test_merge_holds_at_most_a_chunk_per_merged_run():
+    items = variant_items(2000)
+    sorter = CountingSorter(buffer_bytes=6000)
+    sorter.max_fan_in = 4
+    for (key, line) in items:
+        sorter.add(key, line)
+    assert len(sorter.runs) > 4 * sorter.max_fan_in
+    merged = []
+    for item in sorter:
+        assert len(sorter.runs) <= sorter.max_fan_in
+        merged.append(item)
+    sorter.close()
+
+    assert merged == sorted(items)
+    # a chunk holds at most chunk_bytes of items plus the one going over
+    items_per_chunk = sorter.chunk_bytes // sorter.item_overhead + 1
+    assert 0 < sorter.peak <= sorter.max_fan_in * items_per_chunk
+
+
+def test_unspilled_items_sort_in_memory():
+    items = variant_items(100)
+    with ExternalSorter(buffer_bytes=1024 * 1024) as sorter:
+        for (key, line) in items:
+            sorter.add(key, line)
+        assert sorter.runs == []
+        assert list(sorter) == sorted(items)
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+
+sys.path.append('../src')
+from query_cache import query_cache  # noqa: E402
+from scheduler import Scheduler, in_worker_process, pool_workers  # noqa: E402
+
+
+def report(path, name):
+    with open(path, 'a') as f:
+        f.write('{} {} {} {}\n'.format(name, os.getpid(), in_worker_process(), pool_workers(4)))
+
+
+def nested_jobs(path, name):
+    report(path, name)
+    scheduler = Scheduler(2)
+    for number in range(2):
+        scheduler.add('{}.{}'.format(name, number), report, path, '{}.{}'.format(name, number))
+    assert all(result['status'] == 'ok' for result in scheduler.run())
+
+
+def test_jobs_of_worker_processes_do_not_start_pools():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'report')
+        scheduler = Scheduler(2)
+        for name in ('a', 'b'):
+            scheduler.add(name, nested_jobs, path, name)
+        assert [result['status'] for result in scheduler.run()] == ['ok', 'ok']
+        with open(path) as f:
+            reports = dict((line.split()[0], line.split()[1:]) for line in f)
+    assert sorted(reports) == ['a', 'a.0', 'a.1', 'b', 'b.0', 'b.1']
+    for name in ('a', 'b'):
+        (pid, in_worker, workers) = reports[name]
+        assert pid != str(os.getpid())
+        assert (in_worker, workers) == ('True', '0')
+        # nested jobs ran one by one in the worker process of their parent job
+        assert reports[name + '.0'] == reports[name + '.1'] == reports[name]
+    assert (in_worker_process(), pool_workers(4)) == (False, 4)
+
+
+def hit_cache(count):
+    query_cache.hits += count
+    query_cache.misses += 1
+
+
+def test_cache_counters_of_jobs_are_counted_once():
+    for workers in (1, 2):
+        (query_cache.hits, query_cache.misses) = (0, 0)
+        scheduler = Scheduler(workers)
+        scheduler.add('a', hit_cache, 3)
+        scheduler.add('b', hit_cache, 2)
+        scheduler.run()
+        assert (query_cache.hits, query_cache.misses) == (5, 2)
+    (query_cache.hits, query_cache.misses) = (0, 0)
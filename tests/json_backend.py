@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+from jsonschema import validate
+
+sys.path.append('../src')
+from json_codec import json_codec  # noqa: E402
+from writers import JsonDataWriter  # noqa: E402
+
+SCHEMA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schemas')
+
+METADATA = {'filetype': 'Disease',
+            'databaseVersion': '3.1.0',
+            'sourceURL': 'http://alliancegenome.org/downloads',
+            'genTime': '2020-06-01 12:00',
+            'stringencyFilter': '',
+            'dataFormat': 'json',
+            'readme': '',
+            'species': [{'taxonId': 'NCBITaxon:10090', 'speciesName': 'Mus musculus'}]}
+
+
+def disease_association(number):
+    return {'Taxon': 'NCBITaxon:10090',
+            'SpeciesName': 'Mus musculus',
+            'DBobjectType': 'gene',
+            'DBObjectID': 'MGI:{}'.format(number),
+            'DBObjectSymbol': 'Pax{}<sup>Sey-Dey</sup>'.format(number),
+            'AssociationType': 'is_implicated_in',
+            'DOID': 'DOID:{}'.format(number),
+            'DOtermName': 'Sjögren syndrome "type {}"'.format(number),
+            'WithOrthologs': ['HGNC:{}'.format(number)] if number % 2 else [],
+            'InferredFromID': '',
+            'InferredFromSymbol': '',
+            'EvidenceCode': 'ECO:0000033',
+            'EvidenceCodeName': 'author statement supported by traceable reference',
+            'Reference': 'PMID:{}'.format(number),
+            'Date': '20200601',
+            'Source': 'MGI'}
+
+
+def write_and_load(directory, backend, elements):
+    json_codec.configure(backend)
+    path = os.path.join(directory, backend + '.json')
+    with JsonDataWriter(path, METADATA) as writer:
+        writer.write_all(elements)
+    with open(path, 'rb') as f:
+        return json_codec.load(f)
+
+
+def test_orjson_files_match_the_disease_schema_and_stdlib_data():
+    pytest.importorskip('orjson')
+    elements = [disease_association(number) for number in range(20)]
+    with open(os.path.join(SCHEMA_FOLDER, 'disease.schema')) as f:
+        schema = json.load(f)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            stdlib_document = write_and_load(directory, 'stdlib', elements)
+            orjson_document = write_and_load(directory, 'orjson', elements)
+    finally:
+        json_codec.configure('stdlib')
+    validate(orjson_document, schema)
+    assert orjson_document == stdlib_document == {'metadata': METADATA, 'data': elements}
+
+
+def test_values_orjson_cannot_encode_fall_back_to_stdlib():
+    pytest.importorskip('orjson')
+    try:
+        json_codec.configure('orjson')
+        assert json_codec.dumps({'count': 2 ** 70}) == json.dumps({'count': 2 ** 70})
+        assert json_codec.dumps({1: 'one'}) == json.dumps({1: 'one'})
+    finally:
+        json_codec.configure('stdlib')
@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append('../src')
+from writers import JsonDataWriter, PartitionedDataWriter, TsvDataWriter  # noqa: E402
+
+METADATA = {'filetype': 'Test', 'species': [{'taxonId': 'NCBITaxon:7955', 'speciesName': 'Danio rerio'}]}
+
+
+def expected_bytes(directory, elements):
+    path = os.path.join(directory, 'expected.json')
+    with open(path, 'w') as f:
+        json.dump({'metadata': METADATA, 'data': elements}, f)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_json_data_writer_matches_json_dump():
+    elements = [{'GeneID': 'ZFIN:{}'.format(number), 'Name': 'gène {}'.format(number), 'Score': number / 3, 'Tags': None}
+                for number in range(50)]
+    with tempfile.TemporaryDirectory() as directory:
+        for data in (elements, []):
+            path = os.path.join(directory, 'test.json')
+            with JsonDataWriter(path, METADATA) as writer:
+                writer.write_all(data)
+            with open(path, 'rb') as f:
+                assert f.read() == expected_bytes(directory, data)
+
+
+def test_json_data_writer_with_late_metadata():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.json')
+        with JsonDataWriter(path) as writer:
+            writer.write_all(range(10))
+            writer.close(METADATA)
+        with open(path, 'rb') as f:
+            assert f.read() == expected_bytes(directory, list(range(10)))
+        assert sorted(os.listdir(directory)) == ['expected.json', 'test.json']
+
+
+def test_tsv_data_writer_with_late_header():
+    fields = ['ID', 'Name']
+    rows = [{'ID': number, 'Name': 'gene\t{}'.format(number)} for number in range(10)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.tsv')
+        with TsvDataWriter(path, fields) as writer:
+            for row in rows:
+                writer.write(row)
+            assert not os.path.exists(path)
+            writer.close('# header\n')
+        expected_path = os.path.join(directory, 'expected.tsv')
+        with open(expected_path, 'w') as f:
+            f.write('# header\n')
+            tsv_writer = csv.DictWriter(f, delimiter='\t', fieldnames=fields, lineterminator="\n")
+            tsv_writer.writeheader()
+            tsv_writer.writerows(rows)
+        with open(path, 'rb') as f, open(expected_path, 'rb') as expected:
+            assert f.read() == expected.read()
+        assert sorted(os.listdir(directory)) == ['expected.tsv', 'test.tsv']
+
+
+def test_partitioned_data_writer_combines_partitions():
+    rows = [('NCBITaxon:{}'.format(7955 + number % 3), {'ID': number, 'Name': 'gène {}'.format(number)}) for number in range(30)]
+
+    def header(partitions, data_format):
+        if data_format == 'json':
+            return {'partitions': partitions}
+        return '# ' + ','.join(partitions) + '\n'
+
+    with tempfile.TemporaryDirectory() as directory:
+        def partition_basepath(partition):
+            return os.path.join(directory, partition)
+
+        with PartitionedDataWriter(os.path.join(directory, 'combined'), partition_basepath, header, ['ID', 'Name']) as writer:
+            for (partition, element) in rows:
+                writer.write(partition, element, element)
+
+        partitions = ['NCBITaxon:7955', 'NCBITaxon:7956', 'NCBITaxon:7957']
+        by_partition = [element for partition in partitions for (row_partition, element) in rows if row_partition == partition]
+        with open(os.path.join(directory, 'combined.json')) as f:
+            assert json.load(f) == {'metadata': {'partitions': partitions}, 'data': by_partition}
+        with open(os.path.join(directory, 'combined.tsv')) as f:
+            assert f.read() == ''.join(['# ' + ','.join(partitions) + '\n', 'ID\tName\n'] +
+                                       ['{ID}\t{Name}\n'.format(**element) for element in by_partition])
+        with open(os.path.join(directory, 'NCBITaxon:7956.json')) as f:
+            assert json.load(f)['data'] == [element for (partition, element) in rows if partition == 'NCBITaxon:7956']
+
+
+def test_partitioned_data_writer_encodes_chunks_in_worker_processes():
+    rows = [('NCBITaxon:{}'.format(7955 + number % 4), {'ID': number, 'Name': 'gène {}'.format(number)}) for number in range(101)]
+
+    def header(partitions, data_format):
+        return {'partitions': partitions} if data_format == 'json' else '# ' + ','.join(partitions) + '\n'
+
+    outputs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in (0, 2):
+            folder = os.path.join(directory, str(workers))
+            os.mkdir(folder)
+            with PartitionedDataWriter(os.path.join(folder, 'combined'), lambda partition: os.path.join(folder, partition),
+                                       header, ['ID', 'Name'], workers=workers) as writer:
+                writer.chunk_size = 7
+                for (partition, element) in rows:
+                    writer.write(partition, element, element)
+            outputs.append(dict((name, open(os.path.join(folder, name), 'rb').read()) for name in os.listdir(folder)))
+    assert len(outputs[0]) == 10
+    assert outputs[0] == outputs[1]
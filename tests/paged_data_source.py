@@ -0,0 +1,100 @@
+import sys
+from contextlib import contextmanager
+
+import pytest
+from neo4j.exceptions import ServiceUnavailable, TransientError
+
+sys.path.append('../src')
+from data_source import PagedDataSource  # noqa: E402
+
+KEY_QUERY = 'MATCH (dej) RETURN dej.primaryKey AS key'
+QUERY = 'MATCH (dej)--(object) WHERE dej.primaryKey IN $keys RETURN dej.primaryKey AS dejID, object.primaryKey AS objectID'
+
+# DOID:2 has no rows, as for a driving node filtered out by the expanding MATCHes
+DEJ_KEYS = ['DOID:1', 'DOID:2', 'DOID:3', 'DOID:4', 'DOID:5']
+ROWS = [{'dejID': 'DOID:1', 'objectID': 'ZFIN:1'},
+        {'dejID': 'DOID:1', 'objectID': 'ZFIN:2'},
+        {'dejID': 'DOID:1', 'objectID': 'ZFIN:3'},
+        {'dejID': 'DOID:3', 'objectID': 'ZFIN:4'},
+        {'dejID': 'DOID:3', 'objectID': 'ZFIN:5'},
+        {'dejID': 'DOID:4', 'objectID': 'ZFIN:6'},
+        {'dejID': 'DOID:5', 'objectID': 'ZFIN:7'},
+        {'dejID': 'DOID:5', 'objectID': 'ZFIN:8'}]
+
+
+class FakeRecord(dict):
+
+    def data(self):
+        return dict(self)
+
+
+class FakeTransaction:
+
+    def __init__(self, queries, failures):
+        self.queries = queries
+        self.failures = failures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def run(self, query, parameters):
+        self.queries.append((query, parameters))
+        if len(self.queries) in self.failures:
+            raise self.failures[len(self.queries)]
+        if query == KEY_QUERY:
+            keys = [key for key in DEJ_KEYS if parameters['last_key'] is None or key > parameters['last_key']]
+            return [FakeRecord(key=key) for key in keys[:parameters['page_size']]]
+        return [FakeRecord(row) for row in ROWS if row['dejID'] in parameters['keys']]
+
+
+class FakePagedDataSource(PagedDataSource):
+
+    retry_delay = 0
+
+    def __init__(self, *args, failures=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+        # exceptions raised by the n-th query run, counting from 1
+        self.failures = failures or {}
+
+    @contextmanager
+    def _session(self):
+        session = type('FakeSession', (), {'begin_transaction': lambda session: FakeTransaction(self.queries, self.failures)})()
+        yield session
+
+
+def test_page_boundaries_never_split_the_rows_of_a_key():
+    for page_size in (1, 2, 3, 4, 5, 6):
+        data_source = FakePagedDataSource('bolt://localhost:7687', QUERY, KEY_QUERY, page_size)
+        assert list(data_source) == ROWS
+        key_pages = [parameters['last_key'] for (query, parameters) in data_source.queries if query == KEY_QUERY]
+        assert len(key_pages) == len(DEJ_KEYS) // page_size + 1
+        assert data_source.last_key == 'DOID:5'
+
+
+def test_resumes_after_the_last_key_of_the_last_complete_page():
+    data_source = FakePagedDataSource('bolt://localhost:7687', QUERY, KEY_QUERY, 2, last_key='DOID:2')
+    assert list(data_source) == ROWS[3:]
+
+
+def test_failed_pages_are_fetched_again_from_the_last_key():
+    # the rows query of the second page and the key query of its retry fail
+    failures = {4: ServiceUnavailable('connection lost'), 5: TransientError('deadlock')}
+    data_source = FakePagedDataSource('bolt://localhost:7687', QUERY, KEY_QUERY, 2, failures=failures)
+    assert list(data_source) == ROWS
+    key_pages = [parameters['last_key'] for (query, parameters) in data_source.queries if query == KEY_QUERY]
+    assert key_pages == [None, 'DOID:2', 'DOID:2', 'DOID:2', 'DOID:4']
+
+
+def test_retries_are_bounded():
+    failures = dict((number, ServiceUnavailable('connection lost')) for number in range(3, 10))
+    data_source = FakePagedDataSource('bolt://localhost:7687', QUERY, KEY_QUERY, 2, failures=failures, retries=2)
+    records = iter(data_source)
+    assert [next(records) for row in ROWS[:3]] == ROWS[:3]
+    with pytest.raises(ServiceUnavailable):
+        next(records)
+    assert data_source.last_key == 'DOID:2'
+    assert len(data_source.queries) == 5
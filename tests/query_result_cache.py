@@ -0,0 +1,114 @@
+import os
+import stat
+import sys
+import tempfile
+
+import pytest
+from neo4j.types.graph import Graph
+
+sys.path.append('../src')
+from query_cache import DetachedNode, QueryCache  # noqa: E402
+
+URI = 'bolt://localhost:7687'
+QUERY = 'MATCH (g:Gene) RETURN g.primaryKey AS id, g AS gene'
+
+
+def records(count, fail_after=None):
+    graph = Graph()
+    for number in range(count):
+        if number == fail_after:
+            raise IOError('connection lost')
+        yield {'id': 'ZFIN:{}'.format(number),
+               'gene': graph.put_node(number, ['Gene'], {'primaryKey': 'ZFIN:{}'.format(number)})}
+
+
+def configured_cache(directory, max_bytes=1024 * 1024):
+    cache = QueryCache()
+    cache.configure(directory, max_bytes, '3.1.0')
+    return cache
+
+
+def test_complete_stream_is_published_and_read_back_with_detached_nodes():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(os.path.join(directory, 'cache'))
+        assert stat.S_IMODE(os.stat(cache.directory).st_mode) == 0o700
+        assert [record['id'] for record in cache.stream(URI, QUERY, {}, lambda: records(3))] == ['ZFIN:0', 'ZFIN:1', 'ZFIN:2']
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        cached = list(cache.stream(URI, QUERY, {}, lambda: records(0)))
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert [record['id'] for record in cached] == ['ZFIN:0', 'ZFIN:1', 'ZFIN:2']
+        gene = cached[2]['gene']
+        assert isinstance(gene, DetachedNode)
+        assert (gene.id, gene.labels, dict(gene)) == (2, frozenset(['Gene']), {'primaryKey': 'ZFIN:2'})
+
+
+def test_partial_stream_is_discarded():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(directory)
+        stream = cache.stream(URI, QUERY, {}, lambda: records(3, fail_after=2))
+        with pytest.raises(IOError):
+            list(stream)
+        assert os.listdir(directory) == []
+
+        # a stream abandoned before its end is not published either
+        stream = cache.stream(URI, QUERY, {}, lambda: records(3))
+        next(stream)
+        stream.close()
+        assert os.listdir(directory) == []
+
+
+def test_key_covers_the_database_uri():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(directory)
+        list(cache.stream(URI, QUERY, {}, lambda: records(1)))
+        assert len(list(cache.stream('bolt://other-host:7687', QUERY, {}, lambda: records(2)))) == 2
+        assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_least_recently_used_entries_are_evicted():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(directory)
+        for number in range(3):
+            list(cache.stream(URI, QUERY, {'number': number}, lambda: records(50)))
+        paths = [os.path.join(directory, cache.key(URI, QUERY, {'number': number}) + cache.suffix) for number in range(3)]
+        # entry 1 becomes the least recently used
+        os.utime(paths[1], (1, 1))
+        cache.max_bytes = os.path.getsize(paths[0]) + os.path.getsize(paths[2])
+        cache.evict()
+        assert [os.path.exists(path) for path in paths] == [True, False, True]
+
+
+def test_entry_evicted_before_it_is_read():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(directory)
+        list(cache.stream(URI, QUERY, {}, lambda: records(3)))
+        path = os.path.join(directory, cache.key(URI, QUERY, {}) + cache.suffix)
+        stream = cache.stream(URI, QUERY, {}, lambda: records(0))
+        # another process evicts the entry between the lookup and the first record
+        cache.max_bytes = 0
+        cache.evict()
+        assert not os.path.exists(path)
+        assert [record['id'] for record in stream] == ['ZFIN:0', 'ZFIN:1', 'ZFIN:2']
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # a missing entry is a miss
+        assert len(list(cache.stream(URI, QUERY, {}, lambda: records(2)))) == 2
+        assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entry_removed_by_a_concurrent_eviction(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        cache = configured_cache(directory)
+        list(cache.stream(URI, QUERY, {}, lambda: records(3)))
+        remove = os.remove
+
+        def remove_after_other_process(path):
+            remove(path)
+            remove(path)
+
+        with monkeypatch.context() as patch:
+            patch.setattr(os, 'remove', remove_after_other_process)
+            cache.max_bytes = 0
+            cache.evict()
+        assert os.listdir(directory) == []
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append('../src')
+from validators.vcf_validator import EXAMPLE_CASES, VcfValidator  # noqa: E402
+from writers import IndexedVcfWriter  # noqa: E402
+
+HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+
+def line(chromosome, position, variant_id, ref='A', alt='G'):
+    return '\t'.join([chromosome, str(position), variant_id, ref, alt, '.', '.', '.']) + '\n'
+
+
+def example_line(example):
+    return line(example['CHROM'], example['POS'], example['ID'], example['REF'], example['ALT'])
+
+
+# records of chromosomes '10', '13' and '5' in that (string) order, holding the GRCz11 examples
+GOOD_LINES = [line('10', 100, 'NC_007121.7:g.100A>G'),
+              example_line(EXAMPLE_CASES['GRCz11'][2]),
+              line('10', 16027812, 'NC_007121.7:g.16027812A>G'),
+              example_line(EXAMPLE_CASES['GRCz11'][0]),
+              line('13', 50540200, 'NC_007124.7:g.50540200A>G'),
+              line('5', 5, 'NC_007116.7:g.5A>G'),
+              example_line(EXAMPLE_CASES['GRCz11'][1])]
+
+
+def write_vcf(directory, lines, indexed=False):
+    path = os.path.join(directory, 'GRCz11-3.1.0.vcf')
+    if indexed:
+        with IndexedVcfWriter(path) as vcf_file:
+            vcf_file.write(HEADER)
+            for data_line in lines:
+                vcf_file.write_record(data_line)
+        return path + '.gz'
+    with open(path, 'w') as vcf_file:
+        vcf_file.write(HEADER + ''.join(lines))
+    return path
+
+
+def validate(lines, indexed=False, full_scan=True):
+    with tempfile.TemporaryDirectory() as directory:
+        VcfValidator(write_vcf(directory, lines, indexed), full_scan).validate_vcf()
+
+
+def assert_fails(caplog, message, lines, indexed=False, full_scan=True):
+    caplog.clear()
+    with pytest.raises(SystemExit):
+        validate(lines, indexed, full_scan)
+    assert any(message in record.getMessage() for record in caplog.records if record.levelname == 'ERROR')
+
+
+def test_good_files_pass():
+    validate(GOOD_LINES)
+    validate(GOOD_LINES, indexed=True)
+    validate(GOOD_LINES, indexed=True, full_scan=False)
+
+
+def test_missing_example_fails(caplog):
+    for indexed in (False, True):
+        assert_fails(caplog, 'No matching VCF data found for example with id: NC_007116.7', GOOD_LINES[:-1], indexed)
+
+
+def test_mismatched_example_fails(caplog):
+    lines = list(GOOD_LINES)
+    lines[3] = lines[3].replace('\tC\tT\t', '\tC\tA\t')
+    for (indexed, full_scan) in ((False, True), (True, True), (True, False)):
+        assert_fails(caplog, 'key mismatch: ALT', lines, indexed, full_scan)
+
+
+def test_unsorted_chromosomes_fail(caplog):
+    assert_fails(caplog, 'Chromosomes not alphabetically sorted', GOOD_LINES[5:] + GOOD_LINES[:5])
+
+
+def test_unsorted_positions_fail(caplog):
+    lines = list(GOOD_LINES)
+    (lines[0], lines[1]) = (lines[1], lines[0])
+    assert_fails(caplog, 'Positions are not sorted', lines)
+
+
+def test_duplicate_ids_fail(caplog):
+    lines = list(GOOD_LINES)
+    lines.insert(5, line('13', 50540201, 'NC_007124.7:g.50540200A>G'))
+    assert_fails(caplog, 'At least one Duplicate entery', lines)
+
+
+def test_index_is_required_without_full_scan(caplog):
+    assert_fails(caplog, 'No tabix index', GOOD_LINES, full_scan=False)